@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+#    Copyright (C) 2015 Lance Linder
+#
+"""Size and render time of a template as pretty JSON, compact JSON and
+   Cloud Formation YAML with the pure Python and libyaml emitters.
+
+   Usage: python benchmarks/formats.py [INSTANCES]"""
+
+import sys
+import json
+import time
+import yaml
+
+from troposphere import Join, GetAZs, Select
+
+from troposphere_ext import template, cfyaml
+from troposphere_ext.ec2 import UserData, CloudConfig
+
+
+class PureDumper(yaml.SafeDumper):
+    """The YAML template dumper without libyaml"""
+
+    yaml_representers = cfyaml.TemplateDumper.yaml_representers
+
+    def ignore_aliases(self, data):
+        return True
+
+
+def build(count):
+    tpl = template('Bench')
+    tpl.security_group('Ssh', GroupDescription='ssh')
+    tpl.eip('Ip', Domain='vpc')
+    for i in range(count):
+        user_data = UserData('#!/bin/sh\n',
+                             '    |echo "configuring host {}"\n'.format(i),
+                             '    |ip=', tpl.tref('Ip'), '\n',
+                             '    |/opt/app/bin/start --ip "$ip"\n')
+        if i % 2:
+            user_data = CloudConfig({'runcmd': [
+                'echo host {}'.format(i), '/opt/app/bin/start'],
+                'packages': ['nginx', 'jq']})
+        tpl.instance('Host{:04d}'.format(i),
+                     ImageId='ami-12345678',
+                     SecurityGroupIds=[tpl.ref(tpl.get_resource('Ssh'))],
+                     AvailabilityZone=Select(i % 3, GetAZs('')),
+                     UserData=user_data)
+        tpl.output('Host{:04d}Ip'.format(i),
+                   Value=Join(':', [tpl.get_att('Host{:04d}'.format(i),
+                                                'PrivateIp'), '80']))
+    return tpl
+
+
+def timed(fn, repeat=5):
+    start = time.time()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.time() - start) * 1000 / repeat
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    tpl = build(count)
+    rendered = tpl.to_dict()
+
+    print 'Template with {} instances, dict already rendered:'.format(count)
+    print '  {:<20} {:>10} {:>10}'.format('format', 'size (KB)', 'dump (ms)')
+    for name, dump in [
+            ('JSON indent=2', lambda: json.dumps(
+                rendered, indent=2, sort_keys=True,
+                separators=(', ', ': '))),
+            ('JSON compact', lambda: json.dumps(
+                rendered, sort_keys=True, separators=(',', ':'))),
+            ('YAML pure Python', lambda: cfyaml.dumps(rendered,
+                                                      PureDumper)),
+            ('YAML libyaml', lambda: cfyaml.dumps(rendered))]:
+        body, elapsed = timed(dump)
+        print '  {:<20} {:>10.1f} {:>10.2f}'.format(name, len(body) / 1024.0,
+                                                    elapsed)
+
+    print
+    print 'End to end, including rendering:'
+    for name, render in [('to_json', tpl.to_json), ('to_yaml', tpl.to_yaml)]:
+        _, elapsed = timed(render)
+        print '  {:<20} {:>10.2f} ms'.format(name, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+#    Copyright (C) 2015 Lance Linder
+#
+"""Memory used by a template with thousands of resources before and
+   after the helper changes: reference helpers without __slots__ and
+   titles and tags that are not interned, the __slots__ helpers with
+   interning, and those helpers shared through Template.ref,
+   Template.tref and Template.get_att.
+
+   Usage: python benchmarks/memory.py [RESOURCES]"""
+
+import gc
+import sys
+import types
+import contextlib
+
+import troposphere
+from troposphere.ec2 import Tag
+
+from troposphere_ext import template, utils, TRef, TGetAtt, SRef
+
+SKIPPED = (type, types.ModuleType, types.FunctionType,
+           types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_size(root):
+    """Bytes reachable from root, counting every object once"""
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SKIPPED):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+class _DictTRef(troposphere.Ref):
+    """TRef as it was before, attributes in a __dict__"""
+
+    def __init__(self, resource):
+        self._resource = resource
+        self._resource_name = resource
+        self._title = resource
+        troposphere.Ref.__init__(self, resource)
+
+    JSONrepr = TRef.JSONrepr.im_func
+    get_ref = TRef.get_ref.im_func
+
+
+class _DictTGetAtt(troposphere.GetAtt):
+    """TGetAtt as it was before"""
+
+    __init__ = TGetAtt.__init__.im_func
+    JSONrepr = TGetAtt.JSONrepr.im_func
+    get_ref = TGetAtt.get_ref.im_func
+
+
+class _DictSRef(troposphere.AWSHelperFn):
+    """SRef as it was before"""
+
+    __init__ = SRef.__init__.im_func
+
+
+@contextlib.contextmanager
+def _interning(enabled):
+    intern_str = utils.intern_str
+    if not enabled:
+        utils.intern_str = lambda value: value
+    try:
+        yield
+    finally:
+        utils.intern_str = intern_str
+
+
+def build(count, slots, shared):
+    with _interning(slots):
+        tpl = template('Bench')
+        tpl.security_group('Ssh', GroupDescription='ssh')
+        tpl.internet_gateway('Igw')
+
+        if shared:
+            tref, get_att = tpl.tref, tpl.get_att
+        else:
+            tref = TRef if slots else _DictTRef
+            get_att = TGetAtt if slots else _DictTGetAtt
+
+        for i in range(count):
+            tpl.instance('Instance{}'.format(i),
+                         ImageId='ami-12345678',
+                         SecurityGroupIds=[tref('Ssh')],
+                         SubnetId=tref('Igw'),
+                         AvailabilityZone=get_att('Igw', 'AvailabilityZone'),
+                         Tags=[Tag('env', ''.join(['de', 'v']))])
+    return tpl
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    print 'Per helper instance (bytes):'
+    print '  {:<8} {:>8} {:>8}'.format('', 'before', 'after')
+    for before, after in [(_DictTRef('Igw'), TRef('Igw')),
+                          (_DictTGetAtt('Igw', 'Arn'), TGetAtt('Igw', 'Arn')),
+                          (_DictSRef('us-west-2', 'stack', 'Igw'),
+                           SRef('us-west-2', 'stack', 'Igw'))]:
+        print '  {:<8} {:>8} {:>8}'.format(type(after).__name__,
+                                           deep_size(before),
+                                           deep_size(after))
+
+    print
+    print 'Template with {} resources:'.format(count)
+    sizes = []
+    for label, slots, shared in [('before', False, False),
+                                 ('__slots__, interned', True, False),
+                                 ('shared helpers', True, True)]:
+        gc.collect()
+        sizes.append(deep_size(build(count, slots, shared)))
+        print '  {:<20} {:>8.1f} KB {:>6.1f} %'.format(
+            label, sizes[-1] / 1024.0,
+            100.0 * (sizes[-1] - sizes[0]) / sizes[0])
+
+
+if __name__ == '__main__':
+    main()
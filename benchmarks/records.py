@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+#
+#    Copyright (C) 2015 Lance Linder
+#
+"""Resource count, size and render time of a template with thousands of
+   Route 53 record sets with and without packing them into record set
+   groups.
+
+   Usage: python benchmarks/records.py [RECORDS]"""
+
+import sys
+import time
+
+from troposphere_ext import template, TRef
+
+
+def build(count, packed):
+    tpl = template('Bench').trusted().pack_records(packed)
+    tpl.eip('Ip', Domain='vpc')
+    for i in range(count):
+        zone = 'zone{}.example.com.'.format(i % 4)
+        tpl.record_set('Host{:05d}'.format(i), HostedZoneName=zone,
+                       Name='host{}.{}'.format(i, zone), Type='A',
+                       TTL='300', ResourceRecords=[
+                           TRef('Ip$') if i % 10 == 0
+                           else '10.{}.{}.{}'.format(i >> 16, i >> 8 & 255,
+                                                     i & 255)])
+    return tpl
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    print '{} record sets in 4 hosted zones:'.format(count)
+    for packed in [False, True]:
+        tpl = build(count, packed)
+        start = time.time()
+        body = tpl.to_json(indent=None, separators=(',', ':'))
+        elapsed = time.time() - start
+        resources = body.count('"Type":"AWS::')
+        print '  {:<10} {:>6} resources {:>8.1f} KB {:>8.0f} ms'.format(
+            'packed' if packed else 'one each', resources,
+            len(body) / 1024.0, elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main()
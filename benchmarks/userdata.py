@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+#    Copyright (C) 2015 Lance Linder
+#
+"""User data size and render time for plain and compressed UserData,
+   and CloudConfig rendering with the pure Python and libyaml dumpers.
+
+   Usage: python benchmarks/userdata.py"""
+
+import json
+import time
+import yaml
+
+import troposphere
+
+from troposphere_ext import template, TRef
+from troposphere_ext.ec2 import UserData, CloudConfig
+from troposphere_ext import ec2
+
+# stands in for the value Cloud Formation substitutes for a Ref
+REF_VALUE = 'eipalloc-0123456789abcdef0'
+
+
+def script(size):
+    lines = []
+    i = 0
+    while sum(len(l) for l in lines) < size:
+        lines.append('    |echo "configuring component {0}" && '
+                     'install -m 0644 /tmp/component-{0}.conf '
+                     '/etc/app/conf.d/\n'.format(i))
+        i += 1
+    return ''.join(lines)
+
+
+def user_data_size(rendered):
+    """Bytes of user data EC2 receives once Cloud Formation has
+       resolved the intrinsic functions, before base64 encoding"""
+    join = rendered['Fn::Base64']['Fn::Join'][1]
+    return sum(len(p) if isinstance(p, basestring) else len(REF_VALUE)
+               for p in join)
+
+
+def timed(fn, repeat=20):
+    start = time.time()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.time() - start) * 1000 / repeat
+
+
+def encode(obj):
+    return json.loads(json.dumps(obj, cls=troposphere.awsencode))
+
+
+def main():
+    tpl = template('Bench')
+    tpl.eip('Ip', Domain='vpc')
+
+    body = script(14 * 1024)
+    print 'UserData with a {:.1f} KB script and 6 Refs:'.format(
+        len(body) / 1024.0)
+    print '  {:<12} {:>10} {:>12} {:>12}'.format(
+        'mode', 'size (KB)', 'first (ms)', 'cached (ms)')
+    for compress in (False, True):
+        ec2._rendered.clear()
+        n = len(body) / 6 + 1
+        args = [x for i in range(6)
+                for x in (body[i * n:(i + 1) * n], TRef('Ip'))]
+        user_data = UserData('#!/bin/sh\n', args, compress=compress)
+        rendered, first = timed(lambda: encode(user_data), repeat=1)
+        _, cached = timed(lambda: encode(user_data))
+        print '  {:<12} {:>10.1f} {:>12.2f} {:>12.2f}'.format(
+            'gzip+mime' if compress else 'plain',
+            user_data_size(rendered) / 1024.0, first, cached)
+
+    config = {'write_files': [{'path': '/etc/app/{}.conf'.format(i),
+                               'content': body[:512]} for i in range(20)],
+              'packages': ['pkg{}'.format(i) for i in range(50)]}
+    print
+    print 'CloudConfig yaml.dump ({} entries):'.format(
+        len(config['write_files']) + len(config['packages']))
+    for name, dumper in (('Dumper', yaml.Dumper),
+                         ('CDumper', getattr(yaml, 'CDumper', None))):
+        if dumper is None:
+            print '  {:<12} not available'.format(name)
+            continue
+        _, elapsed = timed(lambda: yaml.dump(config, Dumper=dumper,
+                                             default_flow_style=False))
+        print '  {:<12} {:>8.2f} ms'.format(name, elapsed)
+
+    ec2._rendered.clear()
+    cloud_config = CloudConfig(config)
+    _, first = timed(lambda: encode(cloud_config), repeat=1)
+    _, cached = timed(lambda: encode(cloud_config))
+    print '  {:<12} {:>8.2f} ms'.format('first render', first)
+    print '  {:<12} {:>8.2f} ms'.format('cached', cached)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+#    Copyright (C) 2015 Lance Linder
+#
+"""Time to generate a template for many environments by running the
+   template function for each one versus deriving variants of a single
+   build.
+
+   Usage: python benchmarks/variants.py [ENVIRONMENTS]"""
+
+import sys
+import time
+
+from troposphere_ext import template, TRef
+from troposphere_ext.ec2 import UserData, CloudConfig
+
+
+def build(name, cidr='10.0.0.0/16'):
+    tpl = template(name)
+    tpl.trusted()
+    tpl.vpc('Vpc', CidrBlock=cidr)
+    tpl.security_group('Web', GroupDescription='web', VpcId=TRef('Vpc$'))
+    for i in range(100):
+        tpl.instance('Host{:03d}'.format(i),
+                     ImageId='ami-12345678',
+                     SecurityGroupIds=[TRef('Web$')],
+                     UserData=UserData('#!/bin/sh\n',
+                                       'echo "host {}"\n'.format(i))
+                     if i % 2 else CloudConfig({'runcmd': [
+                         'echo host {}'.format(i)]}))
+    return tpl
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    names = ['Env{:02d}'.format(i) for i in range(count)]
+
+    start = time.time()
+    for name in names:
+        build(name, '10.{}.0.0/16'.format(len(name))).to_json()
+    rebuilt = time.time() - start
+
+    start = time.time()
+    base = build('Base')
+    for name in names:
+        base.variant(name, properties={'Vpc': {
+            'CidrBlock': '10.{}.0.0/16'.format(len(name))}}).to_json()
+    derived = time.time() - start
+
+    print '{} environments of a 102 resource template:'.format(count)
+    print '  {:<20} {:>8.0f} ms'.format('build each', rebuilt * 1000)
+    print '  {:<20} {:>8.0f} ms'.format('variants of one', derived * 1000)
+    print '  {:<20} {:>8.1f} x'.format('speedup', rebuilt / derived)
+
+
+if __name__ == '__main__':
+    main()
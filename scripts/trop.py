@@ -9,8 +9,25 @@ import argparse
 import logging
 import os
 import yaml
+import socket
+import difflib
+import json
 
 from troposphere_ext.utils import Tropext
+from troposphere_ext.graph import DependencyGraph, DURATIONS
+from troposphere_ext.history import History, DEFAULT_DATABASE, percentile
+from troposphere_ext import utils
+from troposphere_ext.storage import S3Storage, ArtifactStore
+from troposphere_ext.fanout import FanOut, succeeded
+from troposphere_ext import api
+from troposphere_ext.timeline import Timeline, last_operation, root_causes
+from troposphere_ext.daemon import TropextServer, TropextClient
+from troposphere_ext.daemon import DEFAULT_SOCKET, Event
+from troposphere_ext.snapshot import Snapshot, default_path
+from troposphere_ext.teardown import Teardown, waves, excluding
+from troposphere_ext.deploy import Manifest, Deploy
+from troposphere_ext.deploy import waves as deploy_waves
+from troposphere_ext import SRef
 
 log = logging.getLogger('tropext')
 log.addHandler(logging.StreamHandler())
@@ -20,8 +37,20 @@ def generate(args):
     log.info('Starting template generate command.')
 
     try:
-        trop = Tropext(log, args.stack, args.namespace, args.region)
-        print trop.generate(args.template, args.template_args)
+        if args.output is not None and args.format != 'json':
+            log.error('Artifacts are written as JSON, --output only '
+                      'supports --format json.')
+            return 1
+        trop = Tropext(log, args.stack, args.namespace, args.region,
+                       artifacts=__artifacts(args.output))
+        if args.watch_files:
+            return __watch_files(trop, args)
+        template = trop.generate(args.template, args.template_args,
+                                 not args.no_validate, args.format)
+        if template is None:
+            return 1
+        if args.output is None:
+            print template
         return 0
     except:
         log.exception('Unexpected error while generating "{}" template'
@@ -29,10 +58,99 @@ def generate(args):
         return 1
 
 
+def validate(args):
+    log.info('Starting template validate command.')
+
+    try:
+        trop = Tropext(log, args.stack, args.namespace, args.region)
+        template = trop.generate(args.template, args.template_args, False)
+        if template is None:
+            return 1
+        errors = trop.validate(template)
+        for error in errors:
+            print error
+        return 1 if errors else 0
+    except:
+        log.exception('Unexpected error while validating "{}" template'
+                      .format(args.template))
+        return 1
+
+
+def __artifacts(directory):
+    return None if directory is None else ArtifactStore(directory)
+
+
+def __watch_files(trop, args):
+    previous = None
+    try:
+        for current in trop.watch_files(args.template, args.template_args,
+                                        validate=not args.no_validate,
+                                        format=args.format):
+            if current is not None and args.output is None:
+                if args.diff and previous is not None:
+                    print '\n'.join(difflib.unified_diff(
+                        previous.splitlines(), current.splitlines(),
+                        fromfile='previous', tofile='current',
+                        lineterm=''))
+                else:
+                    print current
+                previous = current
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def graph(args):
+    log.info('Starting template graph command.')
+
+    try:
+        trop = Tropext(log, args.stack, args.namespace, args.region)
+        template = trop.generate(args.template, args.template_args, False)
+        if template is None:
+            return 1
+        dependencies = DependencyGraph(json.loads(template))
+        durations = DURATIONS
+        if args.from_history:
+            durations = dict(DURATIONS, **History(args.history).durations())
+
+        if args.format == 'dot':
+            print dependencies.to_dot(durations)
+        elif args.format == 'json':
+            print dependencies.to_json(durations)
+        else:
+            total, path = dependencies.critical_path(durations)
+            print 'Resources: {}'.format(len(dependencies.nodes))
+            print 'Depth: {}'.format(dependencies.depth())
+            print 'Critical path: ~{}s'.format(total)
+            for title in path:
+                print '  {} ({}) {}s'.format(
+                    title, dependencies.resource_type(title),
+                    dependencies.duration(title, durations))
+            redundant = dependencies.redundant_depends_on()
+            if redundant:
+                print 'Redundant DependsOn:'
+                for title, target in redundant:
+                    print '  {} -> {}'.format(title, target)
+        return 0
+    except:
+        log.exception('Unexpected error while graphing "{}" template'
+                      .format(args.template))
+        return 1
+
+
 def create(args):
     log.info('Starting stack create command.')
+    if args.regions:
+        return __fan_out(args, __deploy(args, lambda tropext: tropext.create(
+            args.creator, args.template, dict(args.template_args),
+            args.template_params)))
+
     try:
-        tropext = Tropext(log, args.stack, args.namespace, args.region)
+        tropext = Tropext(log, args.stack, args.namespace, args.region,
+                          storage=__storage(args),
+                          artifacts=__artifacts(args.artifacts),
+                          from_artifacts=args.artifacts is not None)
         stack_id = tropext.create(args.creator, args.template,
                                   args.template_args, args.template_params)
 
@@ -42,7 +160,8 @@ def create(args):
 
             if args.watch:
                 __watch(args.no_color, args.stack,
-                        args.namespace, args.region, False)
+                        args.namespace, args.region, False,
+                        fail_fast=args.fail_fast)
 
             return 0
         else:
@@ -57,8 +176,15 @@ def create(args):
 
 def update(args):
     log.info('Starting stack update command.')
+    if args.regions:
+        return __fan_out(args, __deploy(args, lambda tropext: tropext.update(
+            args.template, dict(args.template_args), args.template_params)))
+
     try:
-        tropext = Tropext(log, args.stack, args.namespace, args.region)
+        tropext = Tropext(log, args.stack, args.namespace, args.region,
+                          storage=__storage(args),
+                          artifacts=__artifacts(args.artifacts),
+                          from_artifacts=args.artifacts is not None)
         stack_id = tropext.update(args.template, args.template_args,
                                   args.template_params)
 
@@ -68,7 +194,7 @@ def update(args):
 
             if args.watch:
                 __watch(args.no_color, args.stack, args.namespace,
-                        args.region, False)
+                        args.region, False, fail_fast=args.fail_fast)
 
             return 0
         else:
@@ -81,23 +207,228 @@ def update(args):
         return 1
 
 
+def deploy(args):
+    log.info('Starting manifest deploy command.')
+
+    try:
+        manifest = Manifest.load(args.manifest)
+        args.region = manifest.region
+        orchestrator = Deploy(log, manifest, args.creator, args.parallel,
+                              args.fail_fast, __storage(args), args.state)
+        planned = deploy_waves(orchestrator.plan())
+        start = 0 if args.restart else orchestrator.resume(planned)
+
+        for i, wave in enumerate(planned):
+            print 'Wave {}: {}{}'.format(i + 1, ', '.join(wave),
+                                         ' (done)' if i < start else '')
+        if args.dry_run:
+            return 0
+        if start:
+            log.warn('Resuming from wave {}'.format(start + 1))
+    except (IOError, ValueError) as e:
+        log.error(str(e))
+        return 1
+
+    try:
+        for stack_name, kind, value in orchestrator.run(planned, start):
+            if kind == 'wave':
+                print 'Deploying wave {}: {}'.format(
+                    value + 1, ', '.join(planned[value]))
+            elif kind == 'event':
+                __print_event(args.no_color, value, stack_name)
+    except KeyboardInterrupt:
+        pass
+
+    stacks = [name for wave in planned[start:] for name in wave]
+    if not stacks:
+        return 0
+    width = max(len(name) for name in stacks)
+    print 'Summary:'
+    for name in stacks:
+        ok, detail = orchestrator.results.get(name, (False, 'interrupted'))
+        print '  {} {:<6} {}'.format(name.ljust(width),
+                                     'OK' if ok else 'FAILED', detail)
+
+    return 0 if all(orchestrator.results.get(name, (False,))[0]
+                    for name in stacks) else 1
+
+
+def __deploy(args, deploy):
+    """Returns a fan out task that starts a deploy in a region and
+       watches it to the end with --watch or --canary"""
+    def _task(tropext, emit):
+        stack_id = deploy(tropext)
+        if stack_id is None:
+            return False, 'not started, see the log'
+        emit('output', 'Started stack "{}"'.format(stack_id))
+        if not (args.watch or args.canary):
+            return True, stack_id
+
+        events = []
+        for e in tropext.watch(False, args.fail_fast):
+            emit('event', e)
+            events.append(e)
+        causes = root_causes(last_operation(events, tropext.fq_stack_name))
+        if causes:
+            return False, '{} ({} {})'.format(
+                tropext.status(), causes[0].logical_resource_id,
+                causes[0].resource_status_reason)
+        status = tropext.final_status()
+        return succeeded(status), status
+    return _task
+
+
+def __fan_out(args, task):
+    fan_out = FanOut(log, args.stack, args.namespace, args.regions,
+                     args.parallel, args.canary,
+                     lambda region: __storage(args, region),
+                     __artifacts(args.artifacts), args.artifacts is not None)
+    no_color = getattr(args, 'no_color', False)
+    try:
+        for region, kind, value in fan_out.run(task):
+            if kind == 'event':
+                __print_event(no_color, value, region)
+            elif kind == 'output':
+                for line in value.splitlines():
+                    print '[{}] {}'.format(region, line)
+    except KeyboardInterrupt:
+        pass
+
+    width = max(len(region) for region in args.regions)
+    print 'Summary:'
+    for region in args.regions:
+        ok, detail = fan_out.results.get(region, (False, 'interrupted'))
+        print '  {} {:<6} {}'.format(region.ljust(width),
+                                     'OK' if ok else 'FAILED', detail)
+
+    return 0 if all(fan_out.results.get(region, (False,))[0]
+                    for region in args.regions) else 1
+
+
+def __storage(args, region=None):
+    if getattr(args, 'template_bucket', None) is None:
+        return None
+    region = args.region if region is None else region
+    # a bucket name can hold a {region} placeholder for per region buckets
+    return S3Storage(args.template_bucket.format(region=region),
+                     region=region)
+
+
 def delete(args):
     log.info('Starting stack delete command.')
-    return 0
+
+    try:
+        teardown = Teardown(log, args.namespace, args.region,
+                            utils.connect(args.region), args.parallel,
+                            history=utils._history)
+        names = teardown.stacks()
+        # matched by name only, they could belong to a longer namespace
+        untagged = sorted(set(teardown.stacks(True)) - set(names))
+        references = teardown.plan(names + untagged)
+        if args.stack is not None:
+            stack_name = '{}-{}'.format(args.namespace, args.stack)
+            if stack_name not in references:
+                log.warn("Stack '{}' doesn't exist.".format(stack_name))
+                return 1
+            dependents = sorted(name for name, targets
+                                in references.iteritems()
+                                if stack_name in targets)
+            if dependents and not args.force:
+                log.error("Stack '{}' is referenced by {}, use --force to "
+                          "delete it anyway.".format(stack_name,
+                                                     ', '.join(dependents)))
+                return 1
+            references = {stack_name: set()}
+        elif untagged:
+            log.warn("Stacks {} have no namespace tag and may belong to "
+                     "another namespace, they and the stacks they reference "
+                     "are left alone. Delete them with --stack."
+                     .format(', '.join(untagged)))
+            references = excluding(references, untagged)
+
+        for i, wave in enumerate(waves(references)):
+            print 'Wave {}: {}'.format(i + 1, ', '.join(wave))
+        if args.dry_run:
+            return 0
+        if len(references) > 1 and not args.yes:
+            log.error('Deleting {} stacks, use --yes to confirm.'
+                      .format(len(references)))
+            return 1
+
+        for stack_name, kind, value in teardown.run(references):
+            if kind == 'event':
+                __print_event(args.no_color, value, stack_name)
+
+        width = max([len(name) for name in teardown.results] or [0])
+        print 'Summary:'
+        for stack_name, result in sorted(teardown.results.iteritems(),
+                                         key=lambda r: r[1]['seconds']):
+            print '  {} {:<15} {:>6} {}'.format(
+                stack_name.ljust(width), result['status'],
+                __seconds(result['seconds']), result['reason'] or '')
+        return 0 if all(r['status'] == 'DELETE_COMPLETE'
+                        for r in teardown.results.itervalues()) else 1
+    except Exception as e:
+        log.exception('Stack delete failed with unexpected error: "{}"'
+                      .format(str(e)))
+        return 1
 
 
 def watch(args):
     log.info('Starting stack event watch command.')
 
-    result = __watch(args.no_color, args.stack, args.namespace, args.region)
+    result = __watch(args.no_color, args.stack, args.namespace, args.region,
+                     timeline=args.timeline)
     return 0 if result else 1
 
 
+def timeline(args):
+    log.info('Starting stack timeline command.')
+
+    try:
+        tropext = Tropext(log, args.stack, args.namespace, args.region)
+        events = last_operation(tropext.get_events(),
+                                tropext.fq_stack_name)
+        try:
+            graph = DependencyGraph(json.loads(tropext.get_template()))
+        except Exception:
+            log.warn('Unable to get the stack template, the critical path '
+                     'is estimated from event times only.')
+            graph = None
+
+        stack_timeline = Timeline(events, tropext.fq_stack_name)
+        if args.format == 'json':
+            print stack_timeline.to_json(graph)
+        else:
+            print stack_timeline.gantt(args.width, graph)
+        return 0
+    except Exception as e:
+        log.exception('Building the stack timeline failed with '
+                      'unexpected error: "{}"'.format(str(e)))
+        return 1
+
+
 def diff(args):
     log.info('Starting stack diff command.')
+    if args.regions:
+        def _diff(tropext, emit):
+            diff_result = tropext.diff(args.template,
+                                       dict(args.template_args))
+            if diff_result is None:
+                return False, 'not diffed, see the log'
+            if diff_result:
+                emit('output', '\n'.join(diff_result))
+            return True, 'differs' if diff_result else 'no changes'
+
+        return __fan_out(args, _diff)
+
     try:
-        tropext = Tropext(log, args.stack, args.namespace, args.region)
+        tropext = Tropext(log, args.stack, args.namespace, args.region,
+                          artifacts=__artifacts(args.artifacts),
+                          from_artifacts=args.artifacts is not None)
         diff_result = tropext.diff(args.template, args.template_args)
+        if diff_result is None:
+            return 1
         if len(diff_result) is 0:
             log.warn('Current template does not differ from '
                      'previous stack template.')
@@ -111,67 +442,240 @@ def diff(args):
         return 1
 
 
+def history(args):
+    log.info('Starting stack history command.')
+
+    try:
+        store = History(args.history)
+        filters = dict(namespace=args.namespace, stack=args.stack,
+                       region=args.region, since=args.since)
+        types = store.resource_types(**filters)
+        deploys = store.deploys(**filters)
+
+        if args.format == 'json':
+            print json.dumps({
+                'resource_types': dict(
+                    (t, {'count': s['count'], 'failed': s['failed'],
+                         'p50': percentile(s['durations'], 50),
+                         'p95': percentile(s['durations'], 95)})
+                    for t, s in types.iteritems()),
+                'deploys': deploys}, indent=2, sort_keys=True)
+            return 0
+
+        print '{:<48} {:>6} {:>7} {:>7} {:>7}'.format(
+            'resource type', 'count', 'p50', 'p95', 'failed')
+        for resource_type, stats in sorted(types.iteritems()):
+            print '{:<48} {:>6} {:>7} {:>7} {:>6.1f}%'.format(
+                resource_type, stats['count'],
+                __seconds(percentile(stats['durations'], 50)),
+                __seconds(percentile(stats['durations'], 95)),
+                100.0 * stats['failed'] / stats['count'])
+        print
+        print 'Deploys:'
+        for deploy in deploys:
+            print '  {start} {namespace}-{stack} {region} {operation} ' \
+                  '{duration:.0f}s {status}'.format(**deploy)
+        return 0
+    except Exception as e:
+        log.exception('Querying the stack history failed with '
+                      'unexpected error: "{}"'.format(str(e)))
+        return 1
+
+
+def snapshot(args):
+    log.info('Starting stack snapshot command.')
+
+    path = args.output or default_path(args.namespace, args.region)
+    try:
+        conn = utils.connect(args.region)
+        if args.check:
+            stale = Snapshot.load(path).stale(conn)
+            for stack in stale:
+                print '{} changed since the snapshot'.format(stack)
+            return 1 if stale else 0
+
+        captured = Snapshot.capture(conn, args.namespace, args.region,
+                                    args.parallel)
+        captured.save(path)
+        log.info('Saved {} stacks to "{}".'
+                 .format(len(captured.stacks), path))
+        return 0
+    except Exception as e:
+        log.exception('Stack snapshot failed with unexpected error: '
+                      '"{}"'.format(str(e)))
+        return 1
+
+
+def __use_snapshots(paths, check):
+    """Resolves SRefs from the snapshots, returns False when asked to
+       check them and one is stale"""
+    fresh = True
+    for path in paths:
+        try:
+            loaded = Snapshot.load(path)
+        except (IOError, ValueError) as e:
+            log.error('Unable to load snapshot "{}": {}'.format(path, e))
+            return False
+        SRef.use_snapshot(loaded)
+        if check:
+            stale = loaded.stale(utils.connect(loaded.region))
+            if stale:
+                log.error('Snapshot "{}" is stale, changed since {}: {}'
+                          .format(path, loaded.created, ', '.join(stale)))
+                fresh = False
+    return fresh
+
+
+def __seconds(value):
+    return '-' if value is None else '{:.0f}s'.format(value)
+
+
 def cost(args):
     log.info('Starting calculate stack costs command.')
 
     return 0
 
 
-def __watch(no_color, stack_name, namespace, region, fetch=True):
+def __watch(no_color, stack_name, namespace, region, fetch=True,
+            timeline=False, fail_fast=False):
+    events = []
+    tropext = None
     try:
-        color_map = {
-            'CREATE_IN_PROGRESS': '\033[93m',
-            'CREATE_FAILED': '\033[91m',
-            'CREATE_COMPLETE': '\033[92m',
-            'UPDATE_IN_PROGRESS': '\033[93m',
-            'UPDATE_FAILED': '\033[91m',
-            'UPDATE_COMPLETE': '\033[92m',
-            'UPDATE_ROLLBACK_IN_PROGRESS': '\033[93m',
-            'UPDATE_ROLLBACK_FAILED': '\033[91m',
-            'UPDATE_ROLLBACK_COMPLETE': '\033[92m',
-            'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS': '\033[93m',
-            'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS': '\033[93m',
-            'DELETE_IN_PROGRESS': '\033[93m',
-            'DELETE_FAILED': '\033[91m',
-            'DELETE_COMPLETE': '\033[92m',
-            'ROLLBACK_IN_PROGRESS': '\033[93m',
-            'ROLLBACK_FAILED': '\033[91m',
-            'ROLLBACK_COMPLETE': '\033[92m'
-        }
-
         tropext = Tropext(log, stack_name, namespace, region)
-        for e in tropext.watch(fetch):
-            if no_color:
-                if 'FAILED' in e.resource_status:
-                    print ('[{}] {} {} {} {}'
-                           .format(e.timestamp, e.resource_status,
-                                   e.resource_type, e.logical_resource_id,
-                                   e.resource_status_reason))
-                else:
-                    print ('[{}] {} {} {}'
-                           .format(e.timestamp, e.resource_status,
-                                   e.resource_type, e.logical_resource_id))
-            else:
-                if 'FAILED' in e.resource_status:
-                    print ('{}[{}] {} {} {} {}{}'
-                           .format(color_map[e.resource_status], e.timestamp,
-                                   e.resource_status, e.resource_type,
-                                   e.logical_resource_id,
-                                   e.resource_status_reason, '\033[0m'))
-                else:
-                    print ('{}[{}] {} {} {}{}'
-                           .format(color_map[e.resource_status], e.timestamp,
-                                   e.resource_status, e.resource_type,
-                                   e.logical_resource_id, '\033[0m'))
+        for e in tropext.watch(fetch, fail_fast):
+            __print_event(no_color, e)
+            events.append(e)
 
+    except KeyboardInterrupt:
+        # still show the timeline of what has been seen so far
+        pass
     except Exception as e:
         log.exception('Watching stack events failed with '
                       'unexpected error: "{}"'.format(str(e)))
         return False
+    finally:
+        name = None if tropext is None else tropext.fq_stack_name
+        if timeline:
+            print
+            print Timeline(last_operation(events, name), name).gantt()
+        if fail_fast:
+            __print_root_causes(last_operation(events, name))
 
     return True
 
 
+def __print_root_causes(events):
+    causes = root_causes(events)
+    if not causes:
+        return
+    print
+    print 'Root cause:'
+    for e in causes:
+        print '  [{}] {} {} {}: {}'.format(
+            e.timestamp, e.logical_resource_id, e.resource_type,
+            e.resource_status, e.resource_status_reason)
+
+
+def __print_event(no_color, e, label=None):
+    color_map = {
+        'CREATE_IN_PROGRESS': '\033[93m',
+        'CREATE_FAILED': '\033[91m',
+        'CREATE_COMPLETE': '\033[92m',
+        'UPDATE_IN_PROGRESS': '\033[93m',
+        'UPDATE_FAILED': '\033[91m',
+        'UPDATE_COMPLETE': '\033[92m',
+        'UPDATE_ROLLBACK_IN_PROGRESS': '\033[93m',
+        'UPDATE_ROLLBACK_FAILED': '\033[91m',
+        'UPDATE_ROLLBACK_COMPLETE': '\033[92m',
+        'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS': '\033[93m',
+        'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS': '\033[93m',
+        'DELETE_IN_PROGRESS': '\033[93m',
+        'DELETE_FAILED': '\033[91m',
+        'DELETE_COMPLETE': '\033[92m',
+        'ROLLBACK_IN_PROGRESS': '\033[93m',
+        'ROLLBACK_FAILED': '\033[91m',
+        'ROLLBACK_COMPLETE': '\033[92m'
+    }
+
+    prefix = '' if label is None else '[{}] '.format(label)
+
+    if no_color:
+        if 'FAILED' in e.resource_status:
+            print ('{}[{}] {} {} {} {}'
+                   .format(prefix, e.timestamp, e.resource_status,
+                           e.resource_type, e.logical_resource_id,
+                           e.resource_status_reason))
+        else:
+            print ('{}[{}] {} {} {}'
+                   .format(prefix, e.timestamp, e.resource_status,
+                           e.resource_type, e.logical_resource_id))
+    else:
+        if 'FAILED' in e.resource_status:
+            print ('{}{}[{}] {} {} {} {}{}'
+                   .format(prefix, color_map[e.resource_status], e.timestamp,
+                           e.resource_status, e.resource_type,
+                           e.logical_resource_id,
+                           e.resource_status_reason, '\033[0m'))
+        else:
+            print ('{}{}[{}] {} {} {}{}'
+                   .format(prefix, color_map[e.resource_status], e.timestamp,
+                           e.resource_status, e.resource_type,
+                           e.logical_resource_id, '\033[0m'))
+
+
+def serve(args):
+    log.info('Starting trop daemon on "{}".'.format(args.socket))
+
+    try:
+        server = TropextServer(log, args.socket)
+    except socket.error as e:
+        log.error('Unable to start trop daemon on "{}": {}'
+                  .format(args.socket, e.strerror or str(e)))
+        return 1
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+def remote(args):
+    log.info('Forwarding command to trop daemon on "{}".'
+             .format(args.remote))
+
+    command = args.func.__name__
+    request = dict(stack=args.stack, namespace=args.namespace,
+                   region=args.region)
+    if command == 'watch':
+        request['fetch'] = True
+    else:
+        request['template'] = args.template
+        request['template_args'] = args.template_args
+    if command == 'generate':
+        request['format'] = args.format
+
+    try:
+        client = TropextClient(args.remote)
+        for message in client.request(command, **request):
+            if 'output' in message:
+                print message['output']
+            elif 'event' in message:
+                __print_event(args.no_color, Event(**message['event']))
+            elif 'status' in message:
+                if 'error' in message:
+                    log.error(message['error'])
+                return message['status']
+    except socket.error as e:
+        log.error('Unable to reach trop daemon on "{}": {}'
+                  .format(args.remote, str(e)))
+
+    return 1
+
+
 def main():
     def is_valid_dir(parser, arg):
         if not os.path.isdir(arg):
@@ -186,6 +690,28 @@ def main():
                    help='Print debug logs')
     p.add_argument('-v', '--verbose', action='store_const', dest='log_level',
                    const=logging.INFO, help='Print info logs')
+    p.add_argument('--remote', nargs='?', const=DEFAULT_SOCKET,
+                   metavar='SOCKET',
+                   help='Forward generate, diff and watch commands to a '
+                        'running trop daemon.')
+
+    p.add_argument('--history', default=DEFAULT_DATABASE, metavar='PATH',
+                   help='SQLite database stack events are recorded to.')
+    p.add_argument('--no-history', dest='no_history', action='store_true',
+                   help='Do not record stack events.')
+    p.add_argument('--api-stats', dest='api_stats', action='store_true',
+                   help='Print Cloud Formation API call, retry and latency '
+                        'counters on exit.')
+
+    p.add_argument('--snapshot', action='append', default=[],
+                   metavar='PATH',
+                   help='Resolve cross stack references from a snapshot '
+                        'taken with the snapshot command instead of the '
+                        'API, once per region.')
+    p.add_argument('--check-snapshot', dest='check_snapshot',
+                   action='store_true',
+                   help='Fail when a stack changed after its snapshot '
+                        'was taken.')
 
     sp = p.add_subparsers()
 
@@ -204,10 +730,58 @@ def main():
                     help='AWS Cloud Formation region to creat the stack in.')
     pg.add_argument('--template-args', '-a', type=yaml.load, default=dict(),
                     help='AWS Cloud Formation stack factory arguments.')
-    # pg.add_argument('--output', '-o', default='/tmp',
-    #                 type=lambda x: is_valid_dir(parser, x),
-    #                 metavar='DIRECTORY',
-    #                 help='Cloud Formation JSON output location.')
+    pg.add_argument('--watch-files', dest='watch_files', action='store_true',
+                    help='Regenerate every time the template module or '
+                         'one of its local imports changes.')
+    pg.add_argument('--diff', action='store_true',
+                    help='With --watch-files print a diff against the '
+                         'previous output instead of the full template.')
+    pg.add_argument('--no-validate', dest='no_validate', action='store_true',
+                    help='Skip the offline template validation.')
+    pg.add_argument('--output', '-o', metavar='DIRECTORY',
+                    help='Write the template to REGION/NAMESPACE-STACK.json '
+                         'in this artifact directory instead of printing '
+                         'it. Unchanged templates are not rewritten.')
+    pg.add_argument('--format', '-f', choices=['json', 'yaml'],
+                    default='json',
+                    help='Template output format, YAML uses short form '
+                         'intrinsic functions.')
+
+    # validate
+    pg = sp.add_parser('validate',
+                       help='Validates the Cloud Formation template from '
+                            'Troposphere DSL offline.')
+    pg.set_defaults(func=validate)
+    pg.add_argument('template', help='Troposphere DSL to execute')
+    pg.add_argument('--stack', '-s', required=True, metavar='STACK_NAME',
+                    help='AWS Cloud Formation stack name.')
+    pg.add_argument('--namespace', '-n', required=True,
+                    help='AWS Cloud Formation stack name namespace prefix.')
+    pg.add_argument('--region', '-r', default='us-west-2',
+                    help='AWS Cloud Formation region.')
+    pg.add_argument('--template-args', '-a', type=yaml.load, default=dict(),
+                    help='AWS Cloud Formation stack factory arguments.')
+
+    # graph
+    pg = sp.add_parser('graph',
+                       help='Prints the resource dependency graph, its '
+                            'depth and critical path.')
+    pg.set_defaults(func=graph)
+    pg.add_argument('template', help='Troposphere DSL to execute')
+    pg.add_argument('--stack', '-s', required=True, metavar='STACK_NAME',
+                    help='AWS Cloud Formation stack name.')
+    pg.add_argument('--namespace', '-n', required=True,
+                    help='AWS Cloud Formation stack name namespace prefix.')
+    pg.add_argument('--region', '-r', default='us-west-2',
+                    help='AWS Cloud Formation region.')
+    pg.add_argument('--template-args', '-a', type=yaml.load, default=dict(),
+                    help='AWS Cloud Formation stack factory arguments.')
+    pg.add_argument('--format', '-f', choices=['text', 'dot', 'json'],
+                    default='text', help='Output format.')
+    pg.add_argument('--from-history', dest='from_history',
+                    action='store_true',
+                    help='Weight the critical path with the median '
+                         'durations recorded in the stack history.')
 
     # create
     pg = sp.add_parser('create',
@@ -224,8 +798,19 @@ def main():
     pg.add_argument('--creator', '-c',
                     help='The creator (username) used for tagging the '
                          'newly created stack.')
-    pg.add_argument('--region', '-r', required=True,
-                    help='AWS Cloud Formation region to creat the stack in.')
+    region = pg.add_mutually_exclusive_group(required=True)
+    region.add_argument('--region', '-r',
+                        help='AWS Cloud Formation region to creat the stack '
+                             'in.')
+    region.add_argument('--regions', type=lambda v: v.split(','),
+                        metavar='REGION,...',
+                        help='Deploy to several regions concurrently.')
+    pg.add_argument('--parallel', type=int, default=4,
+                    help='With --regions the number of regions deployed '
+                         'at once.')
+    pg.add_argument('--canary', action='store_true',
+                    help='With --regions deploy to the first region and '
+                         'only continue with the rest if it succeeds.')
     pg.add_argument('--template-args', '-a', type=yaml.load, default=dict(),
                     help='AWS Cloud Formation stack factory arguments.')
     pg.add_argument('--template-params', '-p', type=yaml.load, default=dict(),
@@ -234,9 +819,17 @@ def main():
                     help='AWS Cloud Formation stack parameters.')
     pg.add_argument('--no-color', dest='no_color', action='store_true',
                     help='AWS Cloud Formation stack name namespace prefix.')
-    # pg.add_argument('--output', '-o', default='/tmp',
-    #    type=lambda x: is_valid_dir(parser, x), metavar='DIRECTORY',
-    #    help='Cloud Formation JSON output location.')
+    pg.add_argument('--fail-fast', dest='fail_fast', action='store_true',
+                    help='With --watch cancel an update, or stop waiting '
+                         'for a create, on the first failed resource.')
+    pg.add_argument('--template-bucket', dest='template_bucket',
+                    metavar='BUCKET',
+                    help='Upload the template to this S3 bucket under a '
+                         'content hash key and pass it as a TemplateURL.')
+    pg.add_argument('--artifacts', metavar='DIRECTORY',
+                    help='Use the template written to this artifact '
+                         'directory by generate --output instead of '
+                         'generating it again.')
 
     # update
     pg = sp.add_parser('update',
@@ -250,8 +843,19 @@ def main():
                     help='AWS Cloud Formation stack name.')
     pg.add_argument('--namespace', '-n', required=True,
                     help='AWS Cloud Formation stack name namespace prefix.')
-    pg.add_argument('--region', '-r', required=True,
-                    help='AWS Cloud Formation region to creat the stack in.')
+    region = pg.add_mutually_exclusive_group(required=True)
+    region.add_argument('--region', '-r',
+                        help='AWS Cloud Formation region to creat the stack '
+                             'in.')
+    region.add_argument('--regions', type=lambda v: v.split(','),
+                        metavar='REGION,...',
+                        help='Deploy to several regions concurrently.')
+    pg.add_argument('--parallel', type=int, default=4,
+                    help='With --regions the number of regions deployed '
+                         'at once.')
+    pg.add_argument('--canary', action='store_true',
+                    help='With --regions deploy to the first region and '
+                         'only continue with the rest if it succeeds.')
     pg.add_argument('--template-args', '-a', type=yaml.load, default=dict(),
                     help='AWS Cloud Formation stack factory arguments.')
     pg.add_argument('--template-params', '-p', type=yaml.load, default=dict(),
@@ -260,8 +864,72 @@ def main():
                     help='AWS Cloud Formation stack parameters.')
     pg.add_argument('--no-color', dest='no_color', action='store_true',
                     help='AWS Cloud Formation stack name namespace prefix.')
+    pg.add_argument('--fail-fast', dest='fail_fast', action='store_true',
+                    help='With --watch cancel an update, or stop waiting '
+                         'for a create, on the first failed resource.')
+    pg.add_argument('--template-bucket', dest='template_bucket',
+                    metavar='BUCKET',
+                    help='Upload the template to this S3 bucket under a '
+                         'content hash key and pass it as a TemplateURL.')
+    pg.add_argument('--artifacts', metavar='DIRECTORY',
+                    help='Use the template written to this artifact '
+                         'directory by generate --output instead of '
+                         'generating it again.')
+
+    # deploy
+    pg = sp.add_parser('deploy',
+                       help='Creates or updates every stack of a namespace '
+                            'manifest in dependency order.')
+    pg.set_defaults(func=deploy)
+    pg.add_argument('manifest',
+                    help='YAML manifest of the namespace stacks.')
+    pg.add_argument('--creator', '-c',
+                    help='The creator (username) used for tagging the '
+                         'newly created stacks.')
+    pg.add_argument('--parallel', type=int, default=4,
+                    help='Number of stacks of a wave deployed at once.')
+    pg.add_argument('--fail-fast', dest='fail_fast', action='store_true',
+                    help='Cancel an update, or stop waiting for a create, '
+                         'on the first failed resource.')
+    pg.add_argument('--no-color', dest='no_color', action='store_true',
+                    help='Print events without colors.')
+    pg.add_argument('--template-bucket', dest='template_bucket',
+                    metavar='BUCKET',
+                    help='Upload the templates to this S3 bucket under a '
+                         'content hash key and pass them as TemplateURLs.')
+    pg.add_argument('--dry-run', dest='dry_run', action='store_true',
+                    help='Print the deploy waves without deploying.')
+    pg.add_argument('--state', metavar='PATH',
+                    help='Where completed waves are recorded, defaults to '
+                         '~/.tropext/deploys/NAMESPACE-REGION.json.')
+    pg.add_argument('--restart', action='store_true',
+                    help='Deploy every wave instead of resuming after the '
+                         'last completed one.')
 
     # delete
+    pg = sp.add_parser('delete',
+                       help='Deletes a stack, or every stack of a namespace '
+                            'in reference order.')
+    pg.set_defaults(func=delete)
+    pg.add_argument('--stack', '-s', metavar='STACK_NAME',
+                    help='AWS Cloud Formation stack name, every stack of '
+                         'the namespace when left out.')
+    pg.add_argument('--namespace', '-n', required=True,
+                    help='AWS Cloud Formation stack name namespace prefix.')
+    pg.add_argument('--region', '-r', default='us-west-2',
+                    help='AWS Cloud Formation region.')
+    pg.add_argument('--parallel', type=int, default=4,
+                    help='Number of stacks deleted at once.')
+    pg.add_argument('--dry-run', dest='dry_run', action='store_true',
+                    help='Print the delete waves without deleting.')
+    pg.add_argument('--yes', action='store_true',
+                    help='Delete more than one stack without stopping '
+                         'after the waves are printed.')
+    pg.add_argument('--force', action='store_true',
+                    help='Delete a stack even if other stacks reference '
+                         'it.')
+    pg.add_argument('--no-color', dest='no_color', action='store_true',
+                    help='Print events without colors.')
 
     # watch
     pg = sp.add_parser('watch', help='Watches Cloud Formation events.')
@@ -276,6 +944,41 @@ def main():
                     help='AWS Cloud Formation stack name namespace prefix.')
     pg.add_argument('--no-color', dest='no_color', action='store_true',
                     help='AWS Cloud Formation stack name namespace prefix.')
+    pg.add_argument('--timeline', action='store_true',
+                    help='Print a per resource timeline when the stack '
+                         'operation finishes.')
+
+    # timeline
+    pg = sp.add_parser('timeline',
+                       help='Prints a per resource timeline of the last '
+                            'stack operation.')
+    pg.set_defaults(func=timeline)
+    pg.add_argument('--stack', '-s', required=True, metavar='STACK_NAME',
+                    help='AWS Cloud Formation stack name.')
+    pg.add_argument('--namespace', '-n', required=True,
+                    help='AWS Cloud Formation stack name namespace prefix.')
+    pg.add_argument('--region', '-r', default='us-west-2',
+                    help='AWS Cloud Formation region.')
+    pg.add_argument('--format', '-f', choices=['text', 'json'],
+                    default='text', help='Output format.')
+    pg.add_argument('--width', type=int, default=60,
+                    help='Width of the text chart bars.')
+
+    # history
+    pg = sp.add_parser('history',
+                       help='Prints provisioning durations, deploys and '
+                            'failure rates from the recorded stack '
+                            'events.')
+    pg.set_defaults(func=history)
+    pg.add_argument('--stack', '-s', metavar='STACK_NAME',
+                    help='Only events of this stack.')
+    pg.add_argument('--namespace', '-n',
+                    help='Only events of this namespace.')
+    pg.add_argument('--region', '-r', help='Only events of this region.')
+    pg.add_argument('--since', metavar='YYYY-MM-DD',
+                    help='Only events from this date on.')
+    pg.add_argument('--format', '-f', choices=['text', 'json'],
+                    default='text', help='Output format.')
 
     # diff
     pg = sp.add_parser('diff',
@@ -291,8 +994,48 @@ def main():
                     help='AWS Cloud Formation stack name namespace prefix.')
     pg.add_argument('--region', '-r', default='us-west-2',
                     help='AWS Cloud Formation stack name namespace prefix.')
+    pg.add_argument('--regions', type=lambda v: v.split(','),
+                    metavar='REGION,...',
+                    help='Diff against the stacks of several regions '
+                         'concurrently.')
+    pg.add_argument('--parallel', type=int, default=4,
+                    help='With --regions the number of regions deployed '
+                         'at once.')
+    pg.add_argument('--canary', action='store_true',
+                    help='With --regions deploy to the first region and '
+                         'only continue with the rest if it succeeds.')
     pg.add_argument('--template-args', '-a', type=yaml.load, default=dict(),
                     help='AWS Cloud Formation stack factory arguments.')
+    pg.add_argument('--artifacts', metavar='DIRECTORY',
+                    help='Use the template written to this artifact '
+                         'directory by generate --output instead of '
+                         'generating it again.')
+
+    # serve
+    pg = sp.add_parser('serve',
+                       help='Runs a resident trop daemon that keeps '
+                            'templates and connections warm.')
+    pg.set_defaults(func=serve)
+    pg.add_argument('--socket', default=DEFAULT_SOCKET,
+                    help='Unix socket path the daemon listens on.')
+
+    # snapshot
+    pg = sp.add_parser('snapshot',
+                       help='Saves the physical resource ids of every '
+                            'stack in a namespace for offline generation.')
+    pg.set_defaults(func=snapshot)
+    pg.add_argument('--namespace', '-n', required=True,
+                    help='AWS Cloud Formation stack name namespace prefix.')
+    pg.add_argument('--region', '-r', default='us-west-2',
+                    help='AWS Cloud Formation region.')
+    pg.add_argument('--output', '-o', metavar='PATH',
+                    help='Snapshot file, defaults to '
+                         '~/.tropext/snapshots/NAMESPACE-REGION.json.')
+    pg.add_argument('--parallel', type=int, default=8,
+                    help='Number of stacks listed at once.')
+    pg.add_argument('--check', action='store_true',
+                    help='Print the stacks that changed since the '
+                         'snapshot was taken instead of taking one.')
 
     # cost
 
@@ -300,10 +1043,28 @@ def main():
 
     log.setLevel(args.log_level)
 
+    if args.remote is not None:
+        if args.func.__name__ not in TropextServer.commands:
+            p.error('--remote only supports the {} commands.'
+                    .format(', '.join(TropextServer.commands)))
+        return remote(args)
+
+    if not args.no_history and args.func in [create, update, deploy, delete,
+                                             watch, timeline, serve]:
+        utils.use_history(History(args.history))
+
+    if args.snapshot and \
+            not __use_snapshots(args.snapshot, args.check_snapshot):
+        return 1
+
     # add current directory to the system path to resolve templates
     sys.path.append(os.getcwd())
 
-    return args.func(args)
+    try:
+        return args.func(args)
+    finally:
+        if args.api_stats:
+            sys.stderr.write(api.stats.report() + '\n')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import json
+import unittest
+
+from boto.exception import BotoServerError
+
+from troposphere_ext.api import Api, Stats, TokenBucket
+
+
+def _throttling():
+    return BotoServerError(400, 'Bad Request', json.dumps(
+        {'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}))
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class _Connection(object):
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def describe_stacks(self, name=None):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return [name]
+
+    def create_stack(self, name):
+        return self.describe_stacks(name)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_acquire(self):
+        clock = _Clock()
+        bucket = TokenBucket(rate=2, burst=2, clock=clock.time,
+                             sleep=clock.sleep)
+
+        waits = [bucket.acquire() for _ in range(4)]
+
+        self.assertEquals(waits, [0, 0, 0.5, 0.5])
+        self.assertEquals(clock.now, 1.0)
+
+
+class TestApi(unittest.TestCase):
+
+    def _api(self, conn, **kwargs):
+        clock = _Clock()
+        self.slept = clock
+        return Api(conn, TokenBucket(rate=1000, burst=1000), Stats(),
+                   sleep=clock.sleep, **kwargs)
+
+    def test_retries_throttling(self):
+        conn = _Connection(_throttling(),
+                           BotoServerError(503, 'Service Unavailable'))
+        api = self._api(conn)
+
+        self.assertEquals(api.describe_stacks('stack'), ['stack'])
+        self.assertEquals(conn.calls, 3)
+        stats = api._stats.to_dict()['describe_stacks']
+        self.assertEquals((stats['calls'], stats['retries'],
+                           stats['throttled'], stats['errors']),
+                          (1, 2, 1, 0))
+        self.assertTrue(0 <= self.slept.now <= 1.5)
+
+    def test_gives_up(self):
+        conn = _Connection(*[_throttling() for _ in range(3)])
+        api = self._api(conn, retries=2)
+
+        with self.assertRaises(BotoServerError):
+            api.describe_stacks()
+        self.assertEquals(api._stats.to_dict()['describe_stacks']['errors'],
+                          1)
+
+    def test_does_not_retry_client_errors(self):
+        conn = _Connection(BotoServerError(400, 'Bad Request'))
+        api = self._api(conn)
+
+        with self.assertRaises(BotoServerError):
+            api.describe_stacks()
+        self.assertEquals(conn.calls, 1)
+
+    def test_does_not_repeat_writes(self):
+        conn = _Connection(BotoServerError(503, 'Service Unavailable'))
+        api = self._api(conn)
+
+        with self.assertRaises(BotoServerError):
+            api.create_stack('stack')
+        self.assertEquals(conn.calls, 1)
+
+        conn = _Connection(_throttling())
+        api = self._api(conn)
+
+        self.assertEquals(api.create_stack('stack'), ['stack'])
+        self.assertEquals(conn.calls, 2)
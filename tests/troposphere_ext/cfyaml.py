@@ -0,0 +1,63 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import json
+import unittest
+
+from troposphere import Join, GetAZs
+
+from troposphere_ext import template, TRef, SRef, cfyaml
+from troposphere_ext.ec2 import UserData, CloudConfig
+from troposphere_ext.snapshot import Snapshot
+
+
+class TestYaml(unittest.TestCase):
+
+    def setUp(self):
+        SRef.use_snapshot(Snapshot('ns', 'us-west-2', {'ns-vpc': {
+            'updated': '2015-06-01T12:00:00',
+            'resources': [['Subnet', 'subnet-1', 'AWS::EC2::Subnet']]}}))
+
+    def tearDown(self):
+        SRef._SRef__snapshots.clear()
+
+    def _template(self):
+        t = template('Test')
+        t.eip('Ip', Domain='vpc')
+        t.instance('Host', ImageId='ami-12345678',
+                   SubnetId=SRef('us-west-2', 'ns-vpc', 'Subnet'),
+                   AvailabilityZone=Join('', [GetAZs(''), 'a']),
+                   UserData=UserData('#!/bin/sh\n', 'echo ', TRef('Ip'),
+                                     '\n'))
+        t.instance('Config', ImageId='ami-12345678',
+                   UserData=CloudConfig({'runcmd': [
+                       'echo one', 'echo two', 'echo three'],
+                       'subnet': SRef('us-west-2', 'ns-vpc', 'Subnet')}))
+        t.output('Address', Value=t.get_att('Host', 'PrivateIp'))
+        return t
+
+    def test_round_trip(self):
+        t = self._template()
+
+        self.assertEquals(cfyaml.loads(t.to_yaml()), json.loads(t.to_json()))
+
+    def test_short_form(self):
+        body = self._template().to_yaml()
+
+        self.assertIn('!Ref TestIp', body)
+        self.assertIn('Value: !GetAtt TestHost.PrivateIp', body)
+        self.assertIn("!Join\n      - ''\n      - - !GetAZs ''", body)
+        # a short form can't directly hold another one
+        self.assertIn('UserData: !Base64\n        Fn::Join:', body)
+        self.assertIn('SubnetId: subnet-1', body)
+        self.assertNotIn('&id', body)
+
+    def test_smaller(self):
+        t = self._template()
+
+        self.assertTrue(len(t.to_yaml()) < len(t.to_json()))
+
+
+if __name__ == '__main__':
+    unittest.main()
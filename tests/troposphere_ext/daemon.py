@@ -0,0 +1,108 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import sys
+import json
+import stat
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import unittest
+
+from troposphere_ext.daemon import TropextServer, TropextClient
+
+TEMPLATE = '''
+from troposphere_ext import template
+
+
+def create(**kwargs):
+    t = template(kwargs['stack_prefix'])
+    t.bucket('{}')
+    return t
+'''
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+        self.log = logging.getLogger('test.daemon')
+        self.log.disabled = True
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trop.sock')
+        self._write('Data', 0)
+
+        self.server = TropextServer(self.log, self.path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = TropextClient(self.path)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.directory in sys.path:
+            sys.path.remove(self.directory)
+        sys.modules.pop('daemon_test_tpl', None)
+        shutil.rmtree(self.directory)
+
+    def _write(self, title, mtime):
+        path = os.path.join(self.directory, 'daemon_test_tpl.py')
+        with open(path, 'w') as f:
+            f.write(TEMPLATE.format(title))
+        # far enough apart that the reloader always sees the change
+        os.utime(path, (1433160000 + mtime, 1433160000 + mtime))
+
+    def _request(self, command, **kwargs):
+        request = dict(stack='app', namespace='ns', region='us-west-2',
+                       template='daemon_test_tpl', cwd=self.directory)
+        request.update(kwargs)
+        return list(self.client.request(command, **request))
+
+    def test_generate(self):
+        messages = self._request('generate')
+
+        self.assertEquals(messages[-1], {'status': 0})
+        self.assertEquals(json.loads(messages[0]['output'])['Resources']
+                          .keys(), ['NsAppData'])
+
+    def test_reloads_changed_template(self):
+        self._request('generate')
+        self._write('Logs', 60)
+
+        messages = self._request('generate')
+
+        self.assertEquals(json.loads(messages[0]['output'])['Resources']
+                          .keys(), ['NsAppLogs'])
+
+    def test_unsupported_command(self):
+        messages = self._request('delete')
+
+        self.assertEquals(messages, [{
+            'status': 1, 'error': 'Unsupported command "delete"'}])
+
+    def test_socket(self):
+        self.assertEquals(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+        # a running daemon is never replaced
+        self.assertRaises(socket.error, TropextServer, self.log, self.path)
+        self.assertEquals(self._request('generate')[-1], {'status': 0})
+
+    def test_replaces_stale_socket(self):
+        path = os.path.join(self.directory, 'stale.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.close()
+
+        server = TropextServer(self.log, path)
+        server.server_close()
+
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
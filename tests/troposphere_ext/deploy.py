@@ -0,0 +1,236 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import sys
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+import collections
+
+from boto.exception import BotoServerError
+
+from troposphere_ext.utils import Tropext, NO_UPDATES
+from troposphere_ext.deploy import Deploy, Manifest, waves
+
+TEMPLATE = '''
+from troposphere_ext import template, SRef
+
+
+def create(**kwargs):
+    t = template(kwargs['stack_prefix'])
+    t.bucket('Data')
+    for name in kwargs.get('refs', []):
+        t.output(name.capitalize(), Value=SRef(
+            kwargs['region'], '{}-{}'.format(kwargs['namespace'], name),
+            'Data'))
+    return t
+'''
+
+MANIFEST = '''
+namespace: ns
+region: us-west-2
+stacks:
+  vpc:
+    template: deploy_test_tpl
+  db:
+    template: deploy_test_tpl
+    parent: vpc
+  cache:
+    template: deploy_test_tpl
+    args: {refs: [vpc, elsewhere]}
+  app:
+    template: deploy_test_tpl
+    args: {refs: [db]}
+    depends_on: [cache]
+'''
+
+
+class _Deploy(Deploy):
+    """Deploys by recording the stack, stacks in fail fail"""
+
+    def __init__(self, *args, **kwargs):
+        self.fail = kwargs.pop('fail', ())
+        Deploy.__init__(self, *args, **kwargs)
+        self.deployed = []
+
+    def _deploy(self, name, emit):
+        self.deployed.append(name)
+        emit('event', 'deploying')
+        if name in self.fail:
+            return False, 'UPDATE_ROLLBACK_COMPLETE'
+        return True, 'CREATE_COMPLETE'
+
+
+class _Tropext(object):
+    """Stack whose update is still cleaning up after the watch ended"""
+
+    fq_stack_name = 'ns-app'
+
+    def __init__(self):
+        self.statuses = ['UPDATE_COMPLETE_CLEANUP_IN_PROGRESS',
+                         'UPDATE_COMPLETE']
+
+    def status(self):
+        return self.statuses[0]
+
+    def diff(self, template, args):
+        return ['changed']
+
+    def update(self, template, args, params, unchanged=None):
+        return 'id/ns-app'
+
+    def watch(self, fetch, fail_fast):
+        return iter([])
+
+    def final_status(self):
+        return self.statuses[-1]
+
+
+Stack = collections.namedtuple('Stack', ['stack_name', 'stack_status'])
+
+
+class _Deployed(object):
+    """Connection of stacks deployed with the manifest as it is"""
+
+    def __init__(self):
+        self.updates = []
+
+    def describe_stacks(self):
+        return [Stack('ns-vpc', 'UPDATE_COMPLETE')]
+
+    def update_stack(self, stack_name, **kwargs):
+        self.updates.append(stack_name)
+        raise BotoServerError(400, 'Bad Request', json.dumps({'Error': {
+            'Code': 'ValidationError', 'Message': NO_UPDATES}}))
+
+
+class TestDeploy(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+        self.log = logging.getLogger('test.deploy')
+        self.log.disabled = True
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory,
+                               'deploy_test_tpl.py'), 'w') as f:
+            f.write(TEMPLATE)
+        self.path = os.path.join(self.directory, 'manifest.yaml')
+        with open(self.path, 'w') as f:
+            f.write(MANIFEST)
+        self.state = os.path.join(self.directory, 'state.json')
+        sys.path.insert(0, self.directory)
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        sys.modules.pop('deploy_test_tpl', None)
+        shutil.rmtree(self.directory)
+
+    def _deploy(self, **kwargs):
+        return _Deploy(self.log, Manifest.load(self.path),
+                       state_path=self.state, **kwargs)
+
+    def test_waves(self):
+        self.assertEquals(waves({'a': set(), 'b': set(['a']),
+                                 'c': set(['a']), 'd': set(['b', 'c'])}),
+                          [['a'], ['b', 'c'], ['d']])
+        self.assertRaises(ValueError, waves, {'a': set(['b']),
+                                              'b': set(['a'])})
+
+    def test_manifest(self):
+        manifest = Manifest.load(self.path)
+
+        self.assertEquals(manifest.args('db'), {'parent_stack': 'vpc'})
+        self.assertEquals(manifest.depends_on('app'), set(['cache']))
+
+        with open(self.path, 'w') as f:
+            f.write(MANIFEST + '  web:\n    template: tpl\n    parent: lb\n')
+        self.assertRaises(ValueError, Manifest.load, self.path)
+
+    def test_plan(self):
+        dependencies = self._deploy().plan()
+
+        self.assertEquals(dependencies, {'vpc': set(),
+                                         'db': set(['vpc']),
+                                         'cache': set(['vpc']),
+                                         'app': set(['db', 'cache'])})
+        self.assertEquals(waves(dependencies),
+                          [['vpc'], ['cache', 'db'], ['app']])
+
+    def test_deploy_waits_for_final_status(self):
+        deploy = Deploy(self.log, Manifest.load(self.path),
+                        state_path=self.state)
+        deploy.tropext = lambda name: _Tropext()
+
+        self.assertEquals(deploy._deploy('app', lambda kind, value: None),
+                          (True, 'UPDATE_COMPLETE'))
+
+    def test_rerun_with_params(self):
+        with open(self.path, 'w') as f:
+            f.write('namespace: ns\nstacks:\n  vpc:\n'
+                    '    template: deploy_test_tpl\n'
+                    '    params: {Size: small}\n')
+        conn = _Deployed()
+
+        def tropext(name):
+            result = Tropext(self.log, name, 'ns')
+            result._conn = conn
+            return result
+
+        # parameters are always passed to the update
+        for _ in range(2):
+            deploy = Deploy(self.log, Manifest.load(self.path),
+                            state_path=self.state)
+            deploy.tropext = tropext
+            list(deploy.run(waves(deploy.plan())))
+
+            self.assertEquals(deploy.results, {'vpc': (True, 'unchanged')})
+        self.assertEquals(conn.updates, ['ns-vpc', 'ns-vpc'])
+
+    def test_run(self):
+        deploy = self._deploy(parallel=2)
+        planned = waves(deploy.plan())
+        items = list(deploy.run(planned))
+
+        self.assertEquals([value for name, kind, value in items
+                           if kind == 'wave'], [0, 1, 2])
+        self.assertEquals(deploy.deployed[0], 'vpc')
+        self.assertEquals(deploy.deployed[-1], 'app')
+        self.assertTrue(all(ok for ok, _ in deploy.results.itervalues()))
+        # nothing left to resume
+        self.assertFalse(os.path.exists(self.state))
+
+    def test_resume(self):
+        deploy = self._deploy(fail=['db'])
+        planned = waves(deploy.plan())
+        list(deploy.run(planned))
+
+        self.assertEquals(deploy.results['app'],
+                          (False, 'skipped, db failed'))
+        with open(self.state) as f:
+            self.assertEquals(json.load(f)['completed'], 1)
+
+        deploy = self._deploy()
+        start = deploy.resume(planned)
+        list(deploy.run(planned, start))
+
+        self.assertEquals(start, 1)
+        self.assertEquals(sorted(deploy.deployed), ['app', 'cache', 'db'])
+
+    def test_resume_changed(self):
+        deploy = self._deploy(fail=['app'])
+        planned = waves(deploy.plan())
+        list(deploy.run(planned))
+
+        self.assertEquals(deploy.resume(planned), 2)
+        with open(self.path, 'a') as f:
+            f.write('  web:\n    template: deploy_test_tpl\n')
+        self.assertEquals(self._deploy().resume(planned), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
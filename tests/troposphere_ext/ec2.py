@@ -0,0 +1,236 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import gzip
+import json
+import stat
+import yaml
+import base64
+import shutil
+import tempfile
+import unittest
+import StringIO
+import subprocess
+
+from troposphere import Ref, awsencode
+from troposphere.ec2 import NetworkAclEntry
+
+from troposphere_ext import template, TRef, SRef
+from troposphere_ext.ec2 import VPC, Subnet, RouteTable, NetworkAcl
+from troposphere_ext.ec2 import UserData, CloudConfig, USER_DATA_DIR
+from troposphere_ext.ec2 import MIME_BOUNDARY
+from troposphere_ext.snapshot import Snapshot
+
+
+def _encode(obj):
+    return json.loads(json.dumps(obj, cls=awsencode))
+
+
+def _gunzip(value):
+    return gzip.GzipFile(fileobj=StringIO.StringIO(
+        base64.b64decode(value))).read()
+
+
+class TestVPC(unittest.TestCase):
+
+    def _vpc(self, tpl):
+        acl = NetworkAcl('Acl', NetworkAclEntries=[
+            NetworkAclEntry('In', Protocol=-1, RuleAction='allow',
+                            RuleNumber=100, Egress=False,
+                            CidrBlock='0.0.0.0/0')])
+        subnets = [Subnet('Sub{}'.format(i),
+                          CidrBlock='10.0.{}.0/24'.format(i),
+                          RouteTables=[TRef('Rt$')],
+                          NetworkAcls=[TRef('Acl$')])
+                   for i in range(2)]
+        return tpl.vpc('Vpc', CidrBlock='10.0.0.0/16',
+                       NetworkAcls=[acl],
+                       RouteTables=[RouteTable('Rt')],
+                       Subnets=subnets)
+
+    def test_sub_resources_registered_eagerly(self):
+        tpl = self._vpc(template('Test'))
+        subnet = tpl._resources['TestVpcSub0']
+
+        self.assertTrue('TestVpcAclIn' in tpl._resources)
+        self.assertEquals(subnet.title, 'TestVpcSub0')
+        self.assertEquals(_encode(tpl.ref(subnet)), {'Ref': 'TestVpcSub0'})
+        self.assertEquals(_encode(Ref(subnet)), {'Ref': 'TestVpcSub0'})
+        # only the associations wait for the template to be rendered
+        self.assertFalse(any(t.endswith('Assoc') for t in tpl._resources))
+
+        resources = json.loads(tpl.to_json())['Resources']
+
+        self.assertTrue('TestVpcSub0TestVpcRtAssoc' in resources)
+
+    def test_duplicate_sub_resource(self):
+        tpl = template('Test')
+
+        with self.assertRaises(ValueError):
+            tpl.vpc('Vpc', CidrBlock='10.0.0.0/16', Subnets=[
+                Subnet('Sub', CidrBlock='10.0.{}.0/24'.format(i))
+                for i in range(2)])
+
+    def test_lookup_expands_vpc(self):
+        tpl = self._vpc(template('Test'))
+
+        self.assertEquals(tpl.get_resource('Sub1$').title, 'TestVpcSub1')
+
+    def test_associations(self):
+        tpl = self._vpc(template('Test'))
+
+        resources = json.loads(tpl.to_json())['Resources']
+
+        for i in range(2):
+            subnet = 'TestVpcSub{}'.format(i)
+            rt_assoc = resources['{}TestVpcRtAssoc'.format(subnet)]
+            acl_assoc = resources['{}TestVpcAclAssoc'.format(subnet)]
+            self.assertEquals(rt_assoc['Properties'],
+                              {'SubnetId': {'Ref': subnet},
+                               'RouteTableId': {'Ref': 'TestVpcRt'}})
+            self.assertEquals(acl_assoc['Properties'],
+                              {'SubnetId': {'Ref': subnet},
+                               'NetworkAclId': {'Ref': 'TestVpcAcl'}})
+
+
+class TestUserData(unittest.TestCase):
+
+    def test_plain(self):
+        user_data = UserData('#!/bin/sh\n', ['echo ', Ref('Ip'),
+                                             '\n    |done\n'])
+
+        self.assertEquals(_encode(user_data),
+                          {'Fn::Base64': {'Fn::Join': [
+                              '', ['#!/bin/sh\n', 'echo ', {'Ref': 'Ip'},
+                                   '\ndone\n']]}})
+
+    def test_compress_keeps_refs(self):
+        user_data = UserData('#!/bin/sh\n', 'echo ', Ref('Ip'), '\n',
+                             compress=True)
+
+        parts = _encode(user_data)['Fn::Base64']['Fn::Join'][1]
+        payload = ''.join(p for p in parts if isinstance(p, basestring))
+
+        self.assertTrue({'Fn::Base64': {'Ref': 'Ip'}} in parts)
+        self.assertTrue(payload.startswith('Content-Type: multipart/mixed'))
+        content = payload.split('content: |\n')[1].split('\n\n')[0]
+        self.assertEquals(_gunzip(content.replace(' ', '')),
+                          '#!/bin/sh\necho @@TROPEXT_0@@\n')
+
+    def test_compress_runs(self):
+        values = {'Cert': 'a & b \\1\nTROPEXT_VARS\n', 'Name': ''}
+        user_data = UserData('#!/bin/sh\ncat > "$0.out" <<\'END\'\n',
+                             Ref('Cert'), '[', Ref('Name'), ']\nEND\n',
+                             compress=True)
+
+        # resolve the helpers the way Cloud Formation would
+        parts = _encode(user_data)['Fn::Base64']['Fn::Join'][1]
+        payload = ''.join(p if isinstance(p, basestring) else
+                          base64.b64encode(values[p['Fn::Base64']['Ref']])
+                          for p in parts)
+        directory = tempfile.mkdtemp()
+        try:
+            payload = payload.replace(USER_DATA_DIR, directory)
+            parts = payload.split('\n--{}'.format(MIME_BOUNDARY))
+            content = parts[1].split('content: |\n')[1]
+            path = os.path.join(directory, 'user-data')
+            with open(path, 'w') as f:
+                f.write(_gunzip(content.replace(' ', '')))
+            runner = parts[2].split('\n\n', 1)[1]
+
+            subprocess.check_call(['sh', '-c', runner])
+
+            with open(path + '.run.out') as f:
+                self.assertEquals(f.read(), values['Cert'] + '[]\n')
+            self.assertEquals(stat.S_IMODE(os.stat(path + '.vars').st_mode),
+                              0600)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shared_by_helpers(self):
+        ip = Ref('Ip')
+
+        self.assertIs(UserData('echo ', ip).JSONrepr(),
+                      UserData('echo ', ip).JSONrepr())
+        self.assertIsNot(UserData('echo ', ip).JSONrepr(),
+                         UserData('echo ', Ref('Ip')).JSONrepr())
+
+    def test_compress_requires_script(self):
+        with self.assertRaises(ValueError):
+            _encode(UserData('echo hi', compress=True))
+
+
+class _Port(object):
+
+    def __init__(self, number):
+        self.number = number
+
+
+class _Snapshot(Snapshot):
+    """Snapshot counting the stack lookups SRefs make"""
+
+    lookups = 0
+
+    def resources(self, stack_name):
+        self.lookups += 1
+        return Snapshot.resources(self, stack_name)
+
+
+class TestCloudConfig(unittest.TestCase):
+
+    def test_user_representers(self):
+        yaml.add_representer(_Port, lambda dumper, data: dumper
+                             .represent_scalar('tag:yaml.org,2002:int',
+                                               str(data.number)))
+        try:
+            config = CloudConfig({'port': _Port(8080)})
+
+            self.assertEquals(_encode(config),
+                              {'Fn::Base64': '#cloud-config\n'
+                                             'port: 8080\n'})
+        finally:
+            del yaml.Dumper.yaml_representers[_Port]
+
+    def test_helpers_resolved_when_rendered(self):
+        snapshot = _Snapshot('ns', 'us-west-2', dict(
+            ('{}-vpc'.format(namespace), {
+                'updated': '2015-06-01T12:00:00',
+                'resources': [['Subnet', 'subnet-{}'.format(namespace),
+                               'AWS::EC2::Subnet']]})
+            for namespace in ['ns', 'other']))
+        SRef.use_snapshot(snapshot)
+        config = CloudConfig({'subnet': SRef('us-west-2', 'ns-vpc',
+                                             'Subnet')})
+        try:
+            self.assertEquals(_encode(config)['Fn::Base64'],
+                              '#cloud-config\nsubnet: subnet-ns\n')
+            # only resolved to render, never to build a cache key
+            self.assertEquals(snapshot.lookups, 1)
+
+            # not served from the cache once the helper resolves
+            # elsewhere
+            SRef.rename({'ns-vpc': 'other-vpc'})
+            self.assertEquals(_encode(config)['Fn::Base64'],
+                              '#cloud-config\nsubnet: subnet-other\n')
+        finally:
+            SRef.rename(None)
+            SRef._SRef__snapshots.clear()
+
+    def test_shared_by_content(self):
+        self.assertIs(CloudConfig({'packages': ['nginx']}).JSONrepr(),
+                      CloudConfig({'packages': ['nginx']}).JSONrepr())
+        self.assertIsNot(CloudConfig({'port': 1}).JSONrepr(),
+                         CloudConfig({'port': True}).JSONrepr())
+
+    def test_plain(self):
+        self.assertEquals(_encode(CloudConfig({'packages': ['nginx']})),
+                          {'Fn::Base64': '#cloud-config\n'
+                                         'packages:\n- nginx\n'})
+
+    def test_compress(self):
+        config = CloudConfig({'packages': ['nginx']}, compress=True)
+
+        self.assertEquals(_gunzip(_encode(config)),
+                          '#cloud-config\npackages:\n- nginx\n')
@@ -0,0 +1,61 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import logging
+import threading
+import unittest
+
+from troposphere_ext.fanout import FanOut, succeeded
+
+REGIONS = ['us-west-2', 'us-east-1', 'eu-west-1']
+
+
+class TestFanOut(unittest.TestCase):
+
+    def setUp(self):
+        # connections are created up front but never used by these tasks
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+        self.log = logging.getLogger('test.fanout')
+        self.log.disabled = True
+
+    def test_run(self):
+        started = []
+        lock = threading.Lock()
+
+        def _task(tropext, emit):
+            with lock:
+                started.append(tropext._region)
+            emit('output', 'hello')
+            return tropext._region != 'eu-west-1', tropext._region
+
+        fan_out = FanOut(self.log, 'stack', 'ns', REGIONS, parallel=2)
+        items = list(fan_out.run(_task))
+
+        self.assertEquals(sorted(started), sorted(REGIONS))
+        self.assertEquals(len(items), 6)
+        self.assertEquals(sorted(r for r, k, _ in items if k == 'output'),
+                          sorted(REGIONS))
+        self.assertEquals(fan_out.results, {
+            'us-west-2': (True, 'us-west-2'),
+            'us-east-1': (True, 'us-east-1'),
+            'eu-west-1': (False, 'eu-west-1')})
+
+    def test_canary_failure_skips_the_rest(self):
+        def _task(tropext, emit):
+            raise RuntimeError('boom')
+
+        fan_out = FanOut(self.log, 'stack', 'ns', REGIONS, canary=True)
+        items = list(fan_out.run(_task))
+
+        self.assertEquals([r for r, _, _ in items], REGIONS)
+        self.assertEquals(fan_out.results['us-west-2'], (False, 'boom'))
+        self.assertFalse(fan_out.results['eu-west-1'][0])
+
+    def test_succeeded(self):
+        self.assertTrue(succeeded('UPDATE_COMPLETE'))
+        self.assertFalse(succeeded('UPDATE_ROLLBACK_COMPLETE'))
+        self.assertFalse(succeeded('CREATE_FAILED'))
+        self.assertFalse(succeeded(None))
@@ -0,0 +1,63 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import json
+import unittest
+
+from troposphere_ext.graph import DependencyGraph
+
+
+def _resource(resource_type, depends_on=None, **properties):
+    resource = {'Type': resource_type, 'Properties': properties}
+    if depends_on:
+        resource['DependsOn'] = depends_on
+    return resource
+
+
+class TestDependencyGraph(unittest.TestCase):
+
+    def _graph(self):
+        return DependencyGraph({'Resources': {
+            'Vpc': _resource('AWS::EC2::VPC'),
+            'Igw': _resource('AWS::EC2::InternetGateway'),
+            'Attach': _resource('AWS::EC2::VPCGatewayAttachment',
+                                VpcId={'Ref': 'Vpc'},
+                                InternetGatewayId={'Ref': 'Igw'}),
+            'Rt': _resource('AWS::EC2::RouteTable', VpcId={'Ref': 'Vpc'}),
+            'Route': _resource('AWS::EC2::Route', ['Attach', 'Rt', 'Vpc'],
+                               RouteTableId={'Ref': 'Rt'},
+                               GatewayId={'Ref': 'Igw'}),
+            'Host': _resource('AWS::EC2::Instance')}})
+
+    def test_order(self):
+        order = self._graph().order()
+
+        self.assertEquals(order[:3], ['Host', 'Igw', 'Vpc'])
+        self.assertTrue(order.index('Route') > order.index('Attach'))
+
+    def test_depth(self):
+        self.assertEquals(self._graph().depth(), 3)
+
+    def test_critical_path(self):
+        self.assertEquals(self._graph().critical_path(),
+                          (120, ['Host']))
+        self.assertEquals(self._graph().critical_path({}),
+                          (90, ['Igw', 'Attach', 'Route']))
+
+    def test_redundant_depends_on(self):
+        self.assertEquals(self._graph().redundant_depends_on(),
+                          [('Route', 'Rt'), ('Route', 'Vpc')])
+
+    def test_export(self):
+        graph = self._graph()
+
+        exported = json.loads(graph.to_json())
+        dot = graph.to_dot()
+
+        self.assertEquals(exported['depth'], 3)
+        self.assertTrue({'from': 'Route', 'to': 'Rt',
+                         'kinds': ['DependsOn', 'Ref']} in exported['edges'])
+        self.assertTrue('"Route" -> "Vpc" [label="DependsOn", '
+                        'style=dashed];' in dot)
+        self.assertTrue('"Route" -> "Attach" [label="DependsOn"];' in dot)
@@ -0,0 +1,103 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+import collections
+
+from troposphere_ext.history import History, percentile
+
+START = datetime.datetime(2015, 6, 1, 12, 0, 0)
+
+StackEvent = collections.namedtuple('StackEvent', [
+    'event_id', 'timestamp', 'resource_status', 'resource_type',
+    'logical_resource_id', 'resource_status_reason'])
+
+
+def _events(offset, name, failed=False):
+    """Events of one create of the stack name with an instance and a
+       volume"""
+    def _event(seconds, title, status, resource_type):
+        return StackEvent('{}-{}-{}'.format(offset, title, status),
+                          START + datetime.timedelta(seconds=offset +
+                                                     seconds),
+                          status, resource_type, title, None)
+
+    return [
+        _event(0, name, 'CREATE_IN_PROGRESS',
+               'AWS::CloudFormation::Stack'),
+        _event(1, 'Volume', 'CREATE_IN_PROGRESS', 'AWS::EC2::Volume'),
+        _event(11, 'Volume', 'CREATE_COMPLETE', 'AWS::EC2::Volume'),
+        _event(11, 'Host', 'CREATE_IN_PROGRESS', 'AWS::EC2::Instance'),
+        _event(71 + offset / 10, 'Host',
+               'CREATE_FAILED' if failed else 'CREATE_COMPLETE',
+               'AWS::EC2::Instance'),
+        _event(72 + offset / 10, name,
+               'ROLLBACK_COMPLETE' if failed else 'CREATE_COMPLETE',
+               'AWS::CloudFormation::Stack'),
+    ]
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = History(':memory:')
+        for i, offset in enumerate([0, 100, 200, 300]):
+            self.history.record('ns', 'app-{}'.format(i), 'us-west-2',
+                                _events(offset, 'ns-app-{}'.format(i),
+                                        failed=i == 3))
+
+    def tearDown(self):
+        self.history.close()
+
+    def test_record_deduplicates(self):
+        self.history.record('ns', 'app-0', 'us-west-2',
+                            _events(0, 'ns-app-0'))
+
+        self.assertEquals(len(self.history.events()), 24)
+        self.assertEquals(len(self.history.events(stack='app-0')), 6)
+
+    def test_resource_types(self):
+        types = self.history.resource_types()
+
+        self.assertEquals(types['AWS::EC2::Instance']['count'], 4)
+        self.assertEquals(types['AWS::EC2::Instance']['failed'], 1)
+        self.assertEquals(self.history.durations(),
+                          {'AWS::EC2::Instance': 70.0,
+                           'AWS::EC2::Volume': 10.0})
+        self.assertEquals(self.history.durations(95)['AWS::EC2::Instance'],
+                          80.0)
+
+    def test_deploys(self):
+        deploys = self.history.deploys()
+
+        self.assertEquals([(d['stack'], d['operation'], d['duration'],
+                            d['status']) for d in deploys],
+                          [('app-0', 'CREATE', 72, 'CREATE_COMPLETE'),
+                           ('app-1', 'CREATE', 82, 'CREATE_COMPLETE'),
+                           ('app-2', 'CREATE', 92, 'CREATE_COMPLETE'),
+                           ('app-3', 'CREATE', 102, 'ROLLBACK_COMPLETE')])
+
+    def test_relative_path(self):
+        directory = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            History('history.db').close()
+            History(os.path.join('nested', 'history.db')).close()
+
+            self.assertTrue(os.path.exists('history.db'))
+            self.assertTrue(os.path.exists(os.path.join('nested',
+                                                        'history.db')))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+
+    def test_percentile(self):
+        self.assertEquals(percentile([5, 1, 3, 2, 4], 50), 3)
+        self.assertEquals(percentile(range(1, 101), 95), 95)
+        self.assertEquals(percentile([], 50), None)
@@ -0,0 +1,123 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from troposphere import Ref
+
+from troposphere_ext import template, mappings
+from troposphere_ext.mappings import load, usage, prune, ANY
+
+REGIONS = ['us-east-1', 'us-west-1', 'us-west-2', 'eu-west-1',
+           'eu-central-1', 'ap-southeast-1', 'ap-southeast-2',
+           'ap-northeast-1', 'sa-east-1']
+
+
+class TestMappings(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, body):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(body)
+        return path
+
+    def test_load_json_in_chunks(self):
+        amis = dict((region, {'HVM64': 'ami-{}'.format(i), 'PV64': '{}'})
+                    for i, region in enumerate(REGIONS))
+        path = self._write('amis.json', json.dumps(amis, indent=2))
+        chunk_size = mappings.CHUNK_SIZE
+        mappings.CHUNK_SIZE = 16
+        try:
+            self.assertEquals(dict(load(path)), amis)
+        finally:
+            mappings.CHUNK_SIZE = chunk_size
+
+        with self.assertRaises(ValueError):
+            list(load(self._write('broken.json', json.dumps(amis)[:-20])))
+
+    def test_load_csv(self):
+        path = self._write('amis.csv', 'region,HVM64,PV64\n'
+                           'us-east-1,ami-1,ami-2\nus-west-2,ami-3,\n')
+
+        self.assertEquals(dict(load(path)),
+                          {'us-east-1': {'HVM64': 'ami-1', 'PV64': 'ami-2'},
+                           'us-west-2': {'HVM64': 'ami-3'}})
+
+    def test_prune(self):
+        used = usage({'Resources': {'Host': {'Properties': {
+            'ImageId': {'Fn::FindInMap': ['Amis', {'Ref': 'AWS::Region'},
+                                          'HVM64']},
+            'KeyName': {'Fn::FindInMap': ['Keys', 'us-east-1', 'Name']}}}}})
+        entries = [('us-east-1', {'HVM64': 'ami-1', 'PV64': 'ami-2'}),
+                   ('us-west-2', {'PV64': 'ami-3'})]
+
+        self.assertEquals(used, {'Amis': {ANY: set(['HVM64'])},
+                                 'Keys': {'us-east-1': set(['Name'])}})
+        self.assertEquals(list(prune(entries, used['Amis'])),
+                          [('us-east-1', {'HVM64': 'ami-1'})])
+        self.assertEquals(list(prune(entries, used['Keys'])), [])
+
+    def test_mapping_file(self):
+        arches = ['HVM64', 'HVMG2', 'PV64', 'ARM64']
+        amis = dict((region, dict((arch, 'ami-{:08x}'.format(i))
+                                  for i, arch in enumerate(arches)))
+                    for region in REGIONS)
+        amis['cn-north-1'] = {'HVM64': 'ami-9999'}
+        path = self._write('amis.json', json.dumps(amis))
+        tpl = template('Test').mapping_file('Amis', path)
+        tpl.mapping_file('Unused', path)
+        tpl.instance('Host', ImageId=tpl.find_in_map(
+            'Amis', Ref('AWS::Region'), Ref('Arch')))
+
+        t = tpl.to_dict()
+
+        self.assertEquals(sorted(t['Mappings']), ['Amis', 'AmisIndex'])
+        self.assertEquals(sorted(t['Mappings']['Amis']), ['Set0', 'Set1'])
+        self.assertEquals(t['Mappings']['Amis']['Set1'],
+                          {'HVM64': 'ami-9999'})
+        self.assertEquals(t['Mappings']['AmisIndex']['us-west-2'],
+                          {'Set': 'Set0'})
+        self.assertEquals(
+            t['Resources']['TestHost']['Properties']['ImageId'],
+            {'Fn::FindInMap': ['Amis', {'Fn::FindInMap': [
+                'AmisIndex', {'Ref': 'AWS::Region'}, 'Set']},
+                {'Ref': 'Arch'}]})
+
+    def test_find_in_map_fails_on_missing_keys(self):
+        tpl = template('Test').mapping('Amis', {
+            'us-east-1': {'HVM64': 'ami-1'}, 'us-west-2': {'PV64': 'ami-2'}})
+        tpl.instance('Host', ImageId=tpl.find_in_map(
+            'Amis', 'us-west-1', 'HVM64'))
+        tpl.instance('Other', ImageId=tpl.find_in_map(
+            'Amis', Ref('AWS::Region'), 'HVM64'))
+
+        with self.assertRaises(LookupError) as ctx:
+            tpl.to_dict()
+        self.assertEquals(str(ctx.exception).splitlines()[1:], [
+            "  Mapping 'Amis' has no key 'us-west-1'",
+            "  Mapping 'Amis' keys us-west-2 have no attribute 'HVM64'"])
+
+    def test_mapping_compact_by_default(self):
+        amis = {'us-east-1': {'HVM64': 'ami-1', 'PV64': 'ami-2'},
+                'us-west-2': {'HVM64': 'ami-3', 'PV64': 'ami-4'}}
+        compacted = template('Test').mapping('Amis', amis)
+        kept = template('Other').mapping('Amis', amis, compact=False)
+        for tpl in [compacted, kept]:
+            tpl.instance('Host', ImageId=tpl.find_in_map(
+                'Amis', Ref('AWS::Region'), 'HVM64'))
+
+        self.assertEquals(compacted.to_dict()['Mappings']['Amis'],
+                          {'us-east-1': {'HVM64': 'ami-1'},
+                           'us-west-2': {'HVM64': 'ami-3'}})
+        self.assertEquals(kept.to_dict()['Mappings']['Amis'], amis)
@@ -0,0 +1,168 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import unittest
+
+from troposphere import Join
+
+from troposphere_ext import template, TRef
+from troposphere_ext.graph import DependencyGraph
+from troposphere_ext.records import pack, RECORD_SET_GROUP_TYPE
+
+
+def _record(name, values, zone='example.com.', **properties):
+    properties.update(HostedZoneName=zone, Name=name, Type='A', TTL='300',
+                      ResourceRecords=values)
+    return {'Type': 'AWS::Route53::RecordSet', 'Properties': properties}
+
+
+def _records(template):
+    """Returns the sorted (zone, name, type, values) of every record"""
+    records = []
+    for resource in template['Resources'].itervalues():
+        properties = resource['Properties']
+        if resource['Type'] == RECORD_SET_GROUP_TYPE:
+            record_sets = properties['RecordSets']
+        elif resource['Type'] == 'AWS::Route53::RecordSet':
+            record_sets = [properties]
+        else:
+            continue
+        for record_set in record_sets:
+            records.append((properties['HostedZoneName'],
+                            record_set['Name'], record_set['Type'],
+                            record_set['ResourceRecords']))
+    return sorted(records)
+
+
+class TestRecords(unittest.TestCase):
+
+    def test_pack(self):
+        t = {'Resources': {
+            'Web': _record('web.example.com.', [{'Ref': 'Ip'}]),
+            'Api': _record('api.example.com.', ['10.0.0.2']),
+            'Db': _record('db.example.com.', ['10.0.0.3']),
+            'Mail': _record('mail.other.com.', ['10.0.0.4'],
+                            zone='other.com.'),
+            'Ip': {'Type': 'AWS::EC2::EIP', 'Properties': {}}},
+            'Outputs': {'Url': {'Value': {'Fn::Join': [
+                '', ['http://', {'Ref': 'Web'}]]}}}}
+
+        packed, groups = pack(t)
+
+        self.assertEquals(groups, {'ExampleComRecords0': ['Api', 'Db',
+                                                          'Web']})
+        self.assertEquals(sorted(packed['Resources']),
+                          ['ExampleComRecords0', 'Ip', 'Mail'])
+        self.assertEquals(_records(packed), _records(t))
+        # a Ref to a record set is its domain name
+        self.assertEquals(packed['Outputs']['Url']['Value'], {'Fn::Join': [
+            '', ['http://', 'web.example.com.']]})
+        self.assertIn('Web', t['Resources'])
+
+    def test_dependents(self):
+        t = {'Resources': {
+            'Web': _record('web.example.com.', ['10.0.0.1']),
+            'Api': _record('api.example.com.', ['10.0.0.2']),
+            'Host': {'Type': 'AWS::EC2::Instance', 'Properties': {
+                'UserData': {'Ref': 'Web'}}, 'DependsOn': 'Api'},
+            'Late': _record('late.example.com.', [
+                {'Fn::GetAtt': ['Host', 'PrivateIp']}]),
+            'Other': _record('other.example.com.', [
+                {'Fn::GetAtt': ['Host', 'PrivateIp']}])}}
+
+        packed, groups = pack(t)
+        host = packed['Resources']['Host']
+
+        # record sets depended on can't share a group with ones that
+        # depend on the dependent
+        self.assertEquals(groups, {
+            'ExampleComLevel1Records0': ['Api', 'Web'],
+            'ExampleComRecords0': ['Late', 'Other']})
+        self.assertEquals(host['Properties']['UserData'],
+                          'web.example.com.')
+        self.assertEquals(host['DependsOn'], ['ExampleComLevel1Records0'])
+        self.assertEquals(DependencyGraph(packed).order(),
+                          ['ExampleComLevel1Records0', 'Host',
+                           'ExampleComRecords0'])
+
+    def test_kept(self):
+        t = {'Resources': {
+            'Web': _record('web.example.com.', ['10.0.0.1']),
+            'Cond': dict(_record('cond.example.com.', ['10.0.0.2']),
+                         Condition='Prod'),
+            'Txt': dict(_record('txt.example.com.', [{'Ref': 'Token'}]),
+                        Properties=dict(_record('txt.example.com.', [
+                            {'Ref': 'Token'}])['Properties'], Type='TXT')),
+            'Alone': _record('alone.other.com.', ['10.0.0.3'],
+                             zone='other.com.')}}
+
+        self.assertEquals(pack(t), (t, {}))
+
+    def test_limits(self):
+        t = {'Resources': dict(
+            ('Host{:02d}'.format(i), _record('host{}.example.com.'.format(i),
+                                             ['10.0.0.{}'.format(i)] * 3))
+            for i in range(10))}
+
+        for limits in [dict(max_records=7), dict(max_characters=72)]:
+            packed, groups = pack(t, **limits)
+
+            self.assertTrue(groups)
+            for title in groups:
+                record_sets = packed['Resources'][title]['Properties'][
+                    'RecordSets']
+                self.assertLessEqual(sum(len(r['ResourceRecords'])
+                                         for r in record_sets), 7)
+            self.assertEquals(_records(packed), _records(t))
+
+    def test_stable_groups(self):
+        t = {'Resources': dict(
+            ('Host{:02d}'.format(i), _record('host{}.example.com.'.format(i),
+                                             ['10.0.0.{}'.format(i)] * 3))
+            for i in range(10))}
+        groups = pack(t, max_records=12)[1]
+
+        # only the group a record set is added to or removed from changes
+        t['Resources']['Host10'] = _record('host10.example.com.',
+                                           ['10.0.0.10'] * 3)
+        added = pack(t, max_records=12)[1]
+        del t['Resources']['Host01']
+        removed = pack(t, max_records=12)[1]
+
+        self.assertEquals(len(groups), 3)
+        self.assertEquals(sorted(added), sorted(groups))
+        self.assertEquals(sorted(removed), sorted(groups))
+        self.assertEquals(
+            [group for group in groups if groups[group] != added[group]],
+            [group for group in added if 'Host10' in added[group]])
+        self.assertEquals(
+            [group for group in added if added[group] != removed[group]],
+            [group for group in added if 'Host01' in added[group]])
+
+    def test_template_pack_records(self):
+        tpl = template('Test').pack_records()
+        tpl.eip('Ip', Domain='vpc')
+        for name in ['www', 'api', 'cdn']:
+            tpl.record_set(name.capitalize(), HostedZoneName='example.com.',
+                           Name='{}.example.com.'.format(name), Type='A',
+                           TTL='300', ResourceRecords=[TRef('Ip')])
+        tpl.output('Www', Value=Join('', ['http://', TRef('Www')]))
+
+        t = tpl.to_dict()
+
+        self.assertEquals(sorted(t['Resources']),
+                          ['TestExampleComRecords0', 'TestIp'])
+        self.assertEquals(tpl.record_groups, {'TestExampleComRecords0': [
+            'TestApi', 'TestCdn', 'TestWww']})
+        self.assertEquals(
+            t['Resources']['TestExampleComRecords0']['Properties'][
+                'RecordSets'][0],
+            {'Name': 'api.example.com.', 'Type': 'A', 'TTL': '300',
+             'ResourceRecords': [{'Ref': 'TestIp'}]})
+        self.assertEquals(t['Outputs']['Www']['Value'], {'Fn::Join': [
+            '', ['http://', 'www.example.com.']]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import random
+import unittest
+
+from troposphere.ec2 import SecurityGroupRule
+
+from troposphere_ext import template
+from troposphere_ext.rules import compact, aggregate, parse_cidr, _normalize
+
+
+def _rule(cidr, low, high, protocol='tcp'):
+    return {'IpProtocol': protocol, 'CidrIp': cidr,
+            'FromPort': low, 'ToPort': high}
+
+
+def _allows(rules, protocol, address, port):
+    """port is a (type, code) tuple for icmp"""
+    for name, network, length, low, high in rules:
+        mask = 0xffffffff ^ (0xffffffff >> length)
+        if address & mask != network or name not in ('-1', protocol):
+            continue
+        if name == '-1':
+            return True
+        if name == 'icmp':
+            if low == -1 or low == port[0] and high in (-1, port[1]):
+                return True
+        elif low <= port <= high:
+            return True
+    return False
+
+
+def _port(protocol):
+    if protocol == 'icmp':
+        return random.choice([0, 3, 8]), random.choice([0, 1])
+    return random.randint(0, 26)
+
+
+class TestRules(unittest.TestCase):
+
+    def test_aggregate(self):
+        blocks = [parse_cidr(c) for c in [
+            '10.0.0.0/25', '10.0.0.128/25', '10.0.1.0/24', '10.0.1.8/29',
+            '10.0.3.0/24']]
+
+        self.assertEquals(aggregate(blocks), [parse_cidr('10.0.0.0/23'),
+                                              parse_cidr('10.0.3.0/24')])
+
+    def test_compact(self):
+        rules = [_rule('10.0.0.0/24', 80, 80),
+                 _rule('10.0.1.0/24', 80, 80),
+                 _rule('10.0.0.0/23', 81, 90),
+                 _rule('10.0.0.5/32', 85, 85),
+                 _rule('10.0.2.0/24', 22, 22, '6'),
+                 _rule('10.0.2.0/24', 22, 22, 'udp'),
+                 _rule('10.0.9.0/24', -1, -1, '-1'),
+                 _rule('10.0.9.7/32', 443, 443),
+                 {'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22,
+                  'SourceSecurityGroupId': 'sg-1'},
+                 {'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22,
+                  'SourceSecurityGroupId': 'sg-1'}]
+
+        self.assertEquals(compact(rules), [
+            {'IpProtocol': '-1', 'CidrIp': '10.0.9.0/24',
+             'FromPort': -1, 'ToPort': -1},
+            _rule('10.0.2.0/24', 22, 22),
+            _rule('10.0.0.0/23', 80, 90),
+            _rule('10.0.2.0/24', 22, 22, 'udp'),
+            rules[8]])
+
+    def _assert_same_traffic(self, rules, probes=200):
+        compacted = compact(rules)
+
+        self.assertTrue(len(compacted) <= len(rules))
+        rules = [_normalize(r) for r in rules]
+        compacted = [_normalize(r) for r in compacted]
+        for _ in range(probes):
+            protocol = random.choice(['tcp', 'udp', 'icmp'])
+            probe = (protocol, 10 << 24 | random.randint(0, 4095),
+                     _port(protocol))
+            self.assertEquals(_allows(rules, *probe),
+                              _allows(compacted, *probe))
+
+    def test_compact_allows_the_same_traffic(self):
+        random.seed(7)
+        for _ in range(50):
+            rules = []
+            for _ in range(30):
+                length = random.randint(22, 32)
+                network = (10 << 24 | random.randint(0, 1023) << 2) & \
+                    (0xffffffff ^ (0xffffffff >> length))
+                cidr = '10.{}.{}.{}/{}'.format(
+                    network >> 16 & 255, network >> 8 & 255, network & 255,
+                    length)
+                name = random.choice(['tcp', 'udp', 'icmp'])
+                if name == 'icmp':
+                    rules.append(_rule(cidr, random.choice([-1, 0, 3, 8]),
+                                       random.choice([-1, 0, 1]), name))
+                else:
+                    low = random.randint(0, 20)
+                    rules.append(_rule(cidr, low, low + random.randint(0, 5),
+                                       name))
+            self._assert_same_traffic(rules)
+
+        # any icmp type, whatever the code
+        self._assert_same_traffic([_rule('10.0.0.0/24', -1, -1, 'icmp'),
+                                   _rule('10.0.0.0/24', -1, 0, 'icmp'),
+                                   _rule('10.0.0.0/24', 22, 22)])
+
+    def test_compact_any_icmp(self):
+        rules = [_rule('10.0.0.0/24', -1, -1, 'icmp'),
+                 _rule('10.0.0.0/24', -1, 0, 'icmp'),
+                 _rule('10.0.0.0/24', 22, 22)]
+
+        self.assertEquals(sorted(compact(rules)), sorted([rules[0],
+                                                          rules[2]]))
+
+    def test_compact_keeps_rules_it_cannot_shorten(self):
+        rules = [_rule('10.0.0.0/24', '80', '80'),
+                 _rule('10.0.2.0/24', '80', '80')]
+
+        self.assertTrue(compact(rules) is rules)
+
+    def test_template_compact_rules(self):
+        tpl = template('Test').compact_rules()
+        tpl.security_group('Web', GroupDescription='web', VpcId='vpc-1',
+                           SecurityGroupIngress=[
+                               SecurityGroupRule(IpProtocol='tcp',
+                                                 CidrIp='10.0.{}.0/24'
+                                                 .format(i),
+                                                 FromPort='443',
+                                                 ToPort='443')
+                               for i in range(256)])
+
+        ingress = tpl.to_dict()['Resources']['TestWeb']['Properties'][
+            'SecurityGroupIngress']
+
+        self.assertEquals(ingress, [_rule('10.0.0.0/16', 443, 443)])
+        self.assertEquals(tpl.rule_counts,
+                          {'TestWeb': {'SecurityGroupIngress': (256, 1)}})
@@ -0,0 +1,100 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import unittest
+
+from troposphere_ext import template
+from troposphere_ext.sharding import partition, shard
+from troposphere_ext.validator import validate
+
+URL = 'https://s3.amazonaws.com/templates/{title}.json'
+
+
+def _eip(**properties):
+    return {'Type': 'AWS::EC2::EIP', 'Properties': properties}
+
+
+class TestSharding(unittest.TestCase):
+
+    def _chain(self):
+        """A chain of four dependent resources and two independent ones"""
+        return {
+            'Parameters': {'Domain': {'Type': 'String'}},
+            'Resources': {
+                'A': _eip(Domain={'Ref': 'Domain'}),
+                'B': _eip(InstanceId={'Ref': 'A'}),
+                'C': _eip(InstanceId={'Fn::GetAtt': ['B', 'AllocationId']}),
+                'D': dict(_eip(), DependsOn=['A', 'C']),
+                'X': _eip(),
+                'Y': _eip()},
+            'Outputs': {'D': {'Value': {'Ref': 'D'}}}}
+
+    def test_partition(self):
+        shards = partition(self._chain(), max_resources=2)
+
+        self.assertEquals(shards, [['X', 'Y'], ['A', 'B'], ['C', 'D']])
+
+    def test_partition_rejects_cycles(self):
+        with self.assertRaises(ValueError):
+            partition({'Resources': {'A': _eip(InstanceId={'Ref': 'B'}),
+                                     'B': _eip(InstanceId={'Ref': 'A'})}})
+
+    def test_shard_rewires_references(self):
+        parent, children = shard(self._chain(), 'Test', URL,
+                                 max_resources=2)
+
+        self.assertEquals(children.keys(),
+                          ['TestShard0', 'TestShard1', 'TestShard2'])
+        self.assertEquals(validate(parent), [])
+
+        first, second = children['TestShard1'], children['TestShard2']
+        self.assertEquals(first['Outputs'], {
+            'BAllocationId': {'Value': {'Fn::GetAtt': ['B', 'AllocationId']}}})
+        self.assertEquals(second['Resources']['C']['Properties'],
+                          {'InstanceId': {'Ref': 'BAllocationId'}})
+        self.assertEquals(second['Resources']['D']['DependsOn'], ['C'])
+
+        stack = parent['Resources']['TestShard2']
+        self.assertEquals(stack['DependsOn'], ['TestShard1'])
+        self.assertEquals(stack['Properties']['Parameters'], {
+            'BAllocationId': {'Fn::GetAtt': ['TestShard1',
+                                             'Outputs.BAllocationId']}})
+        self.assertEquals(parent['Resources']['TestShard1']['Properties'],
+                          {'TemplateURL': URL.format(title='TestShard1'),
+                           'Parameters': {'Domain': {'Ref': 'Domain'}}})
+        self.assertEquals(parent['Outputs']['D']['Value'],
+                          {'Fn::GetAtt': ['TestShard2', 'Outputs.D']})
+
+    def test_shard_list_attributes(self):
+        servers = {'Fn::GetAtt': ['Zone', 'NameServers']}
+        parent, children = shard({
+            'Resources': {
+                'Zone': {'Type': 'AWS::Route53::HostedZone',
+                         'Properties': {'Name': 'example.com'}},
+                'Set': {'Type': 'AWS::Route53::RecordSet',
+                        'Properties': {'ResourceRecords': servers}}},
+            'Outputs': {'Servers': {'Value': {'Fn::Join': [',', servers]}}}},
+            'Test', URL, max_resources=1)
+
+        zone, records = children['TestShard0'], children['TestShard1']
+        self.assertEquals(zone['Outputs']['ZoneNameServers']['Value'],
+                          {'Fn::Join': [',', servers]})
+        self.assertEquals(records['Parameters'], {
+            'ZoneNameServers': {'Type': 'CommaDelimitedList'}})
+        self.assertEquals(records['Resources']['Set']['Properties'],
+                          {'ResourceRecords': {'Ref': 'ZoneNameServers'}})
+        self.assertEquals(parent['Outputs']['Servers']['Value'],
+                          {'Fn::Join': [',', {'Fn::Split': [',', {
+                              'Fn::GetAtt': ['TestShard0',
+                                             'Outputs.ZoneNameServers']}]}]})
+
+    def test_template_shard(self):
+        tpl = template('Test')
+        for i in range(3):
+            tpl.eip('Ip{}'.format(i), Domain='vpc')
+
+        parent, children = tpl.shard(URL, max_resources=1)
+
+        self.assertEquals(len(children), 3)
+        self.assertEquals(sorted(parent['Resources']), children.keys())
@@ -0,0 +1,112 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+import collections
+
+from troposphere_ext import SRef
+from troposphere_ext.snapshot import Snapshot
+
+Resource = collections.namedtuple('Resource', [
+    'logical_resource_id', 'physical_resource_id', 'resource_type'])
+
+
+class _Stack(object):
+
+    def __init__(self, name, updated=None, status='CREATE_COMPLETE',
+                 namespace=None):
+        self.stack_name = name
+        self.stack_status = status
+        self.tags = {'namespace': namespace} if namespace else []
+        self.creation_time = datetime.datetime(2015, 6, 1, 12, 0, 0)
+        if updated is not None:
+            self.LastUpdatedTime = updated
+
+
+class _Page(list):
+
+    next_token = None
+
+
+class _Connection(object):
+
+    def __init__(self, stacks):
+        self.stacks = stacks
+        self.calls = []
+
+    def describe_stacks(self, stack_name_or_id=None, next_token=None):
+        # two stacks per page
+        start = int(next_token or 0)
+        page = _Page(self.stacks[start:start + 2])
+        if start + 2 < len(self.stacks):
+            page.next_token = str(start + 2)
+        return page
+
+    def list_stack_resources(self, stack_name_or_id, next_token=None):
+        self.calls.append((stack_name_or_id, next_token))
+        if next_token is None:
+            page = _Page([Resource('Vpc', 'vpc-1', 'AWS::EC2::VPC')])
+            page.next_token = 'more'
+        else:
+            page = _Page([Resource('Subnet', 'subnet-1',
+                                   'AWS::EC2::Subnet')])
+        return page
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.conn = _Connection([
+            _Stack('ns-vpc'),
+            _Stack('ns-app', '2015-06-02T12:00:00Z', namespace='ns'),
+            _Stack('other-vpc'), _Stack('ns-old', status='DELETE_COMPLETE'),
+            _Stack('ns-eu-vpc', namespace='ns-eu')])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SRef._SRef__snapshots.clear()
+
+    def test_capture(self):
+        snapshot = Snapshot.capture(self.conn, 'ns', 'us-west-2')
+
+        # ns-eu-vpc is tagged with another namespace
+        self.assertEquals(sorted(snapshot.stacks), ['ns-app', 'ns-vpc'])
+        self.assertEquals(len(self.conn.calls), 4)
+        self.assertEquals(snapshot.stacks['ns-app']['updated'],
+                          '2015-06-02T12:00:00')
+        self.assertEquals([r.physical_resource_id
+                           for r in snapshot.resources('ns-vpc')],
+                          ['subnet-1', 'vpc-1'])
+
+    def test_save_and_load(self):
+        path = os.path.join(self.directory, 'ns', 'snapshot.json')
+        Snapshot.capture(self.conn, 'ns', 'us-west-2').save(path)
+
+        snapshot = Snapshot.load(path)
+
+        self.assertEquals(snapshot.region, 'us-west-2')
+        with self.assertRaises(LookupError):
+            snapshot.resources('ns-missing')
+
+    def test_stale(self):
+        snapshot = Snapshot.capture(self.conn, 'ns', 'us-west-2')
+        self.assertEquals(snapshot.stale(self.conn), [])
+
+        self.conn.stacks[0].LastUpdatedTime = '2015-06-03T12:00:00.120Z'
+        self.conn.stacks.append(_Stack('ns-new'))
+
+        self.assertEquals(snapshot.stale(self.conn), ['ns-new', 'ns-vpc'])
+
+    def test_sref_resolves_from_snapshot(self):
+        SRef.use_snapshot(Snapshot.capture(self.conn, 'ns', 'us-west-2'))
+
+        self.assertEquals(SRef('us-west-2', 'ns-vpc', 'Subnet').JSONrepr(),
+                          'subnet-1')
+        with self.assertRaises(LookupError):
+            SRef('us-west-2', 'ns-db', 'Subnet').JSONrepr()
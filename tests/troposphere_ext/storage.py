@@ -0,0 +1,149 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import threading
+
+from troposphere_ext.storage import LocalStorage, ArtifactStore
+
+
+class _CountingStorage(LocalStorage):
+
+    writes = 0
+
+    def _write(self, key, body):
+        self.writes += 1
+        super(_CountingStorage, self)._write(key, body)
+
+
+class _OverlappingStorage(LocalStorage):
+    """Waits in _write until a second write is in progress"""
+
+    def __init__(self, directory):
+        super(_OverlappingStorage, self).__init__(directory)
+        self.entered = []
+        self.waited = []
+        self.overlapped = threading.Event()
+
+    def _write(self, key, body):
+        self.entered.append(key)
+        if len(self.entered) == 2:
+            self.overlapped.set()
+        self.waited.append(self.overlapped.wait(5))
+        super(_OverlappingStorage, self)._write(key, body)
+
+
+class TestLocalStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put(self):
+        storage = LocalStorage(self.directory)
+
+        url = storage.put('{"Resources": {}}')
+        path = storage.path(storage.key('{"Resources": {}}'))
+
+        self.assertEquals(url, 'file://{}'.format(path))
+        with open(path) as f:
+            self.assertEquals(f.read(), '{"Resources": {}}')
+
+    def test_put_is_content_addressed(self):
+        storage = _CountingStorage(self.directory)
+
+        first = storage.put('{"a": 1}')
+        second = storage.put('{"a": 1}')
+        other = storage.put('{"a": 2}')
+
+        self.assertEquals(first, second)
+        self.assertNotEquals(first, other)
+        self.assertEquals(storage.writes, 2)
+
+    def test_put_skips_existing(self):
+        LocalStorage(self.directory).put('{}')
+        storage = _CountingStorage(self.directory)
+
+        storage.put('{}')
+
+        self.assertEquals(storage.writes, 0)
+        self.assertEquals(len(os.listdir(os.path.join(self.directory,
+                                                      'templates'))), 1)
+
+    def test_put_in_parallel(self):
+        storage = _OverlappingStorage(self.directory)
+
+        threads = [threading.Thread(target=storage.put, args=(body,))
+                   for body in ['{"a": 1}', '{"a": 2}']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the upload of one template does not wait for another
+        self.assertEquals(storage.waited, [True, True])
+        self.assertEquals(len(os.listdir(os.path.join(self.directory,
+                                                      'templates'))), 2)
+
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_skips_unchanged(self):
+        store = ArtifactStore(self.directory)
+
+        path, changed = store.write('ns', 'app', 'us-west-2', '{"a": 1}')
+        os.utime(path, (0, 0))
+        _, unchanged = ArtifactStore(self.directory).write(
+            'ns', 'app', 'us-west-2', '{"a": 1}')
+
+        self.assertEquals(path, os.path.join(self.directory, 'us-west-2',
+                                             'ns-app.json'))
+        self.assertTrue(changed)
+        self.assertFalse(unchanged)
+        self.assertEquals(os.path.getmtime(path), 0)
+        self.assertTrue(store.write('ns', 'app', 'us-west-2',
+                                    '{"a": 2}')[1])
+
+    def test_manifest(self):
+        ArtifactStore(self.directory).write('ns', 'app', 'us-east-1', '{}')
+
+        with open(os.path.join(self.directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        store = ArtifactStore(self.directory)
+
+        self.assertEquals(manifest['us-east-1/ns-app.json']['bytes'], 2)
+        self.assertEquals(store.read('ns', 'app', 'us-east-1'), '{}')
+        with self.assertRaises(LookupError):
+            store.read('ns', 'app', 'us-west-2')
+
+        with open(store.path('ns', 'app', 'us-east-1'), 'w') as f:
+            f.write('{"edited": true}')
+        with self.assertRaises(ValueError):
+            store.read('ns', 'app', 'us-east-1')
+
+    def test_manifest_shared_between_processes(self):
+        # stores opened before either wrote, as two trop processes would
+        first = ArtifactStore(self.directory)
+        second = ArtifactStore(self.directory)
+
+        first.write('ns', 'app', 'us-west-2', '{}')
+        second.write('ns', 'db', 'us-west-2', '{}')
+
+        with open(os.path.join(self.directory, 'manifest.json')) as f:
+            self.assertEquals(sorted(json.load(f)),
+                              ['us-west-2/ns-app.json',
+                               'us-west-2/ns-db.json'])
+        self.assertEquals(first.read('ns', 'db', 'us-west-2'), '{}')
@@ -0,0 +1,224 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import json
+import logging
+import unittest
+import collections
+
+from troposphere_ext.teardown import Teardown, dependencies, waves, \
+    excluding
+
+Resource = collections.namedtuple('Resource', [
+    'logical_resource_id', 'physical_resource_id', 'resource_type'])
+
+Event = collections.namedtuple('Event', [
+    'event_id', 'logical_resource_id', 'resource_type', 'resource_status',
+    'resource_status_reason'])
+
+STACK_TYPE = 'AWS::CloudFormation::Stack'
+
+
+class _Stack(object):
+
+    def __init__(self, name, status='CREATE_COMPLETE', namespace='ns'):
+        self.stack_name = name
+        self.stack_id = 'id/{}'.format(name)
+        self.stack_status = status
+        # boto leaves tags an empty list when there are none
+        self.tags = {'namespace': namespace} if namespace else []
+
+
+class _Page(list):
+
+    next_token = None
+
+
+class _Connection(object):
+    """Deletes a stack one sleep after delete_stack is called, stacks in
+       fail end up DELETE_FAILED instead"""
+
+    def __init__(self, bodies, physical_ids, fail=()):
+        self.bodies = bodies
+        self.physical_ids = physical_ids
+        self.fail = fail
+        self.stacks = dict((name, _Stack(name)) for name in bodies)
+        self.events = dict((name, [Event('{}-0'.format(name), name,
+                                         STACK_TYPE, 'CREATE_COMPLETE',
+                                         None)])
+                           for name in bodies)
+        self.deleting = []
+        self.deleted = []
+        self.event_calls = 0
+
+    def tick(self, seconds):
+        for name in self.deleting:
+            events = self.events[name]
+            if name in self.fail:
+                events.append(Event('{}-{}'.format(name, len(events)),
+                                    'Bucket', 'AWS::S3::Bucket',
+                                    'DELETE_FAILED', 'Bucket not empty'))
+                status = 'DELETE_FAILED'
+            else:
+                status = 'DELETE_COMPLETE'
+            events.append(Event('{}-{}'.format(name, len(events)), name,
+                                STACK_TYPE, status, None))
+            self.stacks[name].stack_status = status
+        self.deleting = []
+
+    def describe_stacks(self, stack_name_or_id=None, next_token=None):
+        if stack_name_or_id is not None:
+            return _Page([self.stacks[stack_name_or_id]])
+        return _Page(self.stacks[name] for name in sorted(self.stacks))
+
+    def get_template(self, name):
+        return {'GetTemplateResponse': {'GetTemplateResult': {
+            'TemplateBody': self.bodies[name]}}}
+
+    def list_stack_resources(self, name, next_token=None):
+        return _Page(Resource('R', physical_id, 'AWS::EC2::Subnet')
+                     for physical_id in self.physical_ids[name])
+
+    def delete_stack(self, name):
+        self.deleting.append(name)
+        self.deleted.append(name)
+        self.events[name].append(Event(
+            '{}-{}'.format(name, len(self.events[name])), name, STACK_TYPE,
+            'DELETE_IN_PROGRESS', None))
+
+    def describe_stack_events(self, stack_id, next_token):
+        # newest first, two events per page
+        self.event_calls += 1
+        events = list(reversed(self.events[stack_id[3:]]))
+        start = int(next_token or 0)
+        page = _Page(events[start:start + 2])
+        if start + 2 < len(events):
+            page.next_token = str(start + 2)
+        return page
+
+
+def _body(*values):
+    return json.dumps({'Resources': {'Res': {
+        'Type': 'AWS::EC2::Instance',
+        'Properties': {'UserData': ' '.join(values)}}}})
+
+
+class TestTeardown(unittest.TestCase):
+
+    def setUp(self):
+        # app references the vpc and db stacks, db references the vpc
+        self.conn = _Connection({
+            'ns-vpc': _body(),
+            'ns-db': _body('subnet-1'),
+            'ns-app': _body('echo', 'ns-db', 'subnet-2'),
+        }, {
+            'ns-vpc': ['subnet-1', 'subnet-2'],
+            'ns-db': ['db-1'],
+            'ns-app': ['i-1'],
+        })
+        self.clock = [0]
+
+    def _teardown(self, parallel=4):
+        def _sleep(seconds):
+            self.clock[0] += seconds
+            self.conn.tick(seconds)
+        return Teardown(logging.getLogger('test'), 'ns', 'us-west-2',
+                        self.conn, parallel, interval=5,
+                        clock=lambda: self.clock[0], sleep=_sleep)
+
+    def test_dependencies(self):
+        references = dependencies(
+            ['ns-vpc', 'ns-db', 'ns-app'],
+            self.conn.bodies, dict((name, set(ids)) for name, ids
+                                   in self.conn.physical_ids.iteritems()))
+
+        self.assertEquals(references, {'ns-vpc': set(),
+                                       'ns-db': set(['ns-vpc']),
+                                       'ns-app': set(['ns-db', 'ns-vpc'])})
+
+    def test_stacks(self):
+        self.conn.stacks['ns-eu-app'] = _Stack('ns-eu-app', namespace='ns-eu')
+        self.conn.stacks['ns-old'] = _Stack('ns-old', namespace=None)
+        teardown = self._teardown()
+
+        self.assertEquals(teardown.stacks(), ['ns-app', 'ns-db', 'ns-vpc'])
+        self.assertEquals(teardown.stacks(True),
+                          ['ns-app', 'ns-db', 'ns-old', 'ns-vpc'])
+
+    def test_excluding(self):
+        references = {'ns-vpc': set(), 'ns-db': set(['ns-vpc']),
+                      'ns-app': set(['ns-db']), 'ns-web': set(['ns-vpc'])}
+
+        self.assertEquals(excluding(references, ['ns-app']),
+                          {'ns-web': set()})
+        self.assertEquals(excluding(references, ['ns-web']),
+                          {'ns-db': set(), 'ns-app': set(['ns-db'])})
+
+    def test_waves(self):
+        self.assertEquals(waves({'a': set(['c']), 'b': set(['c']),
+                                 'c': set(['d']), 'd': set()}),
+                          [['a', 'b'], ['c'], ['d']])
+        self.assertRaises(ValueError, waves, {'a': set(['b']),
+                                              'b': set(['a'])})
+
+    def test_run(self):
+        teardown = self._teardown()
+        results = [(name, value['status']) for name, kind, value
+                   in teardown.run(teardown.plan()) if kind == 'result']
+
+        self.assertEquals(self.conn.deleted, ['ns-app', 'ns-db', 'ns-vpc'])
+        self.assertEquals(results, [('ns-app', 'DELETE_COMPLETE'),
+                                    ('ns-db', 'DELETE_COMPLETE'),
+                                    ('ns-vpc', 'DELETE_COMPLETE')])
+        self.assertEquals(teardown.results['ns-db']['seconds'], 5)
+
+    def test_run_parallel(self):
+        references = {'ns-app': set(['ns-vpc']), 'ns-db': set(['ns-vpc']),
+                      'ns-vpc': set()}
+        teardown = self._teardown(parallel=1)
+        list(teardown.run(references))
+
+        self.assertEquals(self.conn.deleted, ['ns-app', 'ns-db', 'ns-vpc'])
+        self.assertEquals(self.clock[0], 15)
+
+        self.conn = _Connection(self.conn.bodies, self.conn.physical_ids)
+        self.clock = [0]
+        list(self._teardown(parallel=2).run(references))
+
+        self.assertEquals(self.clock[0], 10)
+
+    def test_run_failed(self):
+        self.conn.fail = ['ns-db']
+        teardown = self._teardown()
+        events = [(name, value) for name, kind, value
+                  in teardown.run(teardown.plan()) if kind == 'event']
+
+        self.assertEquals(self.conn.deleted, ['ns-app', 'ns-db'])
+        self.assertEquals(teardown.results['ns-db']['status'],
+                          'DELETE_FAILED')
+        self.assertEquals(teardown.results['ns-db']['reason'],
+                          'Bucket not empty')
+        self.assertEquals(teardown.results['ns-vpc']['status'], 'SKIPPED')
+        # only the events of the delete are streamed
+        self.assertEquals([e.resource_status for name, e in events
+                           if name == 'ns-db'],
+                          ['DELETE_IN_PROGRESS', 'DELETE_FAILED',
+                           'DELETE_FAILED'])
+
+    def test_new_events(self):
+        teardown = self._teardown()
+        watched = teardown._start('ns-vpc')
+        for _ in range(4):
+            self.conn.delete_stack('ns-vpc')
+        self.conn.deleting = []
+        self.conn.event_calls = 0
+
+        self.assertEquals(len(teardown._new_events(watched)), 5)
+        self.assertEquals(self.conn.event_calls, 3)
+        self.assertEquals(teardown._new_events(watched), [])
+        self.assertEquals(self.conn.event_calls, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
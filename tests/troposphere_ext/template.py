@@ -8,8 +8,12 @@ import unittest
 from troposphere import Tags
 from troposphere.s3 import Bucket
 from troposphere.ec2 import Tag, Instance, EIP
+from troposphere.autoscaling import LaunchConfiguration
+from troposphere.elasticloadbalancing import LoadBalancer, Listener
 
-from troposphere_ext import Template, template
+from troposphere_ext import Template, template, TRef, TGetAtt, SRef
+from troposphere_ext import utils
+from troposphere_ext.dedup import merge, MERGEABLE
 
 
 class TestTemplate(unittest.TestCase):
@@ -28,6 +32,15 @@ class TestTemplate(unittest.TestCase):
         self.assertEquals(eip.title, 'TestSomeEip')
         self.assertFalse(hasattr(eip, 'Tags'))
 
+    def test_register_resource_keeps_titles_with_name(self):
+        tpl = template('Web')
+
+        for title in ['TestWebBucket', 'WebServer', 'Website', 'Logs']:
+            tpl.add_resource(Bucket(title))
+
+        self.assertEquals(sorted(tpl._resources), [
+            'TestWebBucket', 'WebLogs', 'WebServer', 'Website'])
+
     def test_register_resource_with_tags_Tag_support(self):
         tpl = template('Test')
 
@@ -161,3 +174,167 @@ class TestTemplate(unittest.TestCase):
                                                     Domain='Test2')])
 
         self.assertTrue(isinstance(resource, list))
+
+    # -- test trusted
+
+    def test_trusted_defers_validation(self):
+        tpl = template('Test').trusted()
+
+        instance = tpl._create_resource(Instance, 'SomeInstance',
+                                        ImageId=5)[0]
+        tpl._create_resource(Bucket, 'SomeBucket', BucketName=3)
+
+        self.assertEquals(instance.ImageId, 5)
+        with self.assertRaises(ValueError) as ctx:
+            tpl.to_json()
+        self.assertTrue('TestSomeInstance.ImageId' in str(ctx.exception))
+        self.assertTrue('TestSomeBucket' in str(ctx.exception))
+
+    def test_trusted_matches_untrusted_output(self):
+        def _build(tpl):
+            tpl.instance('SomeInstance', ImageId='ami-test',
+                         Tags=[Tag('Test', 'test-tag')])
+            tpl.eip('SomeEip', InstanceId='Test', Domain='Test')
+            return tpl.to_json()
+
+        self.assertEquals(_build(template('Test').trusted()),
+                          _build(template('Test')))
+
+    def test_trusted_only_while_building(self):
+        template('Test').trusted()
+
+        with self.assertRaises(TypeError):
+            EIP('SomeEip', InstanceId=5)
+
+    # -- test shared helpers
+
+    def test_flyweights(self):
+        tpl = template('Test')
+        eip = EIP('Ip', Domain='vpc')
+        other = EIP('Ip', Domain='vpc')
+
+        self.assertIs(tpl.ref(eip), tpl.ref(eip))
+        self.assertIsNot(tpl.ref(eip), tpl.ref(other))
+        self.assertIs(tpl.tref('Ip'), tpl.tref('Ip'))
+        self.assertIsNot(tpl.tref('Ip'), tpl.ref('Ip'))
+        self.assertIs(tpl.get_att('Ip', 'AllocationId'),
+                      tpl.get_att('Ip', 'AllocationId'))
+        self.assertIsNot(tpl.get_att('Ip', 'AllocationId'),
+                         tpl.get_att('Ip', 'PublicIp'))
+        self.assertIsNot(tpl.ref(eip), template('Other').ref(eip))
+
+        # Ref captures the title, a renamed resource gets a new helper
+        before = tpl.ref(eip)
+        tpl.eip(eip)
+        self.assertEquals(before.title, 'Ip')
+        self.assertEquals(tpl.ref(eip).title, 'TestIp')
+
+    def test_intern_str(self):
+        value = ''.join(['Test', 'Ip'])
+
+        self.assertIs(utils.intern_str(value), intern('TestIp'))
+        # only byte strings can be interned
+        self.assertIsInstance(utils.intern_str(u'TestIp'), unicode)
+
+        tpl = template('Test')
+        tpl.instance('Host', ImageId='ami-12345678')
+        host = tpl.get_resource('Host')
+        self.assertIs(host.title, intern('TestHost'))
+        self.assertIs(host.Tags[0].data['Value'], intern('test_host'))
+
+    def test_helpers_use_slots(self):
+        for helper in [TRef('Ip'), TGetAtt('Ip', 'PublicIp'),
+                       SRef('us-west-2', 'ns-vpc', 'Ip')]:
+            self.assertEquals(helper.__dict__, {})
+
+    # -- test identity map and dedup
+
+    def _group(self, tpl, title, lb):
+        config = LaunchConfiguration('{}Config'.format(title),
+                                     ImageId='ami-test',
+                                     InstanceType='t2.micro')
+        tpl.auto_scaling_group(title, LaunchConfiguration=config,
+                               LoadBalancers=[lb], MinSize='1',
+                               MaxSize='2', AvailabilityZones=['a'])
+
+    def test_register_resource_idempotent(self):
+        tpl = template('Test')
+        lb = LoadBalancer('Lb', Listeners=[Listener(
+            LoadBalancerPort='80', InstancePort='80', Protocol='HTTP')],
+            AvailabilityZones=['a'])
+
+        self._group(tpl, 'Web', lb)
+        self._group(tpl, 'Api', lb)
+
+        resources = tpl.to_dict()['Resources']
+        self.assertEquals(lb.title, 'TestLb')
+        self.assertEquals(len(lb.Tags), 1)
+        self.assertEquals(resources['TestWeb']['Properties']
+                          ['LoadBalancerNames'], [{'Ref': 'TestLb'}])
+        self.assertEquals(resources['TestApi']['Properties']
+                          ['LoadBalancerNames'], [{'Ref': 'TestLb'}])
+
+    def test_deduplicate(self):
+        tpl = template('Test').deduplicate()
+        lb = LoadBalancer('Lb', Listeners=[Listener(
+            LoadBalancerPort='80', InstancePort='80', Protocol='HTTP')],
+            AvailabilityZones=['a'])
+
+        self._group(tpl, 'Web', lb)
+        self._group(tpl, 'Api', lb)
+        tpl.output('Config', Value=tpl.ref('TestWebConfig'))
+
+        t = tpl.to_dict()
+        self.assertEquals(sorted(t['Resources']),
+                          ['TestApi', 'TestApiConfig', 'TestLb', 'TestWeb'])
+        self.assertEquals(t['Resources']['TestWeb']['Properties']
+                          ['LaunchConfigurationName'],
+                          {'Ref': 'TestApiConfig'})
+        self.assertEquals(t['Outputs']['Config']['Value'],
+                          {'Ref': 'TestApiConfig'})
+
+    def test_merge_keeps_identities(self):
+        group = {'Type': 'AWS::EC2::SecurityGroup',
+                 'Properties': {'GroupDescription': 'app'}}
+
+        def _ingress(group, source):
+            return {'Type': 'AWS::EC2::SecurityGroupIngress',
+                    'Properties': {'GroupId': {'Ref': group},
+                                   'SourceSecurityGroupId': {'Ref': source},
+                                   'IpProtocol': 'tcp', 'FromPort': '5432',
+                                   'ToPort': '5432'}}
+
+        t, aliases = merge({'Resources': {
+            'Web': group, 'Db': group, 'Cache': group,
+            'DbFromWeb': _ingress('Db', 'Web'),
+            'CacheFromWeb': _ingress('Cache', 'Web')}})
+
+        self.assertEquals(aliases, {})
+        self.assertEquals(len(t['Resources']), 5)
+
+    def test_merge_until_unchanged(self):
+        role = {'Type': 'AWS::IAM::Role', 'Properties': {'Path': '/'}}
+        t, aliases = merge({'Resources': {
+            'RoleA': role, 'RoleB': role,
+            'ProfileA': {'Type': 'AWS::IAM::InstanceProfile',
+                         'Properties': {'Roles': [{'Ref': 'RoleA'}]}},
+            'ProfileB': {'Type': 'AWS::IAM::InstanceProfile',
+                         'Properties': {'Roles': [{'Ref': 'RoleB'}]}},
+            'Host': {'Type': 'AWS::EC2::Instance', 'DependsOn': 'RoleB',
+                     'Properties': {'IamInstanceProfile':
+                                    {'Fn::GetAtt': ['ProfileB', 'Arn']}}},
+            'Other': {'Type': 'AWS::EC2::Instance', 'DependsOn': 'RoleB',
+                      'Properties': {'IamInstanceProfile':
+                                     {'Fn::GetAtt': ['ProfileB', 'Arn']}}}}},
+            types=MERGEABLE | set(['AWS::IAM::Role']))
+
+        self.assertEquals(aliases, {'RoleB': 'RoleA',
+                                    'ProfileB': 'ProfileA'})
+        self.assertEquals(sorted(t['Resources']),
+                          ['Host', 'Other', 'ProfileA', 'RoleA'])
+        self.assertEquals(t['Resources']['Host'],
+                          {'Type': 'AWS::EC2::Instance',
+                           'DependsOn': ['RoleA'],
+                           'Properties': {'IamInstanceProfile':
+                                          {'Fn::GetAtt': ['ProfileA',
+                                                          'Arn']}}})
@@ -0,0 +1,112 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import json
+import datetime
+import unittest
+
+from troposphere_ext.daemon import Event
+from troposphere_ext.graph import DependencyGraph
+from troposphere_ext.timeline import Timeline, last_operation, root_causes
+
+START = datetime.datetime(2015, 6, 1, 12, 0, 0)
+
+
+def _event(seconds, title, status, resource_type='AWS::EC2::VPC'):
+    if title == 'Stack':
+        resource_type = 'AWS::CloudFormation::Stack'
+    return Event(str(START + datetime.timedelta(seconds=seconds)), status,
+                 resource_type, title, None)
+
+
+EVENTS = [
+    _event(0, 'Stack', 'CREATE_IN_PROGRESS'),
+    _event(0, 'Vpc', 'CREATE_IN_PROGRESS'),
+    _event(1, 'Igw', 'CREATE_IN_PROGRESS'),
+    _event(2, 'Vpc', 'CREATE_IN_PROGRESS'),
+    _event(15, 'Vpc', 'CREATE_COMPLETE'),
+    _event(16, 'Igw', 'CREATE_COMPLETE'),
+    _event(16, 'Subnet', 'CREATE_IN_PROGRESS'),
+    _event(21, 'Subnet', 'CREATE_COMPLETE'),
+    _event(30, 'Attach', 'CREATE_IN_PROGRESS'),
+    _event(45, 'Attach', 'CREATE_COMPLETE'),
+    _event(46, 'Stack', 'CREATE_COMPLETE'),
+]
+
+
+class TestTimeline(unittest.TestCase):
+
+    def test_spans(self):
+        timeline = Timeline(EVENTS)
+
+        self.assertEquals([(s.title, s.duration()) for s in timeline.spans],
+                          [('Vpc', 15), ('Igw', 15), ('Subnet', 5),
+                           ('Attach', 15)])
+        self.assertEquals(timeline.duration(), 46)
+        self.assertEquals(timeline.concurrency()[1], 2)
+
+    def test_gaps(self):
+        gaps = [(int((start - START).total_seconds()),
+                 int((end - START).total_seconds()))
+                for start, end in Timeline(EVENTS).gaps()]
+
+        self.assertEquals(gaps, [(21, 30), (45, 46)])
+
+    def test_critical_path(self):
+        graph = DependencyGraph({'Resources': {
+            'Vpc': {}, 'Igw': {}, 'Subnet': {'DependsOn': 'Vpc'},
+            'Attach': {'DependsOn': ['Vpc', 'Igw']}}})
+
+        timeline = Timeline(EVENTS)
+
+        self.assertEquals([s.title for s in timeline.critical_path()],
+                          ['Igw', 'Subnet', 'Attach'])
+        self.assertEquals([s.title for s in timeline.critical_path(graph)],
+                          ['Igw', 'Attach'])
+
+    def test_live(self):
+        timeline = Timeline(EVENTS[:7])
+
+        chart = timeline.gantt(width=16)
+
+        self.assertTrue('Subnet |' in chart)
+        self.assertTrue(chart.splitlines()[2].rstrip().endswith(
+            '0s IN_PROGRESS'))
+        self.assertEquals(json.loads(timeline.to_json())['resources'][2],
+                          {'title': 'Subnet', 'type': 'AWS::EC2::VPC',
+                           'status': None, 'reason': None, 'start': 16.0,
+                           'end': None, 'duration': 0.0})
+
+    def test_last_operation(self):
+        events = EVENTS + [_event(60, 'Stack', 'UPDATE_IN_PROGRESS'),
+                           _event(61, 'Vpc', 'UPDATE_IN_PROGRESS')]
+
+        self.assertEquals(len(last_operation(events)), 2)
+
+    def test_nested_stacks(self):
+        nested = 'AWS::CloudFormation::Stack'
+        events = EVENTS + [_event(60, 'Stack', 'UPDATE_IN_PROGRESS'),
+                           _event(61, 'Child', 'UPDATE_IN_PROGRESS', nested),
+                           _event(90, 'Child', 'UPDATE_COMPLETE', nested),
+                           _event(91, 'Stack', 'UPDATE_COMPLETE')]
+
+        operation = last_operation(events, 'Stack')
+
+        # a nested stack is a resource of the operation, not a new one
+        self.assertEquals(len(operation), 4)
+        self.assertEquals(len(last_operation(events)), 4)
+        self.assertEquals([(s.title, s.resource_type, s.duration())
+                           for s in Timeline(operation, 'Stack').spans],
+                          [('Child', nested, 29)])
+
+    def test_root_causes(self):
+        events = [_event(0, 'Stack', 'UPDATE_IN_PROGRESS'),
+                  _event(5, 'Host', 'UPDATE_FAILED')._replace(
+                      resource_status_reason='Invalid AMI'),
+                  _event(6, 'Disk', 'UPDATE_FAILED')._replace(
+                      resource_status_reason='Resource update cancelled'),
+                  _event(9, 'Stack', 'UPDATE_ROLLBACK_IN_PROGRESS')]
+
+        self.assertEquals([e.logical_resource_id
+                           for e in root_causes(events)], ['Host'])
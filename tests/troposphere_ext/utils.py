@@ -0,0 +1,304 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import os
+import sys
+import json
+import shutil
+import logging
+import datetime
+import tempfile
+import unittest
+import collections
+
+from troposphere_ext import utils
+from troposphere_ext.utils import Tropext, ModuleReloader
+
+START = datetime.datetime(2015, 6, 1, 12, 0, 0)
+
+StackEvent = collections.namedtuple('StackEvent', [
+    'event_id', 'timestamp', 'resource_status', 'resource_type',
+    'logical_resource_id', 'resource_status_reason'])
+
+Stack = collections.namedtuple('Stack', ['stack_id', 'stack_name',
+                                         'stack_status'])
+
+
+class _Events(list):
+
+    next_token = None
+
+
+class _Connection(object):
+
+    def __init__(self, status, events, later=()):
+        self.status = status
+        self.events = events
+        # events that happen one per describe_stack_events call
+        self.later = list(later)
+        self.cancelled = []
+
+    def describe_stacks(self):
+        return [Stack('id/ns-app', 'ns-app', self.status)]
+
+    def describe_stack_events(self, stack, next_token):
+        # newest first like Cloud Formation
+        events = _Events(reversed(self.events))
+        if self.later:
+            self.events.append(self.later.pop(0))
+        return events
+
+    def cancel_update_stack(self, stack):
+        self.cancelled.append(stack)
+
+    def get_template(self, stack):
+        return {'GetTemplateResponse': {'GetTemplateResult': {
+            'TemplateBody': '{}'}}}
+
+    def update_stack(self, stack, **kwargs):
+        self.updated = kwargs
+        return 'id/ns-app'
+
+
+def _event(seconds, title, status, reason=None):
+    """An event of the stack ns-app when title is Stack, Child is a
+       nested stack"""
+    resource_type = 'AWS::CloudFormation::Stack' \
+        if title in ('Stack', 'Child') else 'AWS::EC2::Instance'
+    return StackEvent('{}-{}'.format(title, status),
+                      START + datetime.timedelta(seconds=seconds),
+                      status, resource_type,
+                      'ns-app' if title == 'Stack' else title, reason)
+
+
+# reload_tpl imports reload_mid and reload_other, reload_mid imports
+# reload_base. every module records when it is executed.
+MODULES = {
+    'reload_base': 'VALUE = 1\n',
+    'reload_mid': 'import reload_base\n',
+    'reload_other': 'VALUE = 1\n',
+    'reload_tpl': '''import reload_mid
+import reload_other
+from troposphere_ext import template
+
+
+def create(**kwargs):
+    t = template(kwargs['stack_prefix'])
+    t.bucket('Data{}'.format(reload_mid.reload_base.VALUE))
+    return t
+''',
+}
+
+
+class TestModuleReloader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in MODULES:
+            self._write(name, 0)
+        sys.path.insert(0, self.directory)
+        sys.executed = []
+        self.reloader = ModuleReloader()
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        for name in MODULES:
+            sys.modules.pop(name, None)
+        del sys.executed
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, mtime, body=None):
+        path = os.path.join(self.directory, name + '.py')
+        with open(path, 'w') as f:
+            f.write('import sys\nsys.executed.append(__name__)\n')
+            f.write(MODULES[name] if body is None else body)
+        # far enough apart that the reloader always sees the change
+        os.utime(path, (1433160000 + mtime, 1433160000 + mtime))
+
+    def test_affected(self):
+        graph = {'tpl': set(['mid', 'other']), 'mid': set(['base']),
+                 'base': set(), 'other': set()}
+
+        self.assertEquals(self.reloader._affected(graph, ['base']),
+                          ['base', 'mid', 'tpl'])
+        self.assertEquals(self.reloader._affected(graph, ['other']),
+                          ['other', 'tpl'])
+        self.assertEquals(self.reloader._affected(graph, []), [])
+
+    def test_load_reloads_changed_leaf(self):
+        module = self.reloader.load('reload_tpl')
+        self.assertEquals(sorted(sys.executed), sorted(MODULES))
+        self.assertFalse(self.reloader.changed('reload_tpl'))
+
+        del sys.executed[:]
+        self._write('reload_base', 60, 'VALUE = 2\n')
+        self.assertTrue(self.reloader.changed('reload_tpl'))
+        module = self.reloader.load('reload_tpl')
+
+        # importers are reloaded after what they import, unrelated
+        # modules are left alone
+        self.assertEquals(sys.executed,
+                          ['reload_base', 'reload_mid', 'reload_tpl'])
+        self.assertEquals(module.reload_mid.reload_base.VALUE, 2)
+
+        del sys.executed[:]
+        self.reloader.load('reload_tpl')
+        self.assertEquals(sys.executed, [])
+
+    def test_watch_files(self):
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+        log = logging.getLogger('test.utils')
+        log.disabled = True
+        tropext = Tropext(log, 'app', 'ns', reloader=self.reloader)
+        watch = tropext.watch_files('reload_tpl', interval=0.01)
+
+        first = json.loads(next(watch))
+        self._write('reload_base', 60, 'VALUE = 2\n')
+        second = json.loads(next(watch))
+
+        self.assertEquals(first['Resources'].keys(), ['NsAppData1'])
+        self.assertEquals(second['Resources'].keys(), ['NsAppData2'])
+
+
+class TestTropextWatch(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+        log = logging.getLogger('test.utils')
+        log.disabled = True
+        self.tropext = Tropext(log, 'app', 'ns')
+        self.sleep = utils.time.sleep
+        utils.time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        utils.time.sleep = self.sleep
+
+    def _watch(self, conn, fail_fast=True):
+        self.tropext._conn = conn
+        return [e.logical_resource_id + ' ' + e.resource_status
+                for e in self.tropext.watch(False, fail_fast=fail_fast)]
+
+    def test_watch_ends_on_final_status(self):
+        conn = _Connection('UPDATE_IN_PROGRESS', [
+            _event(0, 'Stack', 'UPDATE_IN_PROGRESS')], later=[
+            _event(10, 'Child', 'UPDATE_COMPLETE'),
+            _event(20, 'Stack', 'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS'),
+            _event(30, 'Stack', 'UPDATE_COMPLETE')])
+
+        events = self._watch(conn, fail_fast=False)
+
+        self.assertEquals(events, [
+            'ns-app UPDATE_IN_PROGRESS', 'Child UPDATE_COMPLETE',
+            'ns-app UPDATE_COMPLETE_CLEANUP_IN_PROGRESS',
+            'ns-app UPDATE_COMPLETE'])
+
+    def test_final_status(self):
+        conn = _Connection('UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', [])
+        self.tropext._conn = conn
+        statuses = iter(['UPDATE_COMPLETE'])
+
+        def _sleep(seconds):
+            conn.status = next(statuses)
+        utils.time.sleep = _sleep
+
+        self.assertEquals(self.tropext.final_status(), 'UPDATE_COMPLETE')
+
+    def test_fail_fast_cancels_update(self):
+        conn = _Connection('UPDATE_IN_PROGRESS', [
+            _event(0, 'Stack', 'UPDATE_FAILED'),
+            _event(10, 'Stack', 'UPDATE_IN_PROGRESS'),
+            _event(20, 'Host', 'UPDATE_FAILED', 'Invalid AMI'),
+            _event(21, 'Disk', 'UPDATE_FAILED', 'Resource update cancelled'),
+            _event(30, 'Stack', 'UPDATE_ROLLBACK_COMPLETE')])
+
+        events = self._watch(conn)
+
+        self.assertEquals(conn.cancelled, ['ns-app'])
+        self.assertEquals(events[-1], 'ns-app UPDATE_ROLLBACK_COMPLETE')
+
+    def test_fail_fast_ignores_earlier_operations(self):
+        conn = _Connection('UPDATE_IN_PROGRESS', [
+            _event(0, 'Host', 'UPDATE_FAILED', 'Invalid AMI'),
+            _event(10, 'Stack', 'UPDATE_IN_PROGRESS'),
+            _event(30, 'Stack', 'UPDATE_COMPLETE')])
+
+        self._watch(conn)
+
+        self.assertEquals(conn.cancelled, [])
+
+    def test_fail_fast_stops_create(self):
+        conn = _Connection('CREATE_IN_PROGRESS', [
+            _event(0, 'Stack', 'CREATE_IN_PROGRESS'),
+            _event(20, 'Host', 'CREATE_FAILED', 'Invalid AMI'),
+            _event(21, 'Disk', 'CREATE_FAILED', 'Resource creation cancelled'),
+            _event(30, 'Stack', 'ROLLBACK_IN_PROGRESS')])
+
+        events = self._watch(conn)
+
+        self.assertEquals(conn.cancelled, [])
+        self.assertEquals(events, ['ns-app CREATE_IN_PROGRESS',
+                                   'Host CREATE_FAILED'])
+
+    def test_fail_fast_stops_create_rolling_back(self):
+        conn = _Connection('ROLLBACK_IN_PROGRESS', [
+            _event(0, 'Stack', 'CREATE_IN_PROGRESS'),
+            _event(20, 'Host', 'CREATE_FAILED', 'Invalid AMI'),
+            _event(30, 'Stack', 'ROLLBACK_IN_PROGRESS'),
+            _event(40, 'Host', 'DELETE_IN_PROGRESS')], later=[
+            _event(50, 'Stack', 'ROLLBACK_COMPLETE')])
+
+        events = self._watch(conn)
+
+        self.assertEquals(events, ['ns-app CREATE_IN_PROGRESS',
+                                   'Host CREATE_FAILED'])
+
+
+BODY_TEMPLATE = '''from troposphere import Ref, Tags
+from troposphere_ext import template
+
+
+def create(**kwargs):
+    t = template(kwargs['stack_prefix'])
+    for i in range(kwargs.get('buckets', 1)):
+        t.bucket('Data{}'.format(i), Tags=Tags(Note='x' * 400))
+    if kwargs.get('invalid'):
+        t.output('Missing', Value=Ref('Missing'))
+    return t
+'''
+
+
+class TestTropextBody(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+        log = logging.getLogger('test.utils')
+        log.disabled = True
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'body_tpl.py'), 'w') as f:
+            f.write(BODY_TEMPLATE)
+        sys.path.insert(0, self.directory)
+        self.conn = _Connection('UPDATE_COMPLETE', [])
+        self.tropext = Tropext(log, 'app', 'ns')
+        self.tropext._conn = self.conn
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        sys.modules.pop('body_tpl', None)
+        shutil.rmtree(self.directory)
+
+    def test_large_body(self):
+        # too large to deploy inline, still generated for a bucket
+        body = self.tropext.generate('body_tpl', {'buckets': 150})
+
+        self.assertGreater(len(body), 51200)
+        self.assertIsNone(self.tropext.update('body_tpl', {'buckets': 150}))
+        self.assertFalse(hasattr(self.conn, 'updated'))
+        self.assertEquals(self.tropext.update('body_tpl'), 'id/ns-app')
+
+    def test_diff_invalid(self):
+        self.assertTrue(self.tropext.diff('body_tpl'))
+        self.assertIsNone(self.tropext.diff('body_tpl', {'invalid': True}))
@@ -0,0 +1,78 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import unittest
+
+from troposphere_ext.validator import validate, LIMITS
+
+
+def _resource(resource_type, **properties):
+    return {'Type': resource_type, 'Properties': properties}
+
+
+class TestValidate(unittest.TestCase):
+
+    def test_valid(self):
+        template = {
+            'Parameters': {'Env': {'Type': 'String'}},
+            'Resources': {
+                'Ip': _resource('AWS::EC2::EIP', Domain={'Ref': 'Env'}),
+                'Host': _resource('AWS::EC2::Instance',
+                                  ImageId={'Ref': 'AWS::Region'},
+                                  Tags=[{'Key': 'ip', 'Value': {
+                                      'Fn::GetAtt': ['Ip', 'AllocationId']
+                                  }}])},
+            'Outputs': {'Ip': {'Value': {'Ref': 'Ip'}}}}
+
+        self.assertEquals(validate(template), [])
+
+    def test_unknown_targets(self):
+        template = {
+            'Conditions': {'Prod': {'Fn::Equals': [{'Ref': 'Ip'}, 'x']}},
+            'Resources': {
+                'Ip': _resource('AWS::EC2::EIP', Domain={'Ref': 'Missing'}),
+                'Host': dict(_resource('AWS::EC2::Instance', ImageId={
+                    'Fn::GetAtt': ['Ip', 'PublicIp']}), DependsOn='Gone')}}
+
+        self.assertEquals(validate(template), [
+            "Conditions.Prod: Ref to unknown 'Ip'",
+            "Host: DependsOn unknown resource 'Gone'",
+            "Ip: Ref to unknown 'Missing'"])
+
+    def test_unknown_attributes_warn(self):
+        template = {'Resources': {
+            'Cache': _resource('AWS::ElastiCache::CacheCluster'),
+            'Ip': _resource('AWS::EC2::EIP'),
+            'Host': _resource('AWS::EC2::Instance', ImageId={
+                'Fn::GetAtt': ['Ip', 'PublicIp']}, UserData={
+                'Fn::GetAtt': ['Cache', 'RedisEndpoint.Address']})}}
+        warnings = []
+
+        # the attribute index can lag behind Cloud Formation, so a
+        # valid template is never rejected over it
+        self.assertEquals(validate(template, warnings=warnings), [])
+        self.assertEquals(warnings, [
+            "Host: AWS::EC2::EIP 'Ip' has no known attribute 'PublicIp'"])
+
+    def test_cycle(self):
+        template = {'Resources': {
+            'A': _resource('AWS::EC2::EIP', InstanceId={'Ref': 'B'}),
+            'B': dict(_resource('AWS::EC2::Instance'), DependsOn=['A'])}}
+
+        self.assertEquals(validate(template),
+                          ['Circular dependency between resources A, B'])
+
+    def test_limits(self):
+        resources = dict(('R{}'.format(i), _resource('AWS::EC2::EIP'))
+                         for i in range(LIMITS['Resources'] + 1))
+
+        self.assertEquals(validate({'Resources': resources}),
+                          ['Resources has 201 entries, the limit is 200'])
+
+    def test_body_limit(self):
+        body = ' ' * (LIMITS['body'] + 1)
+
+        self.assertEquals(validate({}, body),
+                          ['Template body is 51201 bytes, the limit is '
+                           '51200'])
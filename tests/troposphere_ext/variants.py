@@ -0,0 +1,113 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+import unittest
+
+from troposphere.ec2 import SecurityGroupIngress
+
+from troposphere_ext import template, TRef, SRef
+from troposphere_ext.ec2 import Subnet, RouteTable
+from troposphere_ext.snapshot import Snapshot
+
+
+def _build(name, cidr='10.0.0.0/16', namespace='dev'):
+    t = template(name)
+    t.parameter('KeyName', Type='String', Default='dev')
+    t.vpc('Vpc', CidrBlock=cidr)
+    t.security_group('Web', GroupDescription='web', VpcId=TRef('Vpc'))
+    t.add_resource(SecurityGroupIngress(
+        'HttpIn', GroupId=t.get_att('Web', 'GroupId'), IpProtocol='tcp',
+        FromPort=80, ToPort=80, CidrIp='0.0.0.0/0', DependsOn='{}Vpc'
+        .format(name)))
+    t.instance('Host', ImageId='ami-12345678', KeyName=t.ref(
+        t._parameters['KeyName']), SubnetId=SRef(
+            'us-west-2', '{}-network'.format(namespace), 'Subnet'))
+    t.output('Constant', Value='web')
+    t.output('Group', Value=TRef('Web'))
+    return t
+
+
+def _build_site(name):
+    """Titles that hold the template name Web in other places"""
+    t = template(name)
+    t.vpc('Vpc', CidrBlock='10.0.0.0/16',
+          RouteTables=[RouteTable('WebRt')],
+          Subnets=[Subnet('Sub', CidrBlock='10.0.0.0/24',
+                          RouteTables=[TRef('WebRt$')])])
+    t.security_group('Website', GroupDescription='web', VpcId=TRef('Vpc$'))
+    t.bucket('WebLogs')
+    t.output('Group', Value=TRef('Website'))
+    return t
+
+
+class TestVariant(unittest.TestCase):
+
+    def setUp(self):
+        SRef.use_snapshot(Snapshot('ns', 'us-west-2', dict(
+            ('{}-network'.format(namespace), {
+                'updated': '2015-06-01T12:00:00',
+                'resources': [['Subnet', 'subnet-{}'.format(namespace),
+                               'AWS::EC2::Subnet']]})
+            for namespace in ['dev', 'prod'])))
+        self.base = _build('Dev')
+
+    def tearDown(self):
+        SRef._SRef__snapshots.clear()
+
+    def test_variant(self):
+        variant = self.base.variant(
+            'Prod', properties={'Vpc': {'CidrBlock': '10.1.0.0/16'}},
+            namespaces={'dev': 'prod'})
+
+        self.assertEquals(variant.to_dict(),
+                          _build('Prod', '10.1.0.0/16', 'prod').to_dict())
+
+    def test_variant_swaps_only_prefixes(self):
+        base = _build_site('Web')
+        variant = base.variant('Prod')
+
+        self.assertEquals(variant.title('Website'), 'ProdWebsite')
+        self.assertEquals(variant.to_dict(), _build_site('Prod').to_dict())
+
+    def test_shared(self):
+        cached = self.base._fragments()
+        before = self.base.to_dict()
+        rendered = self.base.variant('Prod', properties={
+            'Vpc': {'CidrBlock': '10.1.0.0/16'}}).to_dict()
+
+        self.assertIs(self.base._fragments(), cached)
+        self.assertIs(rendered['Outputs']['Constant'],
+                      cached[('Outputs', 'Constant')].value)
+        self.assertEquals(rendered['Resources']['ProdHttpIn']['DependsOn'],
+                          'ProdVpc')
+        self.assertEquals(rendered['Resources']['ProdHost']['Properties']
+                          ['SubnetId'], 'subnet-dev')
+        # copies are only made on the way to what changed
+        self.assertIs(rendered['Resources']['ProdHost']['Properties']
+                      ['KeyName'], cached[('Resources', 'DevHost')]
+                      .value['Properties']['KeyName'])
+        self.assertEquals(self.base.to_dict(), before)
+
+    def test_defaults(self):
+        rendered = self.base.variant('Prod', defaults={
+            'KeyName': 'prod'}).to_dict()
+
+        self.assertEquals(rendered['Parameters']['KeyName']['Default'],
+                          'prod')
+        self.assertRaises(LookupError, self.base.variant, 'Prod',
+                          defaults={'Missing': 'x'})
+        self.assertRaises(LookupError, self.base.variant, 'Prod',
+                          properties={'Missing': {}})
+
+    def test_invalidated(self):
+        cached = self.base._fragments()
+        self.base.bucket('Data')
+
+        self.assertIsNot(self.base._fragments(), cached)
+        self.assertIn('ProdData',
+                      self.base.variant('Prod').to_dict()['Resources'])
+
+
+if __name__ == '__main__':
+    unittest.main()
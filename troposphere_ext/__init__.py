@@ -7,11 +7,12 @@ import boto
 import json
 import re
 import collections
+import contextlib
 import yaml
 import troposphere
 import troposphere_ext
 
-from troposphere import BaseAWSObject, AWSHelperFn, Tags
+from troposphere import BaseAWSObject, AWSHelperFn, FindInMap, Tags
 from troposphere.autoscaling import Tag as ASGTag
 from troposphere.ec2 import Tag as EC2Tag, EIP
 from troposphere.ec2 import Instance, SecurityGroup, InternetGateway
@@ -23,11 +24,42 @@ from troposphere.cloudfront import Distribution
 
 from troposphere_ext.autoscaling import AutoScalingGroup
 from troposphere_ext.ec2 import VPC
+from troposphere_ext import ec2
 
 from troposphere_ext import utils
+from troposphere_ext import sharding
+from troposphere_ext import graph
+from troposphere_ext import dedup
+from troposphere_ext import rules
+from troposphere_ext import records
+from troposphere_ext import mappings
+from troposphere_ext import cfyaml
+from troposphere_ext import variants
 
 _template = None
 
+_setattr = BaseAWSObject.__setattr__
+_trusted = None
+
+
+def _trusted_setattr(self, name, value):
+    """BaseAWSObject.__setattr__ without the property type checks
+       while a trusted template is building resources. Checks are
+       recorded and run when the trusted template is rendered."""
+    if _trusted is None:
+        return _setattr(self, name, value)
+
+    d = self.__dict__
+    if name in d or '_BaseAWSObject__initialized' not in d:
+        object.__setattr__(self, name, value)
+    elif name in self.attributes:
+        self.resource[name] = value
+    elif name in self.props:
+        self.properties[name] = value
+        _trusted._deferred.append((self, name))
+    else:
+        _setattr(self, name, value)
+
 
 def template(name):
     troposphere_ext._template = Template(name)
@@ -36,20 +68,78 @@ def template(name):
 
 class Template(object):
 
-    def __init__(self, name):
+    def __init__(self, name, trusted=False):
         self._name = name
         self._version = None
         self._description = None
         self._conditions = dict()
         self._mappings = dict()
+        # (title, entries, compact) mappings resolved at render time
+        self._mapping_sources = []
+        self._lookups = []
         self._outputs = dict()
         self._parameters = dict()
         self._resources = dict()
+        self._trusted = False
+        self._deferred = []
+        self._flyweights = dict()
+        self._pending = []
+        self._materializing = False
+        # registered resources by identity so registering the same
+        # object again, like a load balancer shared by several auto
+        # scaling groups, is a no-op
+        self._registered = dict()
+        # titles left without the template name prefix because they
+        # already held the name, see Variant.title
+        self._unprefixed = set()
+        self._dedup = False
+        self._compact_rules = False
+        # security group title to rule property to (before, after)
+        # counts of the last render with rule compaction
+        self.rule_counts = dict()
+        self._pack_records = False
+        # record set group title to the record set titles packed into
+        # it by the last render with record packing
+        self.record_groups = dict()
+        # rendered entries shared by variants, see variant
+        self._fragment_cache = None
+        self.trusted(trusted)
 
     def version(self, version):
         self._version = version
         return self
 
+    def trusted(self, trusted=True):
+        """Skips property validation while resources are built by this
+           template. All property errors are reported together when the
+           template is rendered instead."""
+        self._trusted = trusted
+        # installed once, assigning __setattr__ on a class is slow
+        # because it updates every troposphere subclass
+        if trusted and \
+                BaseAWSObject.__dict__['__setattr__'] is not _trusted_setattr:
+            BaseAWSObject.__setattr__ = _trusted_setattr
+        return self
+
+    def deduplicate(self, dedup=True):
+        """Merges structurally identical launch configurations, security
+           groups and IAM resources when the template is rendered, see
+           dedup.merge"""
+        self._dedup = dedup
+        return self
+
+    def compact_rules(self, compact=True):
+        """Merges and drops redundant security group CIDR rules when the
+           template is rendered, see rules.compact"""
+        self._compact_rules = compact
+        return self
+
+    def pack_records(self, pack=True):
+        """Packs the Route 53 record sets of each hosted zone into record
+           set groups when the template is rendered, see records.pack"""
+        self._pack_records = pack
+        return self
+
     def description(self, description):
         self._description = description
         return self
@@ -60,10 +150,29 @@ class Template(object):
         ))
         return self
 
-    def mapping(self, title, mapping):
-        self._mappings[title] = mapping
+    def mapping(self, title, mapping, compact=True):
+        """Adds a mapping. A compact mapping, the default, only keeps the
+           keys and attributes the template looks up, see
+           mappings.resolve. Without compact it is added as it is."""
+        if compact:
+            self._mapping_sources.append((title, mapping.iteritems, True))
+        else:
+            self._mappings[title] = mapping
+        return self
+
+    def mapping_file(self, title, path, format=None, compact=True):
+        """Adds a mapping streamed from a JSON, CSV or YAML file when
+           the template is rendered, see mappings.load"""
+        self._mapping_sources.append(
+            (title, lambda: mappings.load(path, format), compact))
         return self
 
+    def find_in_map(self, title, key, attribute):
+        """Returns a shared FindInMap. Rendering the template fails
+           when the lookup can not succeed."""
+        self._lookups.append((title, key, attribute))
+        return self._flyweight(FindInMap, title, key, attribute)
+
     def output(self, title, **kwargs):
         self._update(self._outputs, troposphere.Output(
             title, **kwargs
@@ -163,6 +272,8 @@ class Template(object):
         regex = resource.title \
                 if isinstance(resource, BaseAWSObject) else resource
 
+        self._materialize()
+
         if isinstance(resource, BaseAWSObject):
             matches = [v for k, v in self._resources.iteritems()
                        if resource.resource_type
@@ -184,7 +295,90 @@ class Template(object):
         self._register_resource(resource)
         return self
 
+    def ref(self, resource):
+        """Returns a shared Ref to the resource"""
+        return self._flyweight(Ref, resource)
+
+    def tref(self, resource):
+        """Returns a shared TRef to the resource"""
+        return self._flyweight(TRef, resource)
+
+    def get_att(self, resource, attribute):
+        """Returns a shared TGetAtt for the resource attribute"""
+        return self._flyweight(TGetAtt, resource, attribute)
+
+    def _flyweight(self, clazz, *args):
+        # reference helpers are immutable once built so identical ones
+        # can be shared. objects are keyed on identity and on their
+        # current title since Ref captures the title when it is built.
+        key = (clazz,) + tuple((a, a.title) if isinstance(a, BaseAWSObject)
+                               else a for a in args)
+        helper = self._flyweights.get(key)
+        if helper is None:
+            helper = self._flyweights[key] = clazz(*args)
+        return helper
+
+    def _defer(self, expand):
+        """Queues a callable that registers sub resources. Queued
+           callables are run once, in order, when the template is
+           rendered or searched."""
+        self._pending.append(expand)
+
+    def _materialize(self):
+        # queued callables look resources up, which would run the
+        # rest of the queue from inside them
+        if self._materializing:
+            return
+        self._materializing = True
+        try:
+            while len(self._pending) > 0:
+                expand = self._pending.pop(0)
+                with self._building():
+                    expand(self)
+        finally:
+            self._materializing = False
+
+    @contextlib.contextmanager
+    def _building(self):
+        # only the outermost build enables and disables trusted mode
+        if not self._trusted or troposphere_ext._trusted is not None:
+            yield
+        else:
+            troposphere_ext._trusted = self
+            try:
+                yield
+            finally:
+                troposphere_ext._trusted = None
+
+    def _validate_deferred(self):
+        """Runs the property checks skipped by trusted mode and
+           raises a single ValueError listing every failure"""
+        errors = []
+        for obj, name in self._deferred:
+            if name in obj.properties:
+                try:
+                    _setattr(obj, name, obj.properties[name])
+                except (TypeError, ValueError) as e:
+                    errors.append('{}.{}: {}'.format(
+                        obj.title or type(obj).__name__, name, str(e)))
+
+        for title, resource in sorted(self._resources.iteritems()):
+            for k, (_, required) in sorted(resource.props.iteritems()):
+                if required and k not in resource.properties:
+                    errors.append('{}: Resource {} required in type {}'
+                                  .format(title, k, resource.resource_type))
+
+        self._deferred = []
+
+        if len(errors) > 0:
+            raise ValueError('Template "{}" failed validation:\n  {}'
+                             .format(self._name, '\n  '.join(errors)))
+
     def _register_resource(self, resources):
+        with self._building():
+            return self.__register_resource(resources)
+
+    def __register_resource(self, resources):
 
         # ensure resources is iterable
         resources = resources if isinstance(resources, collections.Iterable) \
@@ -195,16 +389,24 @@ class Template(object):
                 return accu
             else:
                 value = r_resources[0]
+                if id(value) in self._registered:
+                    accu.append(value)
+                    return _r(accu, r_resources[1:])
+                self._registered[id(value)] = value
                 if hasattr(value, 'set_template'):
                     value.set_template(self)
                 # prefix resource title with the template name
                 if self._name not in value.title:
                     value.title = '{}{}'.format(self._name, value.title)
+                else:
+                    self._unprefixed.add(value.title)
+                value.title = utils.intern_str(value.title)
                 # add a name tag to the resource for better
                 # visibility in the AWS web console
                 if 'Tags' in value.props:
                     # convert camel case title to snake case
-                    name_tag = utils.camel_to_snake(value.title)
+                    name_tag = utils.intern_str(
+                        utils.camel_to_snake(value.title))
                     # sometimes troposphere entities use Tags and other
                     # times they use a list of Tag
                     is_tags_type = value.props['Tags'][0] is troposphere.Tags
@@ -224,9 +426,19 @@ class Template(object):
                         # already has tags so we need to merge the name tag in
                         if isinstance(value.Tags, Tags):
                             # handle Tags type
+                            for tag in value.Tags.tags:
+                                tag['Key'] = utils.intern_str(tag['Key'])
+                                tag['Value'] = utils.intern_str(tag['Value'])
                             value.Tags.tags.append(
                                 {'Key': 'Name', 'Value': name_tag})
                         else:
+                            for tag in value.Tags:
+                                data = getattr(tag, 'data', None)
+                                if isinstance(data, dict):
+                                    for k in ('Key', 'Value'):
+                                        if k in data:
+                                            data[k] = utils.intern_str(
+                                                data[k])
                             if value.resource_type == asg_type:
                                 value.Tags.append(ASGTag('Name',
                                                          name_tag, True))
@@ -271,16 +483,18 @@ class Template(object):
         args = [x for y in args for x in
                 (y if isinstance(y, list) or isinstance(y, tuple) else (y,))]
 
-        return _r([], *args, **kwargs)
+        with self._building():
+            return _r([], *args, **kwargs)
 
     def _handle_duplicate_key(self, key):
         raise ValueError('duplicate key "%s" detected' % key)
 
     def _update(self, d, values):
+        self._fragment_cache = None
         if isinstance(values, list):
             for v in values:
                 if v.title in d:
-                    self._handle_duplicate_key(values.title)
+                    self._handle_duplicate_key(v.title)
                 d[v.title] = v
         else:
             if values.title in d:
@@ -288,27 +502,93 @@ class Template(object):
             d[values.title] = values
         return values
 
-    def to_json(self, indent=2, sort_keys=True, separators=(', ', ': ')):
+    def variant(self, name, properties=None, defaults=None,
+                namespaces=None):
+        """Returns a Variant of the template for another environment with
+           name in place of the template name in resource titles.
+           properties maps resource titles, with or without the template
+           name, to the properties to set, defaults maps parameters to
+           their default and namespaces maps namespaces to the ones SRefs
+           resolve in instead. The template is rendered once and shared
+           by all of its variants, so it should be complete first."""
+        return variants.Variant(self, name, properties, defaults,
+                                namespaces)
+
+    def to_dict(self):
+        """Renders the template to plain dicts, lists and scalars"""
+        self._materialize()
+
+        if self._trusted:
+            self._validate_deferred()
+
+        t = self._header()
+        t.update(self._sections())
+        return self._resolve(utils.plain(t))
+
+    def _header(self):
         t = dict()
         if self._description:
             t['Description'] = self._description
 
         if self._version:
             t['AWSTemplateFormatVersion'] = self._version
+        return t
+
+    def _sections(self):
+        self._materialize()
+        return {'Conditions': self._conditions,
+                'Mappings': self._mappings,
+                'Outputs': self._outputs,
+                'Parameters': self._parameters,
+                'Resources': self._resources}
+
+    def _fragments(self):
+        if self._fragment_cache is None:
+            self._materialize()
+            if self._trusted:
+                self._validate_deferred()
+            self._fragment_cache = variants.fragments(self)
+        return self._fragment_cache
+
+    def _resolve(self, t, name=None):
+        """Runs the render time passes over a rendered template, name is
+           the prefix of the titles they add"""
+        if self._mapping_sources or self._lookups:
+            mappings.resolve(t, self._mapping_sources,
+                             utils.plain(self._lookups))
+        if self._compact_rules:
+            self.rule_counts = rules.compact_template(t)
+        if self._pack_records:
+            t, self.record_groups = records.pack(
+                t, prefix=self._name if name is None else name)
+        if self._dedup:
+            t = dedup.merge(t)[0]
+        return t
+
+    def to_json(self, indent=2, sort_keys=True, separators=(', ', ': ')):
+        return json.dumps(self.to_dict(), indent=indent,
+                          sort_keys=sort_keys, separators=separators)
 
-        t['Conditions'] = self._conditions
-        t['Mappings'] = self._mappings
-        t['Outputs'] = self._outputs
-        t['Parameters'] = self._parameters
-        t['Resources'] = self._resources
+    def to_yaml(self):
+        """Renders the template as Cloud Formation YAML with short form
+           intrinsic functions"""
+        return cfyaml.dumps(self.to_dict())
 
-        return json.dumps(t, cls=troposphere.awsencode,
-                          indent=indent, sort_keys=sort_keys,
-                          separators=separators)
+    def graph(self):
+        """Returns the dependency graph of the rendered resources"""
+        return graph.DependencyGraph(self.to_dict())
+
+    def shard(self, template_url, **kwargs):
+        """Splits the template into a parent template and nested child
+           stack templates, see sharding.shard"""
+        return sharding.shard(self.to_dict(), self._name, template_url,
+                              **kwargs)
 
 
 class TGetAtt(troposphere.GetAtt):
 
+    __slots__ = ('_resource', '_attribute', '_resource_name')
+
     def __init__(self, resource, attribute):
         self._resource = resource
         self._attribute = attribute
@@ -334,6 +614,8 @@ class TGetAtt(troposphere.GetAtt):
 
 class Ref(troposphere.Ref):
 
+    __slots__ = ('_title', 'data')
+
     def __init__(self, data):
         self._title = self.getdata(data)
         super(Ref, self).__init__(data)
@@ -347,6 +629,8 @@ class TRef(Ref):
     """TRef is used like Ref but allows for late binding
        of template resources by name"""
 
+    __slots__ = ('_resource', '_resource_name')
+
     def __init__(self, resource):
         self._resource = resource
         self._resource_name = resource.title \
@@ -374,8 +658,12 @@ class SRef(AWSHelperFn):
     """SRef is used like Ref but for late binding
        of template references from another stack"""
 
-    __resources = None
-    __conn = None
+    __slots__ = ('_region', '_stack_name', '_resource', '_resource_name')
+
+    __resources = dict()
+    __snapshots = dict()
+    __recording = None
+    __renamed = dict()
 
     @staticmethod
     def yaml_reper(dumper, data):
@@ -383,15 +671,45 @@ class SRef(AWSHelperFn):
         return dumper.represent_scalar('tag:yaml.org,2002:str',
                                        data.JSONrepr())
 
+    @staticmethod
+    def use_snapshot(snapshot):
+        """Resolves references to stacks in the snapshot's region from
+           the snapshot instead of the API"""
+        SRef.__snapshots[snapshot.region] = snapshot
+
+    @staticmethod
+    def record(stacks):
+        """Adds the (region, stack name) of every SRef rendered from now
+           on to the stacks set instead of resolving it, None resolves
+           them again. Finds the stacks a template references before
+           they exist."""
+        SRef.__recording = stacks
+
+    @staticmethod
+    def rename(stacks):
+        """Resolves SRefs to the stacks in the keys of the stacks dict in
+           the stacks of its values instead, None stops renaming. Used to
+           render template variants for other namespaces."""
+        SRef.__renamed = dict(stacks or {})
+
     @staticmethod
     def resources(region, stack_name):
-        if SRef.__resources is None:
-            if SRef.__conn is None:
-                SRef.__conn = boto.cloudformation.connect_to_region(region)
+        if region in SRef.__snapshots:
+            return SRef.__snapshots[region].resources(stack_name)
+
+        key = (region, stack_name)
+        if key not in SRef.__resources:
+            conn = utils.connect(region)
+            SRef.__resources[key] = conn.describe_stack_resources(stack_name)
 
-            SRef.__resources = SRef.__conn.describe_stack_resources(stack_name)
+        resources = SRef.__resources[key]
+        return [] if resources is None else resources
 
-        return [] if SRef.__resources is None else SRef.__resources
+    @staticmethod
+    def reset():
+        """Clears the cached stack resources so they are fetched
+           again on the next lookup"""
+        SRef.__resources.clear()
 
     def __init__(self, region, stack_name, resource):
         self._region = region
@@ -402,7 +720,12 @@ class SRef(AWSHelperFn):
 
     def JSONrepr(self):
 
-        resources = SRef.resources(self._region, self._stack_name)
+        if SRef.__recording is not None:
+            SRef.__recording.add((self._region, self._stack_name))
+            return '{}:{}'.format(self._stack_name, self._resource_name)
+
+        stack_name = SRef.__renamed.get(self._stack_name, self._stack_name)
+        resources = SRef.resources(self._region, stack_name)
 
         regex = self._resource.title+'$' \
             if isinstance(self._resource, BaseAWSObject) else self._resource
@@ -431,5 +754,6 @@ class SRef(AWSHelperFn):
                                       self._stack_name))
 
 
-# initialize yaml representation handlers for Cloud Config user data
+# initialize yaml representation handlers for Cloud Config user data,
+# ec2.YAMLDumper looks them up on yaml.Dumper
 yaml.add_representer(SRef, SRef.yaml_reper)
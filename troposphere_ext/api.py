@@ -0,0 +1,212 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import json
+import time
+import random
+import socket
+import httplib
+import threading
+import collections
+
+from boto.exception import BotoServerError
+
+# calls per second and burst allowed per region, Cloud Formation throttles
+# per account and region
+RATE = 4.0
+BURST = 8
+
+THROTTLING_CODES = frozenset(['Throttling', 'ThrottlingException',
+                              'RequestLimitExceeded'])
+
+# operations that may have taken effect when the connection failed or the
+# service answered with a 5xx, only throttling proves they did not
+NOT_IDEMPOTENT = frozenset(['create_stack', 'update_stack',
+                            'cancel_update_stack'])
+
+# stack tag holding the namespace a stack was created in
+NAMESPACE_TAG = 'namespace'
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter shared by every thread that calls
+       acquire"""
+
+    def __init__(self, rate=RATE, burst=BURST, clock=time.time,
+                 sleep=time.sleep):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, waiting for one if the bucket is empty. Returns
+           the seconds waited."""
+        waited = 0
+        while 1:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self._burst, self._tokens +
+                                   (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self._rate
+            self._sleep(wait)
+            waited += wait
+
+
+class Stats(object):
+    """Per operation call, error, retry and latency counters"""
+
+    FIELDS = ['calls', 'errors', 'retries', 'throttled', 'seconds',
+              'waited']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = collections.defaultdict(
+            lambda: dict.fromkeys(Stats.FIELDS, 0))
+
+    def record(self, operation, **counts):
+        with self._lock:
+            stats = self._operations[operation]
+            for name, value in counts.iteritems():
+                stats[name] += value
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return dict((operation, dict(stats))
+                        for operation, stats in self._operations.iteritems())
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def report(self):
+        """Returns the counters as a text table"""
+        lines = ['{:<28} {:>6} {:>6} {:>7} {:>9} {:>9} {:>9}'.format(
+            'operation', 'calls', 'errors', 'retries', 'throttled',
+            'avg (ms)', 'wait (ms)')]
+        for operation, stats in sorted(self.to_dict().iteritems()):
+            attempts = stats['calls'] + stats['retries']
+            lines.append('{:<28} {:>6} {:>6} {:>7} {:>9} {:>9.1f} {:>9.1f}'
+                         .format(operation, stats['calls'], stats['errors'],
+                                 stats['retries'], stats['throttled'],
+                                 stats['seconds'] * 1000 / max(attempts, 1),
+                                 stats['waited'] * 1000))
+        return '\n'.join(lines)
+
+
+stats = Stats()
+
+
+class Api(object):
+    """Wraps a boto connection so every call takes a token from a shared
+       rate limiter and throttled or transient failures are retried with
+       exponential backoff and full jitter. Operations in NOT_IDEMPOTENT
+       are only retried when throttled."""
+
+    def __init__(self, conn, bucket, stats=stats, retries=6, base=0.5,
+                 cap=20.0, sleep=time.sleep):
+        self._conn = conn
+        self._bucket = bucket
+        self._stats = stats
+        self._retries = retries
+        self._base = base
+        self._cap = cap
+        self._sleep = sleep
+
+    def __getattr__(self, name):
+        value = getattr(self._conn, name)
+        if name.startswith('_') or not callable(value):
+            return value
+
+        def _call(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return _call
+
+    def call(self, operation, *args, **kwargs):
+        attempt = 0
+        while 1:
+            waited = self._bucket.acquire()
+            start = time.time()
+            try:
+                result = getattr(self._conn, operation)(*args, **kwargs)
+                self._stats.record(operation, calls=1, waited=waited,
+                                   seconds=time.time() - start)
+                return result
+            except Exception as e:
+                throttled = is_throttling(e)
+                retry = attempt < self._retries and \
+                    (throttled or (operation not in NOT_IDEMPOTENT and
+                                   is_transient(e)))
+                self._stats.record(operation, waited=waited,
+                                   seconds=time.time() - start,
+                                   throttled=int(throttled),
+                                   retries=int(retry),
+                                   calls=int(not retry),
+                                   errors=int(not retry))
+                if not retry:
+                    raise
+                self._sleep(random.uniform(
+                    0, min(self._cap, self._base * 2 ** attempt)))
+                attempt += 1
+
+
+def error_code(error):
+    """Returns the error code of a BotoServerError, Cloud Formation
+       returns JSON bodies boto doesn't parse the code from"""
+    if error.error_code:
+        return error.error_code
+    try:
+        return json.loads(error.body)['Error']['Code']
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def is_throttling(error):
+    return isinstance(error, BotoServerError) and \
+        error_code(error) in THROTTLING_CODES
+
+
+def is_transient(error):
+    if isinstance(error, BotoServerError):
+        return error.status >= 500
+    return isinstance(error, (socket.error, httplib.HTTPException))
+
+
+def pages(call, *args):
+    """Returns every item of a paginated boto call"""
+    items = []
+    next_token = None
+    while 1:
+        page = call(*args, next_token=next_token)
+        items.extend(page)
+        next_token = getattr(page, 'next_token', None)
+        if next_token is None:
+            return items
+
+
+def namespace_stacks(stacks, namespace, untagged=True):
+    """Returns the described stacks of a namespace, the stacks tagged
+       with it when they were created. Stacks created before the tag
+       are only matched by the namespace prefix of their name and could
+       belong to a longer namespace, like dev-eu for dev, they are
+       included when untagged is True."""
+    prefix = '{}-'.format(namespace)
+    result = []
+    for stack in stacks:
+        tag = dict(getattr(stack, 'tags', None) or {}).get(NAMESPACE_TAG)
+        if tag == namespace or (tag is None and untagged and
+                                stack.stack_name.startswith(prefix)):
+            result.append(stack)
+    return result
@@ -5,7 +5,6 @@
 import troposphere
 import troposphere.autoscaling
 
-from troposphere import Ref
 from troposphere.autoscaling import AutoScalingGroup as TropAutoScalingGroup
 
 
@@ -30,7 +29,7 @@ class AutoScalingGroup(TropAutoScalingGroup):
 
         if isinstance(self._load_balancers, list):
             lb_names = [
-                Ref(template._register_resource(lb)[0])
+                template.ref(template._register_resource(lb)[0])
                 for lb in self._load_balancers]
 
             self.__setattr__('LoadBalancerNames', lb_names)
@@ -38,4 +37,4 @@ class AutoScalingGroup(TropAutoScalingGroup):
         if self._launch_config is not None:
             template._register_resource(self._launch_config)
             self.__setattr__('LaunchConfigurationName',
-                             Ref(self._launch_config))
+                             template.ref(self._launch_config))
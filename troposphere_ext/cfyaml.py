@@ -0,0 +1,141 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import yaml
+
+# use the libyaml C emitter and parser when they are available
+BaseDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+BaseLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# intrinsic functions with a short form tag, Fn::{name} becomes !{name}.
+# the Condition function is left alone, a one key Condition dict could
+# also be a resource or output attribute.
+FUNCTIONS = frozenset([
+    'And', 'Base64', 'Cidr', 'Equals', 'FindInMap', 'GetAtt', 'GetAZs',
+    'If', 'ImportValue', 'Join', 'Not', 'Or', 'Select', 'Split', 'Sub',
+])
+
+# long enough that the emitter never folds a line
+WIDTH = 1 << 30
+
+
+class Tagged(object):
+    """An intrinsic function argument emitted with a short form tag"""
+
+    __slots__ = ('tag', 'value')
+
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+
+class TemplateDumper(BaseDumper):
+
+    def ignore_aliases(self, data):
+        # Cloud Formation rejects YAML aliases, shared values are written
+        # out every time
+        return True
+
+
+class TemplateLoader(BaseLoader):
+    pass
+
+
+def _function(key):
+    """Returns the short form name of an intrinsic function key, None
+       when it is not one"""
+    if key == 'Ref':
+        return key
+    if isinstance(key, basestring) and key.startswith('Fn::') and \
+            key[4:] in FUNCTIONS:
+        return key[4:]
+    return None
+
+
+def _is_function(value):
+    return isinstance(value, dict) and len(value) == 1 and \
+        _function(next(iter(value))) is not None
+
+
+def short_form(value):
+    """Returns a rendered template fragment with every intrinsic
+       function replaced by its short form Tagged value"""
+    if isinstance(value, dict):
+        if _is_function(value):
+            key, args = next(value.iteritems())
+            name = _function(key)
+            if name == 'GetAtt' and isinstance(args, list) and \
+                    len(args) == 2 and \
+                    all(isinstance(a, basestring) for a in args):
+                return Tagged('!GetAtt', '{}.{}'.format(*args))
+            if _is_function(args):
+                # a short form can't hold another short form directly,
+                # the inner function keeps its full name
+                inner, inner_args = next(args.iteritems())
+                return Tagged('!' + name, {inner: short_form(inner_args)})
+            return Tagged('!' + name, short_form(args))
+        return dict((k, short_form(v)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return [short_form(v) for v in value]
+    return value
+
+
+def _represent_tagged(dumper, data):
+    if isinstance(data.value, list):
+        return dumper.represent_sequence(data.tag, data.value)
+    elif isinstance(data.value, dict):
+        return dumper.represent_mapping(data.tag, data.value)
+    value = unicode(data.value)
+    # an empty plain scalar after a tag is easily missed, quote it
+    return dumper.represent_scalar(data.tag, value,
+                                   style=_style(value) or
+                                   ("'" if not value else None))
+
+
+def _style(value):
+    """Strings of several lines, scripts and cloud configs, are written
+       as literal blocks"""
+    return '|' if value.count('\n') > 1 else None
+
+
+def _literal(represent):
+    def _represent(dumper, data):
+        node = represent(dumper, data)
+        node.style = _style(data) or node.style
+        return node
+    return _represent
+
+
+def _construct_tagged(loader, name, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+        if name == 'GetAtt':
+            value = value.split('.', 1)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    return {'Ref' if name == 'Ref' else 'Fn::' + name: value}
+
+
+TemplateDumper.add_representer(Tagged, _represent_tagged)
+TemplateDumper.add_representer(
+    str, _literal(yaml.representer.SafeRepresenter.represent_str))
+TemplateDumper.add_representer(
+    unicode, _literal(yaml.representer.SafeRepresenter.represent_unicode))
+TemplateLoader.add_multi_constructor('!', _construct_tagged)
+
+
+def dumps(template, dumper=TemplateDumper):
+    """Returns a rendered template as Cloud Formation YAML with short form
+       intrinsic functions"""
+    return yaml.dump(short_form(template), Dumper=dumper,
+                     default_flow_style=False, width=WIDTH)
+
+
+def loads(body):
+    """Parses a Cloud Formation YAML template, short form intrinsic
+       functions are returned in their long form"""
+    return yaml.load(body, Loader=TemplateLoader)
@@ -0,0 +1,175 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import os
+import sys
+import json
+import errno
+import socket
+import getpass
+import tempfile
+import threading
+import collections
+import SocketServer
+
+from troposphere_ext import SRef
+from troposphere_ext.utils import Tropext
+
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(),
+                              'trop-{}.sock'.format(getpass.getuser()))
+
+EVENT_FIELDS = ['timestamp', 'resource_status', 'resource_type',
+                'logical_resource_id', 'resource_status_reason']
+
+Event = collections.namedtuple('Event', EVENT_FIELDS)
+
+
+class TropextRequestHandler(SocketServer.StreamRequestHandler):
+    """Handles a single JSON encoded request per connection and
+       replies with a stream of JSON encoded messages, one per line.
+       The last message always carries the exit status."""
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+            if not line:
+                # closed without a request, another daemon checking
+                # whether this one is running
+                return
+            request = json.loads(line)
+            command = request.get('command')
+            handler = getattr(self, '_' + str(command), None)
+            if command not in self.server.commands or handler is None:
+                raise ValueError('Unsupported command "{}"'.format(command))
+
+            cwd = request.get('cwd')
+            if cwd is not None and cwd not in sys.path:
+                sys.path.append(cwd)
+
+            tropext = self.server.tropext(request['stack'],
+                                          request['namespace'],
+                                          request['region'])
+            status = handler(tropext, request)
+            self._send(status=status)
+        except socket.error:
+            # client went away, nothing left to reply to
+            pass
+        except Exception as e:
+            self.server.log.exception('Request failed with unexpected '
+                                      'error: "{}"'.format(str(e)))
+            self._send(status=1, error=str(e))
+
+    def _generate(self, tropext, request):
+        # stack resources may have changed since the last request
+        SRef.reset()
+        template = tropext.generate(request['template'],
+                                    request.get('template_args') or dict(),
+                                    format=request.get('format', 'json'))
+        if template is None:
+            return 1
+        self._send(output=template)
+        return 0
+
+    def _diff(self, tropext, request):
+        SRef.reset()
+        result = tropext.diff(request['template'],
+                              request.get('template_args') or dict())
+        if result is None:
+            return 1
+        self._send(output='\n'.join(result))
+        return 0
+
+    def _watch(self, tropext, request):
+        for e in tropext.watch(request.get('fetch', True)):
+            self._send(event={k: str(getattr(e, k, None))
+                              for k in EVENT_FIELDS})
+        return 0
+
+    def _send(self, **message):
+        self.wfile.write(json.dumps(message) + '\n')
+        self.wfile.flush()
+
+
+def _answers(path):
+    """Returns True when a daemon accepts connections on the socket"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+class TropextServer(SocketServer.ThreadingMixIn,
+                    SocketServer.UnixStreamServer):
+    """Resident trop process that keeps template modules, Cloud
+       Formation connections and Tropext instances warm between
+       requests. Template modules are only reloaded when their source
+       file changes."""
+
+    daemon_threads = True
+    commands = ['generate', 'diff', 'watch']
+
+    def __init__(self, log, path=DEFAULT_SOCKET):
+        self.log = log
+        self._tropexts = dict()
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            if _answers(path):
+                raise socket.error(errno.EADDRINUSE,
+                                   'A trop daemon is already listening '
+                                   'on "{}"'.format(path))
+            # left behind by a daemon that did not shut down cleanly
+            os.unlink(path)
+
+        # the socket is created with the umask, only the user may
+        # connect from the moment it exists
+        umask = os.umask(0177)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path,
+                                                   TropextRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def tropext(self, stack_name, namespace, region):
+        key = (stack_name, namespace, region)
+        with self._lock:
+            if key not in self._tropexts:
+                self._tropexts[key] = Tropext(self.log, stack_name,
+                                              namespace, region)
+            return self._tropexts[key]
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class TropextClient(object):
+    """Forwards commands to a running trop daemon"""
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self._path = path
+
+    def request(self, command, **kwargs):
+        """Sends a command and returns a generator over the reply
+           messages"""
+        kwargs['command'] = command
+        kwargs.setdefault('cwd', os.getcwd())
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._path)
+        try:
+            stream = sock.makefile('rw')
+            stream.write(json.dumps(kwargs) + '\n')
+            stream.flush()
+            for line in stream:
+                yield json.loads(line)
+        finally:
+            sock.close()
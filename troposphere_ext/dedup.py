@@ -0,0 +1,97 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import json
+
+from troposphere_ext import utils
+from troposphere_ext.graph import depends_on, rewrite
+
+# resource types where two identical definitions are interchangeable.
+# identical instances, volumes or addresses are still distinct things
+# so they are never merged. neither are security groups and roles, two
+# identical ones still differ in the rules and policies that refer to
+# them, merging would grant one what was only granted to the other.
+MERGEABLE = frozenset([
+    'AWS::AutoScaling::LaunchConfiguration',
+    'AWS::EC2::SecurityGroupEgress',
+    'AWS::EC2::SecurityGroupIngress',
+    'AWS::IAM::InstanceProfile',
+    'AWS::IAM::ManagedPolicy',
+    'AWS::IAM::Policy',
+])
+
+
+def fingerprint(title, resource):
+    """Returns a string that is equal for structurally identical
+       resources. The Name tag added when the resource was registered
+       is ignored since it is derived from the title."""
+    name_tag = utils.camel_to_snake(title)
+    properties = dict(resource.get('Properties', {}))
+    if isinstance(properties.get('Tags'), list):
+        properties['Tags'] = [t for t in properties['Tags']
+                              if not (isinstance(t, dict) and
+                                      t.get('Key') == 'Name' and
+                                      t.get('Value') == name_tag)]
+    resource = dict(resource, Properties=properties)
+    if 'DependsOn' in resource:
+        resource['DependsOn'] = sorted(set(depends_on(resource)))
+    return json.dumps(resource, sort_keys=True, separators=(',', ':'))
+
+
+def merge(template, types=MERGEABLE):
+    """Returns a copy of a rendered template with structurally identical
+       resources of the given types merged into the one with the lowest
+       title, and a dict of the merged titles to the title they were
+       merged into. Every Ref, Fn::GetAtt and DependsOn that pointed at a
+       merged resource is rewritten. Merging is repeated until nothing
+       changes since rewriting can make more resources identical."""
+    template = dict(template)
+    resources = dict(template.get('Resources', {}))
+    outputs = template.get('Outputs', {})
+    aliases = dict()
+
+    while 1:
+        groups = dict()
+        for title in sorted(resources):
+            resource = resources[title]
+            if resource.get('Type') in types:
+                groups.setdefault(fingerprint(title, resource),
+                                  []).append(title)
+
+        merged = dict((title, titles[0]) for titles in groups.itervalues()
+                      for title in titles[1:])
+        if not merged:
+            break
+
+        for title, canonical in aliases.items():
+            aliases[title] = merged.get(canonical, canonical)
+        aliases.update(merged)
+
+        def _rewire(kind, target, attr):
+            if target in merged:
+                return {'Ref': merged[target]} if attr is None \
+                    else {'Fn::GetAtt': [merged[target], attr]}
+
+        for title in merged:
+            del resources[title]
+        for title, resource in resources.items():
+            resource = rewrite(resource, _rewire)
+            if any(t in merged for t in depends_on(resource)):
+                targets = []
+                for target in depends_on(resource):
+                    target = merged.get(target, target)
+                    if target != title and target not in targets:
+                        targets.append(target)
+                if targets:
+                    resource['DependsOn'] = targets
+                else:
+                    del resource['DependsOn']
+            resources[title] = resource
+        outputs = rewrite(outputs, _rewire)
+
+    template['Resources'] = resources
+    if 'Outputs' in template:
+        template['Outputs'] = outputs
+    return template, aliases
@@ -0,0 +1,278 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import os
+import json
+import yaml
+
+from troposphere_ext import SRef
+from troposphere_ext.utils import Tropext
+from troposphere_ext.fanout import succeeded, concurrently
+from troposphere_ext.storage import write_atomic, sha256
+from troposphere_ext.timeline import last_operation, root_causes
+
+VERSION = 1
+
+# returned by Tropext.update when a stack is up to date
+UNCHANGED = object()
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.tropext',
+                                 'deploys')
+
+
+def default_path(namespace, region):
+    return os.path.join(DEFAULT_DIRECTORY,
+                        '{}-{}.json'.format(namespace, region))
+
+
+def waves(dependencies):
+    """Groups stacks into topological levels, a stack is in the wave
+       after the last wave of the stacks it depends on. Raises a
+       ValueError on circular dependencies."""
+    remaining = dict((name, set(targets))
+                     for name, targets in dependencies.iteritems())
+    done = set()
+    result = []
+    while remaining:
+        wave = sorted(name for name, targets in remaining.iteritems()
+                      if targets <= done)
+        if not wave:
+            raise ValueError('Circular dependencies between stacks {}'
+                             .format(', '.join(sorted(remaining))))
+        for name in wave:
+            del remaining[name]
+        done.update(wave)
+        result.append(wave)
+    return result
+
+
+class Manifest(object):
+    """The stacks of a namespace and region, each with its template,
+       template args and parameters. A stack's parent is passed to its
+       template as parent_stack and depends_on lists stacks it needs
+       that the templates don't reference with SRef.
+
+       namespace: dev
+       region: us-west-2
+       stacks:
+         vpc:
+           template: vpc
+         app:
+           template: app
+           parent: vpc
+           args: {instances: 2}
+           params: {KeyName: dev}
+           depends_on: [db]
+    """
+
+    def __init__(self, namespace, region, stacks, digest=None):
+        self.namespace = namespace
+        self.region = region
+        self.stacks = stacks
+        self.digest = digest
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            body = f.read()
+        data = yaml.safe_load(body) or {}
+        for key in ['namespace', 'stacks']:
+            if key not in data:
+                raise ValueError("Manifest '{}' has no {}"
+                                 .format(path, key))
+
+        stacks = data['stacks']
+        for name, stack in stacks.iteritems():
+            if not isinstance(stack, dict) or 'template' not in stack:
+                raise ValueError("Stack '{}' of manifest '{}' has no "
+                                 "template".format(name, path))
+            for target in [stack.get('parent')] + \
+                    list(stack.get('depends_on', [])):
+                if target is not None and target not in stacks:
+                    raise ValueError("Stack '{}' of manifest '{}' depends "
+                                     "on unknown stack '{}'"
+                                     .format(name, path, target))
+        return cls(str(data['namespace']),
+                   str(data.get('region', 'us-west-2')), stacks,
+                   sha256(body))
+
+    def template(self, name):
+        return self.stacks[name]['template']
+
+    def args(self, name):
+        """Returns a copy of the template args of a stack"""
+        stack = self.stacks[name]
+        args = dict(stack.get('args') or {})
+        if stack.get('parent') is not None:
+            args['parent_stack'] = stack['parent']
+        return args
+
+    def params(self, name):
+        return dict(self.stacks[name].get('params') or {})
+
+    def depends_on(self, name):
+        """Returns the stacks a stack depends on by the manifest alone,
+           its parent and depends_on"""
+        stack = self.stacks[name]
+        targets = set(stack.get('depends_on', []))
+        if stack.get('parent') is not None:
+            targets.add(stack['parent'])
+        return targets
+
+
+class Deploy(object):
+    """Creates or updates the stacks of a manifest in topological waves.
+       The stacks of a wave deploy concurrently, up to parallel at a
+       time, and the next wave starts once every one of them completed.
+       Finished waves are recorded to a state file so an interrupted or
+       failed deploy resumes after the last completed wave."""
+
+    def __init__(self, log, manifest, creator=None, parallel=4,
+                 fail_fast=False, storage=None, state_path=None):
+        self._log = log
+        self._manifest = manifest
+        self._creator = creator
+        self._parallel = max(1, parallel)
+        self._fail_fast = fail_fast
+        self._storage = storage
+        if state_path is None:
+            state_path = default_path(manifest.namespace, manifest.region)
+        self._state_path = state_path
+        # stack name to an (ok, detail) tuple
+        self.results = dict()
+
+    def tropext(self, name):
+        return Tropext(self._log, name, self._manifest.namespace,
+                       self._manifest.region, storage=self._storage)
+
+    def plan(self):
+        """Returns a dict of every stack to the stacks it depends on. The
+           templates are generated once with SRefs recorded instead of
+           resolved, so stacks that don't exist yet can be referenced."""
+        manifest = self._manifest
+        dependencies = dict()
+        for name in sorted(manifest.stacks):
+            referenced = set()
+            SRef.record(referenced)
+            try:
+                body = self.tropext(name).generate(
+                    manifest.template(name), manifest.args(name), False)
+            finally:
+                SRef.record(None)
+            if body is None:
+                raise ValueError("Unable to generate stack '{}'"
+                                 .format(name))
+
+            targets = manifest.depends_on(name)
+            prefix = '{}-'.format(manifest.namespace)
+            for region, stack_name in referenced:
+                target = stack_name[len(prefix):]
+                if region == manifest.region and \
+                        stack_name.startswith(prefix) and \
+                        target in manifest.stacks:
+                    targets.add(target)
+            targets.discard(name)
+            dependencies[name] = targets
+        return dependencies
+
+    def state(self):
+        """Returns the state recorded by an earlier run, None if there
+           is none"""
+        try:
+            with open(self._state_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def resume(self, planned):
+        """Returns the number of waves of planned completed by an earlier
+           run of the same manifest"""
+        state = self.state()
+        if state is None:
+            return 0
+        if state.get('version') != VERSION or \
+                state.get('manifest') != self._manifest.digest or \
+                state.get('waves') != planned:
+            self._log.warn("Manifest or templates changed since the "
+                           "deploy recorded in '{}', starting over"
+                           .format(self._state_path))
+            return 0
+        return state['completed']
+
+    def _save(self, planned, completed):
+        write_atomic(self._state_path, json.dumps({
+            'version': VERSION, 'manifest': self._manifest.digest,
+            'waves': planned, 'completed': completed}, indent=2,
+            sort_keys=True))
+
+    def run(self, planned, start=0):
+        """Deploys the waves of planned from start on. Returns a Generator
+           of (stack, kind, value) tuples, kind is 'wave' with the wave
+           index when a wave starts, 'event' for stack events and 'result'
+           with an (ok, detail) tuple once a stack is done. Stacks of the
+           waves after a failed one are skipped."""
+        for index in range(start, len(planned)):
+            wave = planned[index]
+            # stacks of the previous waves exist now or changed
+            SRef.reset()
+            yield None, 'wave', index
+            for item in self._run(wave):
+                yield item
+
+            failed = [name for name in wave if not self.results[name][0]]
+            if failed:
+                for name in [n for w in planned[index + 1:] for n in w]:
+                    self.results[name] = (False, 'skipped, {} failed'
+                                          .format(', '.join(failed)))
+                    yield name, 'result', self.results[name]
+                return
+            self._save(planned, index + 1)
+
+        # nothing left to resume
+        if os.path.exists(self._state_path):
+            os.remove(self._state_path)
+
+    def _run(self, wave):
+        for name, kind, value in concurrently(self._log, wave, self._deploy,
+                                              self._parallel):
+            if kind == 'result':
+                self.results[name] = value
+            yield name, kind, value
+
+    def _deploy(self, name, emit):
+        """Creates the stack or updates it when its template or
+           parameters changed, and watches it to the end"""
+        manifest = self._manifest
+        template = manifest.template(name)
+        params = manifest.params(name)
+        tropext = self.tropext(name)
+
+        if tropext.status() is None:
+            stack_id = tropext.create(self._creator, template,
+                                      manifest.args(name), params)
+        elif not params and tropext.diff(template,
+                                         manifest.args(name)) == []:
+            return True, 'unchanged'
+        else:
+            # parameters are not diffed, the update finds out
+            stack_id = tropext.update(template, manifest.args(name), params,
+                                      unchanged=UNCHANGED)
+            if stack_id is UNCHANGED:
+                return True, 'unchanged'
+        if stack_id is None:
+            return False, 'not started, see the log'
+
+        events = []
+        for e in tropext.watch(False, self._fail_fast):
+            emit('event', e)
+            events.append(e)
+        causes = root_causes(last_operation(events, tropext.fq_stack_name))
+        if causes:
+            return False, '{} ({} {})'.format(
+                tropext.status(), causes[0].logical_resource_id,
+                causes[0].resource_status_reason)
+        # the wave is only judged once the stack settled
+        status = tropext.final_status()
+        return succeeded(status), status
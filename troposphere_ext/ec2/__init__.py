@@ -3,6 +3,9 @@
 #
 
 import re
+import gzip
+import base64
+import StringIO
 
 import troposphere
 import troposphere.ec2
@@ -10,7 +13,7 @@ import troposphere_ext
 import collections
 import yaml
 
-from troposphere import Ref, Join, Base64
+from troposphere import Join, Base64
 from troposphere.ec2 import SubnetRouteTableAssociation
 from troposphere.ec2 import SubnetNetworkAclAssociation
 
@@ -33,71 +36,88 @@ class VPC(troposphere.ec2.VPC):
 
         super(VPC, self).__init__(title, template, **clean_kwargs)
 
-        if template is not None:
-
-            # gatey attachment
-            if self._attach_gateway is not None:
-                attachment = self._attach_gateway
-                attachment.title = '{}{}'.format(self.title, attachment.title)
-                attachment.VpcId = troposphere.Ref(self)
-                template._register_resource(attachment)
-
-            # network ACLs
-            for acl in self._network_acls:
-                acl.title = '{}{}'.format(self.title, acl.title)
-                acl.VpcId = troposphere.Ref(self)
-
-                # network ACL entries
-                for entry in acl.network_acl_entries:
-                    entry.title = '{}{}'.format(acl.title, entry.title)
-                    entry.NetworkAclId = troposphere.Ref(acl)
-                    template._register_resource(entry)
-
-                template._register_resource(acl)
-
-            # route tables
-            for route_table in self._route_tables:
-                route_table.title = '{}{}'.format(self.title,
-                                                  route_table.title)
-                route_table.VpcId = Ref(self)
-
-                # routes
-                for route in route_table.routes:
-                    route.title = '{}{}'.format(route_table.title,
-                                                route.title)
-                    route.RouteTableId = Ref(route_table)
-                    template._register_resource(route)
-
-                template._register_resource(route_table)
-
-            # subnets
-            for subnet in self._subnets:
-                subnet.title = '{}{}'.format(self.title, subnet.title)
-                subnet.VpcId = Ref(self)
-
-                # route table associations
-                for route_table in subnet.route_tables:
-                    route_table_assoc = SubnetRouteTableAssociation(
-                        '{}{}Assoc'.format(subnet.title,
-                                           route_table.get_ref().title),
-                        SubnetId=Ref(subnet),
-                        RouteTableId=route_table)
-                    template._register_resource(route_table_assoc)
-
-                # network ACL associations
-                for acl in subnet.network_acls:
-                    network_acl_assoc = SubnetNetworkAclAssociation(
-                        '{}{}Assoc'.format(subnet.title, acl.get_ref().title),
-                        SubnetId=troposphere.Ref(subnet),
-                        NetworkAclId=acl)
-                    template._register_resource(network_acl_assoc)
-
-                template._register_resource(subnet)
-
-            # security groups
-            for security_group in self._security_groups:
-                security_group.VpcId = troposphere.Ref(self)
-                template._register_resource(security_group)
+        if template is None:
+            return
+
+        # gatey attachment
+        if self._attach_gateway is not None:
+            attachment = self._attach_gateway
+            attachment.title = '{}{}'.format(self.title, attachment.title)
+            attachment.VpcId = template.ref(self)
+            template._register_resource(attachment)
+
+        # network ACLs
+        for acl in self._network_acls:
+            acl.title = '{}{}'.format(self.title, acl.title)
+            acl.VpcId = template.ref(self)
+
+            # network ACL entries
+            for entry in acl.network_acl_entries:
+                entry.title = '{}{}'.format(acl.title, entry.title)
+                entry.NetworkAclId = template.ref(acl)
+                template._register_resource(entry)
+
+            template._register_resource(acl)
+
+        # route tables
+        for route_table in self._route_tables:
+            route_table.title = '{}{}'.format(self.title,
+                                              route_table.title)
+            route_table.VpcId = template.ref(self)
+
+            # routes
+            for route in route_table.routes:
+                route.title = '{}{}'.format(route_table.title,
+                                            route.title)
+                route.RouteTableId = template.ref(route_table)
+                template._register_resource(route)
+
+            template._register_resource(route_table)
+
+        # subnets
+        for subnet in self._subnets:
+            subnet.title = '{}{}'.format(self.title, subnet.title)
+            subnet.VpcId = template.ref(self)
+            template._register_resource(subnet)
+
+        # security groups
+        for security_group in self._security_groups:
+            security_group.VpcId = template.ref(self)
+            template._register_resource(security_group)
+
+        # subnet associations can name route tables and ACLs that are
+        # not added yet, they are registered in one pass when the
+        # template is rendered
+        if any(s.route_tables or s.network_acls for s in self._subnets):
+            template._defer(self._associate)
+
+    def _associate(self, template):
+        # resolve each route table and ACL the subnets reference once
+        # instead of once per subnet association and again at render
+        route_tables = _resolve(
+            [rt for subnet in self._subnets for rt in subnet.route_tables])
+        acls = _resolve(
+            [acl for subnet in self._subnets for acl in subnet.network_acls])
+
+        for subnet in self._subnets:
+
+            # route table associations
+            for route_table in subnet.route_tables:
+                route_table = route_tables[_target(route_table)]
+                route_table_assoc = SubnetRouteTableAssociation(
+                    '{}{}Assoc'.format(subnet.title, route_table.title),
+                    SubnetId=template.ref(subnet),
+                    RouteTableId=template.ref(route_table))
+                template._register_resource(route_table_assoc)
+
+            # network ACL associations
+            for acl in subnet.network_acls:
+                acl = acls[_target(acl)]
+                network_acl_assoc = SubnetNetworkAclAssociation(
+                    '{}{}Assoc'.format(subnet.title, acl.title),
+                    SubnetId=template.ref(subnet),
+                    NetworkAclId=template.ref(acl))
+                template._register_resource(network_acl_assoc)
 
     @property
     def network_acl_entries(self):
@@ -124,6 +144,23 @@ class VPC(troposphere.ec2.VPC):
         return self._security_groups
 
 
+def _target(ref):
+    # TRefs to the same resource or regex share one resolution
+    return getattr(ref, '_resource', ref)
+
+
+def _resolve(refs):
+    """Maps each distinct reference target to the
+       resource it resolves to"""
+    resources = dict()
+    for ref in refs:
+        target = _target(ref)
+        if target not in resources:
+            resources[target] = ref.get_ref() \
+                if hasattr(ref, 'get_ref') else ref
+    return resources
+
+
 class RouteTable(troposphere.ec2.RouteTable):
 
     def __init__(self, title, template=None, **kwargs):
@@ -186,30 +223,220 @@ class NetworkAcl(troposphere.ec2.NetworkAcl):
         return self._network_acl_entries
 
 
+try:
+    from yaml.cyaml import CEmitter
+except ImportError:
+    YAMLDumper = yaml.Dumper
+else:
+    class YAMLDumper(CEmitter, yaml.Dumper):
+        """yaml.Dumper with the libyaml C emitter. Representers are
+           looked up on yaml.Dumper, so the ones registered with
+           yaml.add_representer apply to Cloud Config too."""
+
+        __init__ = yaml.CDumper.__init__.im_func
+
+MIME_BOUNDARY = '==TROPEXT-USER-DATA=='
+
+USER_DATA_DIR = '/var/lib/tropext'
+
+# rendered user data keyed on content, shared by identical scripts
+_rendered = dict()
+_RENDERED_SIZE = 256
+
+
+def _memoize(key, render):
+    if key is None:
+        return render()
+    value = _rendered.get(key)
+    if value is None:
+        if len(_rendered) >= _RENDERED_SIZE:
+            _rendered.clear()
+        value = _rendered[key] = render()
+    return value
+
+
+def _plain_key(value):
+    """Returns a hashable key equal for equal plain dicts, lists and
+       scalars. Raises TypeError for anything else."""
+    if isinstance(value, dict):
+        return dict, tuple(sorted((_plain_key(k), _plain_key(v))
+                                  for k, v in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(_plain_key(v) for v in value)
+    if value is None or isinstance(value, (basestring, bool, int, long,
+                                           float)):
+        # 1 and True are equal but don't dump the same
+        return type(value), value
+    raise TypeError('{} is not plain data'.format(type(value).__name__))
+
+
+def _gzip_b64(value, width=None):
+    """Gzips the value and returns it base64 encoded, optionally
+       in lines of at most width characters"""
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    buf = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(value)
+    encoded = base64.b64encode(buf.getvalue())
+    if width is None:
+        return encoded
+    return '\n'.join(encoded[i:i + width]
+                     for i in range(0, len(encoded), width))
+
+
+def _mime(parts):
+    """Returns a multipart MIME cloud-init payload as a list of strings
+       and helper functions. Each part is a (content type, file name,
+       list of body fragments) tuple."""
+    result = ['Content-Type: multipart/mixed; boundary="{}"\n'
+              'MIME-Version: 1.0\n'.format(MIME_BOUNDARY)]
+    for content_type, filename, body in parts:
+        result.append('\n--{}\n'
+                      'Content-Type: {}; charset="us-ascii"\n'
+                      'MIME-Version: 1.0\n'
+                      'Content-Transfer-Encoding: 7bit\n'
+                      'Content-Disposition: attachment; filename="{}"\n\n'
+                      .format(MIME_BOUNDARY, content_type, filename))
+        result.extend(body)
+    result.append('\n--{}--\n'.format(MIME_BOUNDARY))
+    return result
+
+
 class CloudConfig(troposphere.AWSHelperFn):
+    """Cloud Config user data. With compress the YAML is gzipped and
+       passed base64 encoded, cloud-init detects and inflates it."""
+
+    __slots__ = ('config', 'compress')
 
-    def __init__(self, config):
+    def __init__(self, config, compress=False):
         self.config = config
+        self.compress = compress
 
     def JSONrepr(self):
-        result = yaml.dump(self.config, default_flow_style=False)
+        try:
+            key = (CloudConfig, self.compress, _plain_key(self.config))
+        except TypeError:
+            # the YAML holds what helpers like SRef resolve to, which
+            # changes with SRef.reset and SRef.rename, just render it
+            key = None
+        return _memoize(key, self._render)
+
+    def _render(self):
+        result = yaml.dump(self.config, Dumper=YAMLDumper,
+                           default_flow_style=False)
         result = '#cloud-config\n' + result
+        if self.compress:
+            # there are no intrinsic functions left to resolve so
+            # the payload is already final
+            return _gzip_b64(result)
         return Base64(result)
 
 
 class UserData(troposphere.AWSHelperFn):
+    """Shell script user data built from strings and helper functions
+       such as Ref, TRef and SRef. A leading margin ending in | is
+       stripped from every line of the strings.
 
-    def __init__(self, *args):
+       With compress=True the script is gzipped into a multipart MIME
+       payload. A cloud-config part writes the compressed script and a
+       small shell part substitutes the helper function values into it
+       before running it."""
+
+    __slots__ = ('data', 'compress')
+
+    _margin = re.compile('\n[ \t]*\|')
+
+    def __init__(self, *args, **kwargs):
         self.data = args
+        self.compress = kwargs.pop('compress', False)
+        if len(kwargs) > 0:
+            raise TypeError('Unexpected arguments {}'.format(kwargs.keys()))
 
     def _strip_margin(self, value):
-        return re.sub('\n[ \t]*\|', '\n', value)
+        return self._margin.sub('\n', value)
 
-    def JSONrepr(self):
-        # flatten array
-        data = [x for y in self.data
+    def _flatten(self):
+        return [x for y in self.data
                 for x in (y if isinstance(y, list) else [y])]
+
+    def JSONrepr(self):
+        data = self._flatten()
+        if self.compress:
+            # helpers that resolve to plain strings, like SRef, are
+            # inlined so their values are part of the key
+            data = [self._inline(v) for v in data]
+        # helpers are kept in the key, equal keys hold the same helpers
+        key = (UserData, self.compress) + tuple(data)
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+        return _memoize(key, lambda: self._render(data))
+
+    def _inline(self, value):
+        if hasattr(value, 'JSONrepr'):
+            resolved = value.JSONrepr()
+            if isinstance(resolved, basestring):
+                return resolved
+        return value
+
+    def _render(self, data):
         # strip margin from the strings
-        data = [self._strip_margin(v) if isinstance(v, str) else v
+        data = [self._strip_margin(v) if isinstance(v, basestring) else v
                 for v in data]
-        return Base64(Join('', data))
+        if not self.compress:
+            return Base64(Join('', data))
+
+        script = []
+        values = []
+        for v in data:
+            if isinstance(v, basestring):
+                script.append(v)
+            else:
+                script.append('@@TROPEXT_{}@@'.format(len(values)))
+                values.append(v)
+        script = ''.join(script)
+        if not script.startswith('#!'):
+            raise ValueError('Compressed user data must be a script '
+                             'starting with #!')
+
+        path = '{}/user-data'.format(USER_DATA_DIR)
+        files = ['#cloud-config\n'
+                 'write_files:\n'
+                 '- path: {}\n'
+                 '  permissions: \'0600\'\n'
+                 '  encoding: gz+b64\n'
+                 '  content: |\n'.format(path)]
+        files.extend('    {}\n'.format(line) for line in
+                     _gzip_b64(script, 76).splitlines())
+
+        # the values can hold parameters, only root may read them
+        runner = ['#!/bin/sh\n'
+                  'set -e\n'
+                  '(umask 077\n'
+                  'cat > {}.vars <<\'TROPEXT_VARS\'\n'.format(path)]
+        # base64 encoded, values can span lines or hold the delimiter
+        for i, v in enumerate(values):
+            runner.extend(['{}\t'.format(i), Base64(v), '\n'])
+        # decoded with a trailing x so a final newline is kept, literal
+        # substitution as awk gsub would interpret & and \\
+        runner.append(
+            'TROPEXT_VARS\n'
+            'awk -F \'\\t\' \''
+            'NR == FNR {{ c = "printf %s \\"" $2 "\\" | base64 -d; '
+            'printf x"; s = ""; n = 0; '
+            'while ((c | getline l) > 0) s = (n++ ? s "\\n" : "") l; '
+            'close(c); v["@@TROPEXT_" $1 "@@"] = '
+            'substr(s, 1, length(s) - 1); next }} '
+            '{{ for (k in v) {{ out = ""; s = $0; '
+            'while ((i = index(s, k)) > 0) {{ '
+            'out = out substr(s, 1, i - 1) v[k]; '
+            's = substr(s, i + length(k)) }} $0 = out s }} print }}\' '
+            '{0}.vars {0} > {0}.run)\n'
+            'chmod 0700 {0}.run\n'
+            'exec {0}.run\n'.format(path))
+
+        return Base64(Join('', _mime([
+            ('text/cloud-config', 'tropext-files.cfg', files),
+            ('text/x-shellscript', 'tropext-run.sh', runner)])))
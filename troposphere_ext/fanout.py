@@ -0,0 +1,112 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import Queue
+import threading
+
+from troposphere_ext.utils import Tropext
+
+
+def succeeded(status):
+    """Returns True for a final stack status that is not a failure"""
+    return status is not None and status.endswith('_COMPLETE') \
+        and 'ROLLBACK' not in status and 'DELETE' not in status
+
+
+def concurrently(log, keys, task, parallel, label='stack'):
+    """Calls task(key, emit) for every key on up to parallel threads.
+       Returns a Generator of (key, kind, value) tuples merged from all
+       tasks as they arrive. A task adds to the stream with emit(kind,
+       value) and its return value is streamed as a 'result'. A task
+       that raises results in a (False, error) tuple."""
+    pending = Queue.Queue()
+    for key in keys:
+        pending.put(key)
+    stream = Queue.Queue()
+
+    def _worker():
+        while 1:
+            try:
+                key = pending.get_nowait()
+            except Queue.Empty:
+                return
+
+            def _emit(kind, value, key=key):
+                stream.put((key, kind, value))
+
+            try:
+                result = task(key, _emit)
+            except Exception as e:
+                log.exception("Error in {} '{}'".format(label, key))
+                result = (False, str(e))
+            stream.put((key, 'result', result))
+
+    for _ in range(min(parallel, len(keys))):
+        worker = threading.Thread(target=_worker)
+        worker.daemon = True
+        worker.start()
+
+    remaining = len(keys)
+    while remaining:
+        try:
+            # a timeout keeps the main thread responsive to Ctrl-C
+            key, kind, value = stream.get(timeout=1)
+        except Queue.Empty:
+            continue
+        if kind == 'result':
+            remaining -= 1
+        yield key, kind, value
+
+
+class FanOut(object):
+    """Runs the same stack operation in several regions at once, one
+       Tropext per region. Templates are still generated one at a time
+       but deploys and watches run concurrently."""
+
+    def __init__(self, log, stack_name, namespace, regions, parallel=4,
+                 canary=False, storage=None, artifacts=None,
+                 from_artifacts=False):
+        self._log = log
+        self._regions = list(regions)
+        self._parallel = max(1, parallel)
+        self._canary = canary
+        self._tropexts = dict(
+            (region, Tropext(log, stack_name, namespace, region,
+                             storage=None if storage is None
+                             else storage(region), artifacts=artifacts,
+                             from_artifacts=from_artifacts))
+            for region in self._regions)
+        self.results = dict()
+
+    def run(self, task):
+        """Calls task(tropext, emit) for every region. Returns a Generator
+           of (region, kind, value) tuples merged from all regions as they
+           arrive. A task adds to the stream with emit(kind, value) and
+           returns an (ok, detail) tuple that is streamed as a 'result'
+           and kept in results. With canary the first region has to
+           succeed before the others start."""
+        regions = self._regions
+        if self._canary and len(regions) > 1:
+            for item in self._run(regions[:1], task):
+                yield item
+            if not self.results[regions[0]][0]:
+                for region in regions[1:]:
+                    self.results[region] = (False, 'skipped, canary {} '
+                                            'failed'.format(regions[0]))
+                    yield region, 'result', self.results[region]
+                return
+            regions = regions[1:]
+
+        for item in self._run(regions, task):
+            yield item
+
+    def _run(self, regions, task):
+        for region, kind, value in concurrently(
+                self._log, regions,
+                lambda region, emit: task(self._tropexts[region], emit),
+                self._parallel, 'region'):
+            if kind == 'result':
+                self.results[region] = value
+            yield region, kind, value
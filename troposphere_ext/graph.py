@@ -0,0 +1,310 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import json
+import collections
+
+# rough seconds Cloud Formation takes to create a resource of each type
+DURATIONS = {
+    'AWS::AutoScaling::AutoScalingGroup': 300,
+    'AWS::AutoScaling::LaunchConfiguration': 5,
+    'AWS::CloudFormation::Stack': 300,
+    'AWS::CloudFront::Distribution': 1200,
+    'AWS::EC2::EIP': 15,
+    'AWS::EC2::Instance': 120,
+    'AWS::EC2::InternetGateway': 15,
+    'AWS::EC2::NetworkAcl': 5,
+    'AWS::EC2::NetworkAclEntry': 5,
+    'AWS::EC2::Route': 5,
+    'AWS::EC2::RouteTable': 5,
+    'AWS::EC2::SecurityGroup': 5,
+    'AWS::EC2::SecurityGroupEgress': 5,
+    'AWS::EC2::SecurityGroupIngress': 5,
+    'AWS::EC2::Subnet': 5,
+    'AWS::EC2::SubnetNetworkAclAssociation': 5,
+    'AWS::EC2::SubnetRouteTableAssociation': 5,
+    'AWS::EC2::VPC': 15,
+    'AWS::EC2::VPCGatewayAttachment': 15,
+    'AWS::ElastiCache::CacheCluster': 600,
+    'AWS::ElasticLoadBalancing::LoadBalancer': 60,
+    'AWS::IAM::InstanceProfile': 120,
+    'AWS::IAM::Policy': 30,
+    'AWS::IAM::Role': 30,
+    'AWS::RDS::DBInstance': 600,
+    'AWS::Route53::RecordSet': 60,
+    'AWS::Route53::RecordSetGroup': 60,
+    'AWS::S3::Bucket': 20,
+}
+DEFAULT_DURATION = 30
+
+
+def references(value):
+    """Returns a Generator of (kind, target, attribute) tuples for every
+       Ref and Fn::GetAtt in a rendered template fragment. Attribute is
+       None for a Ref."""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if len(value) == 1:
+                if 'Ref' in value and isinstance(value['Ref'], basestring):
+                    yield ('Ref', value['Ref'], None)
+                    continue
+                get_att = value.get('Fn::GetAtt')
+                if isinstance(get_att, list) and len(get_att) == 2:
+                    yield ('GetAtt', get_att[0], get_att[1])
+                    continue
+            stack.extend(value.itervalues())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+
+def rewrite(value, rewire):
+    """Returns a copy of value with every Ref and Fn::GetAtt replaced by
+       what rewire returns for it, references rewire returns None for
+       are kept"""
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if isinstance(value.get('Ref'), basestring):
+                return rewire('Ref', value['Ref'], None) or value
+            get_att = value.get('Fn::GetAtt')
+            if isinstance(get_att, list) and len(get_att) == 2:
+                return rewire('GetAtt', get_att[0], get_att[1]) or value
+        return dict((k, rewrite(v, rewire)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return [rewrite(v, rewire) for v in value]
+    return value
+
+
+def depends_on(resource):
+    """Returns the DependsOn titles of a rendered resource as a list"""
+    value = resource.get('DependsOn', [])
+    return [value] if isinstance(value, basestring) else list(value)
+
+
+class DependencyGraph(object):
+    """Dependency graph of the resources in a rendered template. An edge
+       from a resource to another means it has to be created after it,
+       edges are labeled with the Ref, GetAtt and DependsOn kinds that
+       caused them."""
+
+    def __init__(self, template):
+        self._resources = template.get('Resources', {})
+        self._edges = dict()
+
+        for title, resource in self._resources.iteritems():
+            edges = collections.defaultdict(set)
+            for kind, target, _ in references(resource):
+                if target in self._resources:
+                    edges[target].add(kind)
+            for target in depends_on(resource):
+                if target in self._resources:
+                    edges[target].add('DependsOn')
+            self._edges[title] = dict(edges)
+
+        # reachability sets are kept as bit masks over these
+        self._bits = dict((title, 1 << i)
+                          for i, title in enumerate(self.nodes))
+
+    @property
+    def nodes(self):
+        return sorted(self._edges)
+
+    def edges(self, title=None):
+        """Returns the edges of a resource, or all edges, as a dict of
+           target title to the set of edge kinds"""
+        if title is not None:
+            return self._edges[title]
+        return self._edges
+
+    def resource_type(self, title):
+        return self._resources[title].get('Type')
+
+    def duration(self, title, durations=DURATIONS):
+        return durations.get(self.resource_type(title), DEFAULT_DURATION)
+
+    def order(self):
+        """Returns the titles in creation order, dependencies first"""
+        cycles = self.cycles()
+        if cycles:
+            raise ValueError("Circular dependency between resources {}"
+                             .format('; '.join(', '.join(c)
+                                               for c in cycles)))
+
+        dependents = collections.defaultdict(list)
+        waiting = dict()
+        for title, edges in self._edges.iteritems():
+            waiting[title] = len(edges)
+            for target in edges:
+                dependents[target].append(title)
+
+        ready = sorted((t for t, n in waiting.iteritems() if n == 0),
+                       reverse=True)
+        order = []
+        while ready:
+            title = ready.pop()
+            order.append(title)
+            for dependent in sorted(dependents[title], reverse=True):
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        return order
+
+    def depth(self):
+        """Returns the number of resources in the longest dependency
+           chain, the number of rounds Cloud Formation needs even with
+           unlimited parallelism"""
+        depth = dict()
+        for title in self.order():
+            depth[title] = 1 + max([0] + [depth[t]
+                                          for t in self._edges[title]])
+        return max([0] + depth.values())
+
+    def critical_path(self, durations=DURATIONS):
+        """Returns the estimated seconds to create every resource and
+           the chain of titles that takes the longest, weighted by the
+           per resource type durations"""
+        finish = dict()
+        previous = dict()
+        for title in self.order():
+            before = None
+            for target in sorted(self._edges[title]):
+                if before is None or finish[target] > finish[before]:
+                    before = target
+            previous[title] = before
+            finish[title] = self.duration(title, durations) + \
+                (finish[before] if before is not None else 0)
+
+        if not finish:
+            return 0, []
+
+        title = max(sorted(finish), key=lambda t: finish[t])
+        total = finish[title]
+        path = []
+        while title is not None:
+            path.append(title)
+            title = previous[title]
+        return total, path[::-1]
+
+    def redundant_depends_on(self):
+        """Returns (title, target) DependsOn edges that do not change
+           the creation order, either because the resource already has
+           a Ref or Fn::GetAtt to the target or because the target is
+           reached through another dependency. Removing them leaves the
+           schedule the same but makes the real ordering visible."""
+        reach = dict()
+        redundant = []
+        for title in self.order():
+            edges = self._edges[title]
+            mask = 0
+            for target in edges:
+                mask |= reach[target] | self._bits[target]
+            reach[title] = mask
+
+            for target, kinds in sorted(edges.iteritems()):
+                if 'DependsOn' not in kinds:
+                    continue
+                if len(kinds) > 1 or any(
+                        reach[other] & self._bits[target]
+                        for other in edges if other != target):
+                    redundant.append((title, target))
+        return redundant
+
+    def to_dict(self, durations=DURATIONS):
+        total, path = self.critical_path(durations)
+        return {
+            'resources': dict((title, {'type': self.resource_type(title),
+                                       'duration': self.duration(title,
+                                                                 durations)})
+                              for title in self._edges),
+            'edges': [{'from': title, 'to': target, 'kinds': sorted(kinds)}
+                      for title in self.nodes
+                      for target, kinds in sorted(
+                          self._edges[title].iteritems())],
+            'depth': self.depth(),
+            'critical_path': {'duration': total, 'resources': path},
+            'redundant_depends_on': [list(e)
+                                     for e in self.redundant_depends_on()]
+        }
+
+    def to_json(self, durations=DURATIONS):
+        return json.dumps(self.to_dict(durations), indent=2, sort_keys=True)
+
+    def to_dot(self, durations=DURATIONS):
+        """Returns the graph in Graphviz DOT format. Critical path edges
+           are red and redundant DependsOn edges dashed."""
+        _, path = self.critical_path(durations)
+        critical = set(zip(path[1:], path[:-1]))
+        redundant = set(self.redundant_depends_on())
+
+        lines = ['digraph "template" {', '  rankdir=BT;',
+                 '  node [shape=box];']
+        for title in self.nodes:
+            lines.append('  "{}" [label="{}\\n{} {}s"];'.format(
+                title, title, self.resource_type(title),
+                self.duration(title, durations)))
+        for title in self.nodes:
+            for target, kinds in sorted(self._edges[title].iteritems()):
+                attrs = ['label="{}"'.format(','.join(sorted(kinds)))]
+                if (title, target) in critical:
+                    attrs.append('color=red')
+                if (title, target) in redundant:
+                    attrs.append('style=dashed')
+                lines.append('  "{}" -> "{}" [{}];'.format(
+                    title, target, ', '.join(attrs)))
+        lines.append('}')
+        return '\n'.join(lines)
+
+    def cycles(self):
+        """Returns every dependency cycle as a sorted list of titles,
+           found with an iterative Tarjan's strongly connected
+           components search"""
+        index = dict()
+        low = dict()
+        stack = []
+        on_stack = set()
+        cycles = []
+        counter = [0]
+
+        for root in self.nodes:
+            if root in index:
+                continue
+            work = [(root, iter(sorted(self._edges[root])))]
+            index[root] = low[root] = counter[0]
+            counter[0] += 1
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                node, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child not in index:
+                        index[child] = low[child] = counter[0]
+                        counter[0] += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(self._edges[child]))))
+                    elif child in on_stack:
+                        low[node] = min(low[node], index[child])
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in self._edges[node]:
+                        cycles.append(sorted(component))
+
+        return sorted(cycles)
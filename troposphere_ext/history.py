@@ -0,0 +1,156 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import os
+import math
+import sqlite3
+import threading
+import collections
+
+from troposphere_ext.timeline import Timeline, operations, own
+from troposphere_ext.timeline import timestamp
+
+DEFAULT_DATABASE = os.path.join(os.path.expanduser('~'), '.tropext',
+                                'history.db')
+
+EVENT_COLUMNS = ['event_id', 'namespace', 'stack', 'region', 'timestamp',
+                 'logical_resource_id', 'resource_type', 'resource_status',
+                 'resource_status_reason']
+
+Event = collections.namedtuple('Event', EVENT_COLUMNS)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    event_id TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    region TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    logical_resource_id TEXT NOT NULL,
+    resource_type TEXT NOT NULL,
+    resource_status TEXT NOT NULL,
+    resource_status_reason TEXT
+);
+CREATE INDEX IF NOT EXISTS events_stack
+    ON events (namespace, stack, region, timestamp);
+CREATE INDEX IF NOT EXISTS events_resource
+    ON events (logical_resource_id, timestamp);
+CREATE INDEX IF NOT EXISTS events_type
+    ON events (resource_type, timestamp);
+'''
+
+
+def percentile(values, p):
+    """Nearest rank percentile of a list of numbers"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def _fq_name(namespace, stack):
+    """Name of a stack in Cloud Formation, the logical id of its own
+       events"""
+    return '{}-{}'.format(namespace, stack)
+
+
+class History(object):
+    """Local SQLite store of every stack event Tropext has seen, used for
+       provisioning time and failure statistics"""
+
+    def __init__(self, path=DEFAULT_DATABASE):
+        if path != ':memory:':
+            directory = os.path.dirname(os.path.abspath(path))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def record(self, namespace, stack, region, events):
+        """Stores stack events, events already stored are ignored"""
+        rows = [(e.event_id, namespace, stack, region,
+                 timestamp(e.timestamp).strftime('%Y-%m-%dT%H:%M:%S'),
+                 e.logical_resource_id, e.resource_type, e.resource_status,
+                 e.resource_status_reason) for e in events]
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO events VALUES ({})'
+                    .format(', '.join('?' * len(EVENT_COLUMNS))), rows)
+
+    def events(self, namespace=None, stack=None, region=None, since=None):
+        """Returns the stored events in chronological order"""
+        where = []
+        args = []
+        for column, value in [('namespace', namespace), ('stack', stack),
+                              ('region', region)]:
+            if value is not None:
+                where.append('{} = ?'.format(column))
+                args.append(value)
+        if since is not None:
+            where.append('timestamp >= ?')
+            args.append(since)
+
+        query = 'SELECT {} FROM events{} ORDER BY namespace, stack, ' \
+                'region, timestamp, rowid'.format(
+                    ', '.join(EVENT_COLUMNS),
+                    ' WHERE ' + ' AND '.join(where) if where else '')
+        with self._lock:
+            return [Event(*row) for row in self._db.execute(query, args)]
+
+    def operations(self, **filters):
+        """Returns (namespace, stack, region, events) for every stored
+           stack operation"""
+        stacks = collections.OrderedDict()
+        for e in self.events(**filters):
+            stacks.setdefault((e.namespace, e.stack, e.region),
+                              []).append(e)
+        return [key + (events,) for key, events in stacks.iteritems()
+                for events in operations(events, _fq_name(*key[:2]))]
+
+    def resource_types(self, **filters):
+        """Returns per resource type counts, failures and the durations
+           of successful creates and updates"""
+        types = collections.defaultdict(
+            lambda: {'count': 0, 'failed': 0, 'durations': []})
+        for namespace, stack, _, events in self.operations(**filters):
+            for span in Timeline(events, _fq_name(namespace, stack)).spans:
+                if span.status is None:
+                    continue
+                stats = types[span.resource_type]
+                stats['count'] += 1
+                if span.status.endswith('_FAILED'):
+                    stats['failed'] += 1
+                elif span.status in ('CREATE_COMPLETE', 'UPDATE_COMPLETE'):
+                    stats['durations'].append(span.duration())
+        return dict(types)
+
+    def durations(self, p=50, **filters):
+        """Returns the p percentile provisioning seconds per resource
+           type, usable as DependencyGraph durations"""
+        return dict((resource_type, percentile(stats['durations'], p))
+                    for resource_type, stats
+                    in self.resource_types(**filters).iteritems()
+                    if stats['durations'])
+
+    def deploys(self, **filters):
+        """Returns the stored stack operations with their duration and
+           final status, oldest first"""
+        deploys = []
+        for namespace, stack, region, events in self.operations(**filters):
+            name = _fq_name(namespace, stack)
+            statuses = [e.resource_status for e in events if own(e, name)]
+            deploys.append({'namespace': namespace, 'stack': stack,
+                            'region': region, 'start': events[0].timestamp,
+                            'duration': Timeline(events, name).duration(),
+                            'operation': statuses[0].split('_')[0]
+                            if statuses else None,
+                            'status': statuses[-1] if statuses else None})
+        return sorted(deploys, key=lambda d: d['start'])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
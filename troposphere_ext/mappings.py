@@ -0,0 +1,311 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import os
+import csv
+import json
+import yaml
+
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# stands for a FindInMap key or attribute that is not a literal string,
+# any entry could be looked up with it
+ANY = None
+
+FORMATS = {'.json': 'json', '.csv': 'csv', '.yaml': 'yaml', '.yml': 'yaml'}
+
+CHUNK_SIZE = 1 << 16
+
+
+def literal(value):
+    """Returns a rendered FindInMap argument, or ANY when it is not a
+       literal string"""
+    return value if isinstance(value, basestring) else ANY
+
+
+def find_in_maps(value):
+    """Returns a Generator of (mapping, key, attribute) tuples for every
+       Fn::FindInMap in a rendered template fragment. Arguments that are
+       not literal strings are ANY."""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if len(value) == 1 and 'Fn::FindInMap' in value:
+                args = value['Fn::FindInMap']
+                if isinstance(args, list) and len(args) == 3:
+                    yield tuple(literal(a) for a in args)
+            stack.extend(value.itervalues())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+
+def usage(template):
+    """Returns a dict of mapping title to a dict of the keys looked up
+       in it to the set of attributes looked up for them. A title of ANY
+       means any mapping could be looked up."""
+    used = dict()
+    for section in ['Conditions', 'Outputs', 'Resources']:
+        for title, key, attribute in find_in_maps(template.get(section, {})):
+            used.setdefault(title, dict()).setdefault(key, set()).add(
+                attribute)
+    return used
+
+
+def load(path, format=None):
+    """Returns a Generator of the (key, attributes) entries of a JSON,
+       CSV or YAML mapping file. JSON and CSV files are read one entry
+       at a time. CSV files have a header row, the first column holds
+       the keys and every other column is an attribute."""
+    if format is None:
+        format = FORMATS.get(os.path.splitext(path)[1].lower())
+    if format not in FORMATS.values():
+        raise ValueError("Unknown mapping format for '{}'".format(path))
+
+    with open(path, 'rb') as f:
+        if format == 'json':
+            for entry in _json_entries(f):
+                yield entry
+        elif format == 'csv':
+            rows = csv.reader(f)
+            header = next(rows, [])
+            for row in rows:
+                if row:
+                    yield row[0], dict((name, value) for name, value
+                                       in zip(header[1:], row[1:]) if value)
+        else:
+            entries = yaml.load(f, Loader=YAMLLoader) or {}
+            for entry in entries.iteritems():
+                yield entry
+
+
+def prune(entries, used):
+    """Returns a Generator of the entries and attributes that the used
+       keys of a mapping could look up, see usage. Entries left without
+       attributes are dropped."""
+    if ANY in used:
+        attributes_of_any = used[ANY]
+    elif not used:
+        return
+    else:
+        attributes_of_any = set()
+
+    for key, attributes in entries:
+        if key not in used and ANY not in used:
+            continue
+        wanted = used.get(key, set()) | attributes_of_any
+        if ANY not in wanted:
+            attributes = dict((name, value)
+                              for name, value in attributes.iteritems()
+                              if name in wanted)
+        if attributes:
+            yield key, attributes
+
+
+def _recorded(entries, keys):
+    """Passes entries through, adding their keys to the set keys"""
+    for key, attributes in entries:
+        keys.add(key)
+        yield key, attributes
+
+
+def share(entries):
+    """Returns a mapping dict of entries where repeated attribute sets
+       are one shared dict"""
+    shared = dict()
+    mapping = dict()
+    for key, attributes in entries:
+        fingerprint = json.dumps(attributes, sort_keys=True)
+        mapping[key] = shared.setdefault(fingerprint, attributes)
+    return mapping
+
+
+def factor(template, title, suffix='Index'):
+    """Moves the repeated attribute sets of a mapping into their own
+       entries when that makes the rendered template smaller. The
+       mapping is keyed by set and a '{title}{suffix}' mapping holds the
+       set of every original key. Every Fn::FindInMap of the mapping
+       looks the set up with a nested Fn::FindInMap. Returns True when
+       the mapping was factored."""
+    mapping = template['Mappings'][title]
+    index_title = '{}{}'.format(title, suffix)
+    if index_title in template['Mappings']:
+        return False
+
+    sets = dict()
+    index = dict()
+    values = dict()
+    for key in sorted(mapping):
+        fingerprint = json.dumps(mapping[key], sort_keys=True)
+        if fingerprint not in sets:
+            sets[fingerprint] = 'Set{}'.format(len(sets))
+            values[sets[fingerprint]] = mapping[key]
+        index[key] = {'Set': sets[fingerprint]}
+    if len(values) == len(mapping):
+        return False
+
+    uses = sum(1 for section in ['Conditions', 'Outputs', 'Resources']
+               for t, _, _ in find_in_maps(template.get(section, {}))
+               if t == title)
+    nested = len(json.dumps({'Fn::FindInMap': [index_title, '', 'Set']}))
+    if len(json.dumps(index)) + len(json.dumps(values)) + uses * nested >= \
+            len(json.dumps(mapping)):
+        return False
+
+    def _rewrite(value):
+        if isinstance(value, dict):
+            args = value.get('Fn::FindInMap')
+            if len(value) == 1 and isinstance(args, list) and \
+                    len(args) == 3 and args[0] == title:
+                return {'Fn::FindInMap': [title, {'Fn::FindInMap': [
+                    index_title, _rewrite(args[1]), 'Set']},
+                    _rewrite(args[2])]}
+            return dict((k, _rewrite(v)) for k, v in value.iteritems())
+        elif isinstance(value, list):
+            return [_rewrite(v) for v in value]
+        return value
+
+    for section in ['Conditions', 'Outputs', 'Resources']:
+        if section in template:
+            template[section] = _rewrite(template[section])
+    template['Mappings'][title] = values
+    template['Mappings'][index_title] = index
+    return True
+
+
+def check(mappings, lookups):
+    """Checks (mapping, key, attribute) lookups against rendered
+       mappings. Returns a sorted list of errors, a key that is not a
+       literal has to find the attribute under every key."""
+    errors = set()
+    # attribute to the keys that have it, per mapping
+    indexes = dict()
+    for title, key, attribute in lookups:
+        if title is ANY:
+            continue
+        if title not in mappings:
+            errors.add("Mapping '{}' is not defined".format(title))
+            continue
+        mapping = mappings[title]
+        if key is not ANY:
+            if key not in mapping:
+                errors.add("Mapping '{}' has no key '{}'"
+                           .format(title, key))
+            elif attribute is not ANY and attribute not in mapping[key]:
+                errors.add("Mapping '{}' key '{}' has no attribute '{}'"
+                           .format(title, key, attribute))
+        elif attribute is not ANY:
+            if title not in indexes:
+                index = indexes[title] = dict()
+                for k, attributes in mapping.iteritems():
+                    for name in attributes:
+                        index.setdefault(name, set()).add(k)
+            missing = set(mapping) - indexes[title].get(attribute, set())
+            if missing:
+                errors.add("Mapping '{}' keys {} have no attribute '{}'"
+                           .format(title, ', '.join(sorted(missing)),
+                                   attribute))
+    return sorted(errors)
+
+
+def _json_entries(f):
+    """Decodes the members of the top level object of a JSON file one
+       at a time so only the wanted entries are ever kept"""
+    reader = _JSONReader(f)
+    if reader.char() != '{':
+        raise ValueError('JSON mapping file is not an object')
+    reader.pos += 1
+    while 1:
+        char = reader.char()
+        if char == '}':
+            return
+        elif char == '':
+            raise ValueError('Truncated JSON mapping file')
+        key = reader.decode()
+        if reader.char() != ':':
+            raise ValueError("Expected ':' after mapping key '{}'"
+                             .format(key))
+        reader.pos += 1
+        reader.char()
+        yield str(key), reader.decode()
+
+
+class _JSONReader(object):
+
+    def __init__(self, f):
+        self._f = f
+        self._decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+
+    def more(self):
+        """Drops what was consumed and reads the next chunk, reads grow
+           with the buffer so large values are not decoded over and over"""
+        more = self._f.read(max(CHUNK_SIZE, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos:] + more
+        self.pos = 0
+        return len(more) > 0
+
+    def char(self):
+        """Skips whitespace and commas, returns the next character or ''
+           at the end of the file"""
+        while 1:
+            while self.pos < len(self.buf) and \
+                    self.buf[self.pos] in ' \t\r\n,':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ''
+
+    def decode(self):
+        while 1:
+            try:
+                value, self.pos = self._decoder.raw_decode(self.buf,
+                                                           self.pos)
+                return value
+            except ValueError:
+                if not self.more():
+                    raise ValueError('Truncated JSON mapping file')
+
+
+def resolve(template, sources, lookups=()):
+    """Adds the mappings of (title, entries, compact) sources to a
+       rendered template and checks the lookups. Entries of compact
+       sources are pruned to the keys and attributes the template looks
+       up, shared and factored. A mapping nothing is looked up in is
+       left out. Raises a LookupError listing every failed lookup."""
+    mappings = template.setdefault('Mappings', dict())
+    used = usage(template)
+    compacted = []
+    # lookups are checked against every key of a compact mapping, keys
+    # pruned for lacking the attributes looked up still count
+    checked = dict(mappings)
+    for title, entries, compact in sources:
+        if title in mappings:
+            raise ValueError('duplicate key "{}" detected'.format(title))
+        if compact:
+            wanted = {ANY: set([ANY])} if ANY in used \
+                else used.get(title, {})
+            keys = set()
+            mapping = share(prune(_recorded(entries(), keys), wanted))
+            if mapping:
+                mappings[title] = mapping
+                compacted.append(title)
+            if keys:
+                checked[title] = dict((key, mapping.get(key, {}))
+                                      for key in keys)
+        else:
+            mappings[title] = checked[title] = dict(entries())
+
+    errors = check(checked, [tuple(literal(a) for a in lookup)
+                             for lookup in lookups])
+    if errors:
+        raise LookupError('Mapping lookups failed:\n  {}'
+                          .format('\n  '.join(errors)))
+
+    for title in compacted:
+        factor(template, title)
+    return template
@@ -0,0 +1,246 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import re
+import json
+import hashlib
+
+from troposphere_ext.graph import DependencyGraph, depends_on, rewrite
+
+RECORD_SET_TYPE = 'AWS::Route53::RecordSet'
+RECORD_SET_GROUP_TYPE = 'AWS::Route53::RecordSetGroup'
+ZONE_PROPERTIES = ['HostedZoneId', 'HostedZoneName']
+
+# a group is a single Route 53 change batch, which holds at most 1000
+# resource records and 32000 characters of values. updates count every
+# record twice so groups are kept to half of that.
+MAX_RECORDS = 500
+MAX_CHARACTERS = 16000
+
+# characters counted for a value only known at deploy time, the length
+# of the longest domain name
+FUNCTION_CHARACTERS = 255
+
+# types whose values can be longer than FUNCTION_CHARACTERS, they are
+# only packed when every value is a plain string
+TEXT_TYPES = frozenset(['TXT', 'SPF'])
+
+
+def size(properties):
+    """Returns the (resource records, characters) a record set adds to
+       the change batch of its group"""
+    values = properties.get('ResourceRecords', [])
+    characters = sum(len(v) if isinstance(v, basestring)
+                     else FUNCTION_CHARACTERS for v in values)
+    # alias records have no resource records but are still a change
+    return max(1, len(values)), characters
+
+
+def _packable(resource):
+    """Returns True for a record set that means the same inside a group.
+       Record sets with a condition, DependsOn or policies, and ones
+       with computed record lists or text values, are left alone."""
+    if resource.get('Type') != RECORD_SET_TYPE or \
+            set(resource) != set(['Type', 'Properties']):
+        return False
+    properties = resource['Properties']
+    if len([p for p in ZONE_PROPERTIES if p in properties]) != 1:
+        return False
+    values = properties.get('ResourceRecords', [])
+    # a computed list could hold any number of records
+    if not isinstance(values, list):
+        return False
+    if properties.get('Type') in TEXT_TYPES:
+        return all(isinstance(v, basestring) for v in values)
+    return True
+
+
+def _levels(template, candidates):
+    """Returns the record sets that can go in any group mapped to None
+       and the ones other resources depend on mapped to their depth in
+       the dependency graph. Groups only hold record sets of one level
+       so packing can not create a circular dependency. Record sets
+       with a Fn::GetAtt to them are not returned."""
+    graph = DependencyGraph(template)
+    dependents = dict()
+    for title, edges in graph.edges().iteritems():
+        for target, kinds in edges.iteritems():
+            if target in candidates:
+                dependents.setdefault(target, set()).update(kinds)
+
+    levels = dict((title, None) for title in candidates
+                  if title not in dependents)
+    if len(levels) < len(candidates):
+        depth = dict()
+        for title in graph.order():
+            depth[title] = 1 + max([0] + [depth[t]
+                                          for t in graph.edges(title)])
+        for title, kinds in dependents.iteritems():
+            if 'GetAtt' not in kinds:
+                levels[title] = depth[title]
+    return levels
+
+
+def _key(properties, level):
+    zone = [(p, properties[p]) for p in ZONE_PROPERTIES if p in properties]
+    return json.dumps([zone, properties.get('Comment'), level],
+                      sort_keys=True)
+
+
+def _digest(value):
+    return int(hashlib.md5(value).hexdigest(), 16)
+
+
+def _label(value):
+    """Returns a logical id fragment for a hosted zone name or id"""
+    if isinstance(value, dict) and value.keys() == ['Ref']:
+        value = value['Ref']
+    if isinstance(value, basestring):
+        return ''.join(word[:1].upper() + word[1:]
+                       for word in re.split('[^0-9A-Za-z]+', value))
+    return 'Zone{:08x}'.format(_digest(json.dumps(value, sort_keys=True)) &
+                               0xffffffff)
+
+
+def _prefix(properties, level):
+    """Returns the start of the titles of the groups of a zone, the
+       same for every record set that can share a group"""
+    zone = [properties[p] for p in ZONE_PROPERTIES if p in properties][0]
+    prefix = _label(zone)
+    if properties.get('Comment') is not None:
+        prefix += 'Comment{:08x}'.format(
+            _digest(json.dumps(properties['Comment'], sort_keys=True)) &
+            0xffffffff)
+    if level is not None:
+        prefix += 'Level{}'.format(level)
+    return prefix
+
+
+def _buckets(titles, sizes, max_records, max_characters):
+    """Spreads record sets over groups by a hash of their title. The
+       number of groups is the smallest power of two that keeps every
+       group in the limits, so adding or removing a record set only
+       changes the group it is in. Returns a list of title lists."""
+    digests = dict((title, _digest(title)) for title in titles)
+    count = 1
+    while 1:
+        buckets = [[[], 0, 0] for _ in range(count)]
+        for title in titles:
+            bucket = buckets[digests[title] % count]
+            bucket[0].append(title)
+            bucket[1] += sizes[title][0]
+            bucket[2] += sizes[title][1]
+        if all(records <= max_records and characters <= max_characters
+               for _, records, characters in buckets):
+            return [bucket[0] for bucket in buckets]
+        count *= 2
+
+
+def pack(template, max_records=MAX_RECORDS,
+         max_characters=MAX_CHARACTERS, prefix=''):
+    """Returns a copy of a rendered template with the record sets of each
+       hosted zone packed into record set groups, and a dict of group
+       title to the titles of the record sets packed into it. Groups are
+       titled prefix, their zone and a hash bucket of the record set
+       titles, so they keep their title and members when other record
+       sets are added or removed. A Ref to a packed record set, its
+       domain name, is replaced by the Name of the record set and
+       resources that had one depend on the group instead, so the
+       records and creation order stay the same. Record sets that would
+       be alone in a group are kept as they are.
+
+       Packing a template that is already deployed moves its records to
+       new resources, which fails while the old ones still hold them."""
+    resources = template.get('Resources', {})
+    candidates = set(title for title, resource in resources.iteritems()
+                     if _packable(resource))
+    levels = _levels(template, candidates) if candidates else {}
+
+    keys = dict()
+    prefixes = dict()
+    sizes = dict()
+    for title in sorted(levels):
+        properties = resources[title]['Properties']
+        records, characters = size(properties)
+        # a record set over the limits on its own is left alone
+        if records > max_records or characters > max_characters:
+            continue
+        sizes[title] = records, characters
+        key = _key(properties, levels[title])
+        keys.setdefault(key, []).append(title)
+        prefixes[key] = _prefix(properties, levels[title])
+
+    # zones written differently, like with and without the trailing dot,
+    # can come out with the same prefix
+    shared = prefixes.values()
+    for key, zone in prefixes.items():
+        if shared.count(zone) > 1:
+            prefixes[key] = '{}Key{:08x}'.format(zone,
+                                                 _digest(key) & 0xffffffff)
+
+    template = dict(template)
+    resources = dict(resources)
+    packed = dict()
+    groups = dict()
+    for key in sorted(keys):
+        buckets = _buckets(keys[key], sizes, max_records, max_characters)
+        for bucket, titles in enumerate(buckets):
+            if len(titles) < 2:
+                continue
+            title = '{}{}Records{}'.format(prefix, prefixes[key], bucket)
+            if title in resources:
+                raise ValueError("Record set group '{}' collides with a "
+                                 "resource title".format(title))
+            first = resources[titles[0]]['Properties']
+            properties = dict((p, first[p])
+                              for p in ZONE_PROPERTIES + ['Comment']
+                              if p in first)
+            properties['RecordSets'] = [
+                dict((k, v) for k, v in
+                     resources[t]['Properties'].iteritems()
+                     if k not in properties) for t in titles]
+            resources[title] = {'Type': RECORD_SET_GROUP_TYPE,
+                                'Properties': properties}
+            for t in titles:
+                del resources[t]
+                packed[t] = title
+            groups[title] = titles
+
+    if not packed:
+        return template, groups
+
+    names = dict((t, properties['Name']) for title, titles in
+                 groups.iteritems()
+                 for t, properties in zip(
+                     titles, resources[title]['Properties']['RecordSets']))
+
+    def _name(kind, target, attr):
+        if kind == 'Ref' and target in packed:
+            return names[target]
+
+    for title, resource in resources.items():
+        targets = []
+
+        def _rewire(kind, target, attr):
+            name = _name(kind, target, attr)
+            if name is not None:
+                targets.append(packed[target])
+            return name
+
+        resource = rewrite(resource, _rewire)
+        before = depends_on(resource)
+        after = []
+        for target in before + targets:
+            target = packed.get(target, target)
+            if target != title and target not in after:
+                after.append(target)
+        if after != before:
+            resource['DependsOn'] = after
+        resources[title] = resource
+
+    template['Resources'] = resources
+    if 'Outputs' in template:
+        template['Outputs'] = rewrite(template['Outputs'], _name)
+    return template, groups
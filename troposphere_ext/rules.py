@@ -0,0 +1,243 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import json
+
+SECURITY_GROUP_TYPE = 'AWS::EC2::SecurityGroup'
+RULE_PROPERTIES = ['SecurityGroupIngress', 'SecurityGroupEgress']
+
+PROTOCOLS = {'6': 'tcp', '17': 'udp', '1': 'icmp', 'all': '-1'}
+
+# protocols with port ranges that can be merged, other protocols use
+# FromPort and ToPort for something else, icmp type and code for example
+PORT_PROTOCOLS = frozenset(['tcp', 'udp'])
+ALL = '-1'
+
+_FULL = 0xffffffff
+
+
+def protocol(value):
+    """Returns the normalized name of a rule IpProtocol"""
+    value = str(value).lower()
+    return PROTOCOLS.get(value, value)
+
+
+def parse_cidr(value):
+    """Returns the (network, prefix length) of an IPv4 CIDR block string,
+       None when it is not one or has host bits set"""
+    if not isinstance(value, basestring) or value.count('/') != 1:
+        return None
+    address, length = value.split('/')
+    octets = address.split('.')
+    if len(octets) != 4 or not length.isdigit() or int(length) > 32 or \
+            not all(o.isdigit() and int(o) < 256 for o in octets):
+        return None
+    network = 0
+    for octet in octets:
+        network = network << 8 | int(octet)
+    length = int(length)
+    if network & ~_mask(length) & _FULL:
+        return None
+    return network, length
+
+
+def format_cidr(network, length):
+    return '{}.{}.{}.{}/{}'.format(network >> 24, network >> 16 & 255,
+                                   network >> 8 & 255, network & 255, length)
+
+
+def _mask(length):
+    return _FULL ^ (_FULL >> length)
+
+
+def aggregate(blocks):
+    """Returns the smallest list of (network, length) CIDR blocks that
+       covers exactly the same addresses as blocks"""
+    merged = []
+    for network, length in sorted(set(blocks)):
+        # sorted by network then length, so a block is either inside the
+        # last kept block or after it
+        if merged:
+            last, last_length = merged[-1]
+            if network & _mask(last_length) == last and \
+                    last_length <= length:
+                continue
+        merged.append((network, length))
+        # fold sibling blocks into their parent
+        while len(merged) > 1:
+            (a, a_length), (b, b_length) = merged[-2], merged[-1]
+            if a_length != b_length or a_length == 0:
+                break
+            size = 1 << (32 - a_length)
+            if a & size or a + size != b:
+                break
+            merged[-2:] = [(a, a_length - 1)]
+    return merged
+
+
+def union(ranges):
+    """Returns the sorted list of disjoint (from, to) port ranges that
+       covers exactly the same ports as ranges"""
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def _normalize(rule):
+    """Returns a (protocol, network, length, from, to) tuple for a plain
+       IPv4 CIDR rule, None for rules that are kept as they are"""
+    if not isinstance(rule, dict) or \
+            set(rule) - set(['IpProtocol', 'CidrIp', 'FromPort', 'ToPort']):
+        return None
+    try:
+        name = protocol(rule['IpProtocol'])
+        block = parse_cidr(rule['CidrIp'])
+        if name == ALL:
+            low, high = -1, -1
+        else:
+            low, high = int(rule['FromPort']), int(rule['ToPort'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if block is None:
+        return None
+    if name in PORT_PROTOCOLS and not 0 <= low <= high <= 65535:
+        return None
+    if name == 'icmp' and low == -1:
+        # any icmp type allows every code whatever the ToPort
+        high = -1
+    return (name,) + block + (low, high)
+
+
+def _covers(outer, inner):
+    """Returns True when the outer port range covers the inner one"""
+    name, low, high = inner
+    if name in PORT_PROTOCOLS:
+        return outer[0] <= low and high <= outer[1]
+    if name == 'icmp':
+        # icmp FromPort is the type and ToPort the code, -1 for any
+        return outer[0] == -1 or \
+            (outer[0] == low and outer[1] in (-1, high))
+    return outer == (low, high) or outer == (-1, -1)
+
+
+def _unshadowed(rules):
+    """Drops rules that allow a subset of what another single rule
+       allows. Rules are distinct so containment is a strict order and
+       every dropped rule is covered by one that is kept."""
+    index = dict()
+    # only the prefix lengths in use can hold a covering block
+    lengths = dict()
+    for name, network, length, low, high in rules:
+        index.setdefault((name, network, length), []).append((low, high))
+        lengths.setdefault(name, set()).add(length)
+    lengths = dict((name, sorted(lengths.get(ALL, set()) | used))
+                   for name, used in lengths.iteritems())
+
+    kept = []
+    for rule in rules:
+        name, network, length, low, high = rule
+        shadowed = False
+        for outer in lengths[name]:
+            if outer > length:
+                break
+            key = network & _mask(outer), outer
+            if (ALL,) + key in index and (name != ALL or outer < length):
+                shadowed = True
+                break
+            if name == ALL:
+                continue
+            if any(ports != (low, high) or outer < length
+                   for ports in index.get((name,) + key, ())
+                   if _covers(ports, (name, low, high))):
+                shadowed = True
+                break
+        if not shadowed:
+            kept.append(rule)
+    return kept
+
+
+def _merge_blocks(rules):
+    """Aggregates the CIDR blocks of rules with the same ports"""
+    groups = dict()
+    for name, network, length, low, high in rules:
+        groups.setdefault((name, low, high), []).append((network, length))
+    return [(name,) + block + (low, high)
+            for (name, low, high), blocks in groups.iteritems()
+            for block in aggregate(blocks)]
+
+
+def _merge_ports(rules):
+    """Merges the port ranges of tcp and udp rules with the same block"""
+    groups = dict()
+    merged = []
+    for rule in rules:
+        if rule[0] in PORT_PROTOCOLS:
+            groups.setdefault(rule[:3], []).append(rule[3:])
+        else:
+            merged.append(rule)
+    return merged + [key + ports for key, ports in groups.iteritems()
+                     for ports in union(ports)]
+
+
+def compact(rules):
+    """Returns an equivalent and usually shorter list of security group
+       rules. Plain IPv4 CIDR rules are normalized by protocol and port
+       range, rules shadowed by another rule are dropped, and CIDR blocks
+       and port ranges are merged until nothing changes. Rules with
+       other sources or with intrinsic functions are kept as they are,
+       less exact duplicates. The input is returned when nothing can be
+       saved."""
+    opaque = []
+    seen = set()
+    normalized = set()
+    for rule in rules:
+        value = _normalize(rule)
+        if value is not None:
+            normalized.add(value)
+            continue
+        key = json.dumps(rule, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            opaque.append(rule)
+
+    normalized = _unshadowed(list(normalized))
+    count = None
+    while count != len(normalized):
+        count = len(normalized)
+        normalized = _merge_ports(_merge_blocks(normalized))
+    normalized = _unshadowed(normalized)
+
+    if len(opaque) + len(normalized) >= len(rules):
+        return rules
+
+    compacted = []
+    for name, network, length, low, high in sorted(
+            normalized, key=lambda r: (r[0], r[3], r[4], r[1], r[2])):
+        compacted.append({'IpProtocol': name,
+                          'CidrIp': format_cidr(network, length),
+                          'FromPort': low, 'ToPort': high})
+    return compacted + opaque
+
+
+def compact_template(template):
+    """Compacts the rules of every security group in a rendered template
+       in place. Returns a dict of security group title to a dict of
+       rule property to its (before, after) rule counts."""
+    counts = dict()
+    for title, resource in template.get('Resources', {}).iteritems():
+        if resource.get('Type') != SECURITY_GROUP_TYPE:
+            continue
+        properties = resource.get('Properties', {})
+        for name in RULE_PROPERTIES:
+            if isinstance(properties.get(name), list):
+                before = len(properties[name])
+                properties[name] = compact(properties[name])
+                counts.setdefault(title, dict())[name] = \
+                    (before, len(properties[name]))
+    return counts
@@ -0,0 +1,261 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import json
+import collections
+
+from troposphere_ext.graph import DependencyGraph, depends_on, rewrite
+from troposphere_ext import validator
+
+# nested stack templates are uploaded to S3 so the larger body limit applies
+CHILD_LIMITS = validator.URL_LIMITS
+
+# Fn::GetAtt attributes that return a list. outputs and nested stack
+# parameters only carry strings, so these cross shards joined and come
+# back as a CommaDelimitedList.
+LIST_ATTRIBUTES = frozenset([
+    ('AWS::EC2::NetworkInterface', 'SecondaryPrivateIpAddresses'),
+    ('AWS::Route53::HostedZone', 'NameServers'),
+])
+
+
+def partition(template, max_resources=CHILD_LIMITS['Resources'],
+              max_bytes=CHILD_LIMITS['body']):
+    """Splits the resources of a rendered template into shards of at most
+       max_resources resources and max_bytes bytes. Returns a list of
+       lists of resource titles.
+
+       Resources that are not connected by any reference are packed
+       whole into balanced shards so they never add a cross shard
+       reference. Connected groups that do not fit in one shard are cut
+       into consecutive runs of a depth first topological order, which
+       keeps dependency chains together and guarantees that a shard only
+       depends on earlier shards."""
+    graph = DependencyGraph(template)
+    cycles = graph.cycles()
+    if cycles:
+        raise ValueError("Unable to shard a template with circular "
+                         "dependencies: {}".format(
+                             '; '.join(', '.join(c) for c in cycles)))
+
+    sizes = dict((title, len(json.dumps(resource, indent=2)))
+                 for title, resource in template['Resources'].iteritems())
+
+    packed = []
+    split = []
+    for component in _components(graph):
+        size = sum(sizes[title] for title in component)
+        if len(component) <= max_resources and size <= max_bytes:
+            packed.append((component, size))
+        else:
+            split.extend(_chunk(_topological(graph, component), sizes,
+                                max_resources, max_bytes))
+
+    # largest first into the least loaded shard it fits in
+    count = _ceil(sum(len(c) for c, _ in packed), max_resources)
+    count = max(count, _ceil(sum(s for _, s in packed), max_bytes))
+    shards = [([], [0]) for _ in range(count)]
+    for component, size in sorted(packed, key=lambda p: -len(p[0])):
+        fits = [s for s in shards
+                if len(s[0]) + len(component) <= max_resources and
+                s[1][0] + size <= max_bytes]
+        if not fits:
+            fits = [([], [0])]
+            shards.append(fits[0])
+        titles, used = min(fits, key=lambda s: len(s[0]))
+        titles.extend(component)
+        used[0] += size
+
+    return [sorted(titles) for titles, _ in shards if titles] + split
+
+
+def shard(template, name, template_url,
+          max_resources=CHILD_LIMITS['Resources'],
+          max_bytes=CHILD_LIMITS['body']):
+    """Splits a rendered template into nested stacks. References between
+       shards are rewired through child stack outputs and parameters.
+       template_url is formatted with the title of each child stack.
+       Returns the parent template and an OrderedDict of child stack
+       title to child template."""
+    shards = partition(template, max_resources, max_bytes)
+    titles = ['{}Shard{}'.format(name, i) for i in range(len(shards))]
+    owner = dict((title, i) for i, resources in enumerate(shards)
+                 for title in resources)
+
+    resources = template.get('Resources', {})
+    parameters = template.get('Parameters', {})
+    children = [_template(template, Parameters={}, Resources={}, Outputs={},
+                          Conditions=template.get('Conditions', {}),
+                          Mappings=template.get('Mappings', {}))
+                for _ in shards]
+    stack_parameters = [dict() for _ in shards]
+    stack_depends_on = [set() for _ in shards]
+
+    def _listed(target, attr):
+        return (resources[target].get('Type'), attr) in LIST_ATTRIBUTES
+
+    def _export(i, target, attr):
+        """Adds an output for a reference to shard i and returns its name"""
+        if attr is None:
+            export, value = target, {'Ref': target}
+        else:
+            export = '{}{}'.format(target, attr.replace('.', ''))
+            value = {'Fn::GetAtt': [target, attr]}
+            if _listed(target, attr):
+                value = {'Fn::Join': [',', value]}
+        children[i]['Outputs'][export] = {'Value': value}
+        return export
+
+    def _child(i):
+        def _rewire(kind, target, attr):
+            if target in parameters:
+                children[i]['Parameters'][target] = parameters[target]
+                stack_parameters[i][target] = _pass(parameters, target)
+            elif target in owner and owner[target] != i:
+                j = owner[target]
+                export = _export(j, target, attr)
+                if export in shards[i]:
+                    raise ValueError("Cross shard reference '{}' collides "
+                                     "with a resource title".format(export))
+                children[i]['Parameters'][export] = {
+                    'Type': 'CommaDelimitedList'
+                    if _listed(target, attr) else 'String'}
+                stack_parameters[i][export] = {
+                    'Fn::GetAtt': [titles[j], 'Outputs.{}'.format(export)]}
+                return {'Ref': export}
+        return _rewire
+
+    def _parent(kind, target, attr):
+        if target in owner:
+            j = owner[target]
+            value = {'Fn::GetAtt': [titles[j], 'Outputs.{}'.format(
+                _export(j, target, attr))]}
+            if attr is not None and _listed(target, attr):
+                return {'Fn::Split': [',', value]}
+            return value
+
+    for i, child in enumerate(children):
+        rewire = _child(i)
+        child['Conditions'] = rewrite(child['Conditions'], rewire)
+        for title in shards[i]:
+            resource = rewrite(resources[title], rewire)
+            targets = depends_on(resource)
+            local = [t for t in targets if owner.get(t, i) == i]
+            stack_depends_on[i].update(owner[t] for t in targets
+                                       if owner.get(t, i) != i)
+            if len(local) != len(targets):
+                if local:
+                    resource['DependsOn'] = local
+                else:
+                    del resource['DependsOn']
+            child['Resources'][title] = resource
+
+    parent = _template(template, Parameters=parameters,
+                       Conditions=template.get('Conditions', {}),
+                       Mappings=template.get('Mappings', {}),
+                       Outputs=rewrite(template.get('Outputs', {}), _parent),
+                       Resources=dict())
+    for i, title in enumerate(titles):
+        stack = {'Type': 'AWS::CloudFormation::Stack',
+                 'Properties': {'TemplateURL': template_url.format(
+                                title=title)}}
+        if stack_parameters[i]:
+            stack['Properties']['Parameters'] = stack_parameters[i]
+        if stack_depends_on[i]:
+            stack['DependsOn'] = sorted(titles[j]
+                                        for j in stack_depends_on[i])
+        parent['Resources'][title] = stack
+
+    errors = ['{}: {}'.format(title, error)
+              for title, child in zip(titles, children)
+              for error in validator.validate(child, limits=CHILD_LIMITS)]
+    if errors:
+        raise ValueError("Sharded template '{}' is invalid:\n  {}"
+                         .format(name, '\n  '.join(errors)))
+
+    return parent, collections.OrderedDict(zip(titles, children))
+
+
+def _template(template, **sections):
+    t = dict((k, template[k]) for k in ['AWSTemplateFormatVersion',
+                                        'Description'] if k in template)
+    t.update(sections)
+    return t
+
+
+def _pass(parameters, title):
+    """Returns the value a parent passes down for one of its parameters,
+       nested stack parameters only take strings"""
+    parameter_type = parameters[title].get('Type', '')
+    if parameter_type.startswith('List<') or \
+            parameter_type == 'CommaDelimitedList':
+        return {'Fn::Join': [',', {'Ref': title}]}
+    return {'Ref': title}
+
+
+def _ceil(value, divisor):
+    return (value + divisor - 1) // divisor
+
+
+def _components(graph):
+    """Returns the groups of resources connected by references, largest
+       first"""
+    parent = dict((title, title) for title in graph.nodes)
+
+    def _find(title):
+        while parent[title] != title:
+            parent[title] = parent[parent[title]]
+            title = parent[title]
+        return title
+
+    for title, edges in graph.edges().iteritems():
+        for target in edges:
+            parent[_find(title)] = _find(target)
+
+    components = collections.defaultdict(list)
+    for title in graph.nodes:
+        components[_find(title)].append(title)
+    return sorted(components.values(), key=lambda c: (-len(c), c[0]))
+
+
+def _topological(graph, titles):
+    """Returns titles in depth first post order, dependencies first"""
+    order = []
+    seen = set()
+    for root in sorted(titles):
+        if root in seen:
+            continue
+        seen.add(root)
+        work = [(root, iter(sorted(graph.edges(root))))]
+        while work:
+            node, targets = work[-1]
+            target = next(targets, None)
+            if target is None:
+                work.pop()
+                order.append(node)
+            elif target not in seen:
+                seen.add(target)
+                work.append((target, iter(sorted(graph.edges(target)))))
+    return order
+
+
+def _chunk(order, sizes, max_resources, max_bytes):
+    """Cuts a topological order into balanced consecutive runs"""
+    total = sum(sizes[title] for title in order)
+    count = max(_ceil(len(order), max_resources), _ceil(total, max_bytes))
+    target = _ceil(len(order), count)
+
+    chunks = [[]]
+    size = 0
+    for title in order:
+        chunk = chunks[-1]
+        if chunk and (len(chunk) >= target or
+                      size + sizes[title] > max_bytes):
+            chunk = []
+            chunks.append(chunk)
+            size = 0
+        chunk.append(title)
+        size += sizes[title]
+    return chunks
@@ -0,0 +1,142 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import os
+import json
+import Queue
+import datetime
+import threading
+import collections
+
+from troposphere_ext.timeline import timestamp
+from troposphere_ext.storage import write_atomic
+from troposphere_ext.api import pages, namespace_stacks
+
+VERSION = 1
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.tropext',
+                                 'snapshots')
+
+# stacks in these states have no resources to reference
+GONE = frozenset(['DELETE_COMPLETE'])
+
+StackResource = collections.namedtuple('StackResource', [
+    'logical_resource_id', 'physical_resource_id', 'resource_type'])
+
+
+def default_path(namespace, region):
+    return os.path.join(DEFAULT_DIRECTORY,
+                        '{}-{}.json'.format(namespace, region))
+
+
+def last_updated(stack):
+    """Returns when a described stack last changed, boto leaves the
+       LastUpdatedTime of stacks as the raw string"""
+    updated = getattr(stack, 'LastUpdatedTime', None)
+    return timestamp(updated) if updated else stack.creation_time
+
+
+class Snapshot(object):
+    """Physical resource ids of every stack in a namespace and region,
+       saved locally so SRef can resolve them without the API"""
+
+    def __init__(self, namespace, region, stacks=None, created=None):
+        self.namespace = namespace
+        self.region = region
+        # stack name to {'updated': iso time, 'resources': [...]}
+        self.stacks = dict() if stacks is None else stacks
+        self.created = created or datetime.datetime.utcnow().strftime(
+            '%Y-%m-%dT%H:%M:%S')
+
+    @classmethod
+    def capture(cls, conn, namespace, region, parallel=8):
+        """Describes the namespace's stacks and lists their resources
+           with up to parallel concurrent paginated calls"""
+        snapshot = cls(namespace, region)
+        stacks = [s for s in namespace_stacks(
+            pages(conn.describe_stacks, None), namespace)
+            if s.stack_status not in GONE]
+
+        pending = Queue.Queue()
+        for stack in stacks:
+            pending.put(stack)
+        errors = []
+
+        def _worker():
+            while 1:
+                try:
+                    stack = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    resources = pages(conn.list_stack_resources,
+                                      stack.stack_name)
+                except Exception as e:
+                    errors.append('{}: {}'.format(stack.stack_name, e))
+                    continue
+                snapshot.stacks[stack.stack_name] = {
+                    'updated': last_updated(stack).strftime(
+                        '%Y-%m-%dT%H:%M:%S'),
+                    'resources': sorted([
+                        [r.logical_resource_id, r.physical_resource_id,
+                         r.resource_type] for r in resources])}
+
+        workers = [threading.Thread(target=_worker)
+                   for _ in range(min(parallel, len(stacks)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if errors:
+            raise LookupError('Unable to snapshot stacks:\n  {}'
+                              .format('\n  '.join(sorted(errors))))
+        return snapshot
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != VERSION:
+            raise ValueError("Snapshot '{}' has version {}, expected {}"
+                             .format(path, data.get('version'), VERSION))
+        return cls(str(data['namespace']), str(data['region']),
+                   data['stacks'], data['created'])
+
+    def save(self, path):
+        """Writes the snapshot atomically so a reader never sees a
+           partial file"""
+        write_atomic(path, json.dumps(self.to_dict(), indent=2,
+                                      sort_keys=True))
+        return path
+
+    def to_dict(self):
+        return {'version': VERSION, 'namespace': self.namespace,
+                'region': self.region, 'created': self.created,
+                'stacks': self.stacks}
+
+    def resources(self, stack_name):
+        """Returns the StackResources of a stack in the snapshot"""
+        if stack_name not in self.stacks:
+            raise LookupError("Stack '{}' is not in the {} {} snapshot "
+                              "taken {}".format(stack_name, self.namespace,
+                                                self.region, self.created))
+        return [StackResource(*r)
+                for r in self.stacks[stack_name]['resources']]
+
+    def stale(self, conn):
+        """Returns the stacks that were created, updated or deleted since
+           the snapshot was taken. Only describes the stacks, resources
+           are not listed again."""
+        current = dict((s.stack_name, last_updated(s))
+                       for s in namespace_stacks(
+                           pages(conn.describe_stacks, None),
+                           self.namespace)
+                       if s.stack_status not in GONE)
+        return sorted(name for name in set(current) | set(self.stacks)
+                      if name not in current or name not in self.stacks or
+                      current[name].replace(microsecond=0) > timestamp(
+                          self.stacks[name]['updated']))
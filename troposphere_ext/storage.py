@@ -0,0 +1,197 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import os
+import json
+import fcntl
+import hashlib
+import contextlib
+import tempfile
+import threading
+import boto.s3
+
+
+def write_atomic(path, body):
+    """Writes a file through a temporary file and a rename so readers
+       never see a partial file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        f.write(body)
+    os.rename(tmp, path)
+
+
+def sha256(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+class Storage(object):
+    """Stores rendered templates under a key derived from their content
+       so an identical template is only ever stored once"""
+
+    def __init__(self, prefix='templates'):
+        self._prefix = prefix
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def key(self, body):
+        return '{}/{}.json'.format(self._prefix, sha256(body))
+
+    def put(self, body):
+        """Stores a template body unless it is already stored and returns
+           its URL"""
+        key = self.key(body)
+        with self._lock:
+            known = key in self._known
+        # the lock is not held across the upload so puts of different
+        # templates run in parallel. two threads may both upload the
+        # same body, that is harmless since the key is its content hash
+        if not known:
+            if not self._exists(key):
+                self._write(key, body)
+            with self._lock:
+                self._known.add(key)
+        return self.url(key)
+
+    def url(self, key):
+        raise NotImplementedError()
+
+    def _exists(self, key):
+        raise NotImplementedError()
+
+    def _write(self, key, body):
+        raise NotImplementedError()
+
+
+class S3Storage(Storage):
+    """Stores templates in an S3 bucket for use as a TemplateURL"""
+
+    def __init__(self, bucket, prefix='templates', region='us-west-2'):
+        super(S3Storage, self).__init__(prefix)
+        self._region = region
+        self._bucket = boto.s3.connect_to_region(region) \
+            .get_bucket(bucket, validate=False)
+
+    def url(self, key):
+        host = 's3.amazonaws.com' if self._region == 'us-east-1' \
+            else 's3-{}.amazonaws.com'.format(self._region)
+        return 'https://{}/{}/{}'.format(host, self._bucket.name, key)
+
+    def _exists(self, key):
+        return self._bucket.get_key(key) is not None
+
+    def _write(self, key, body):
+        self._bucket.new_key(key).set_contents_from_string(
+            body, headers={'Content-Type': 'application/json'})
+
+
+class LocalStorage(Storage):
+    """Stores templates in a local directory, a stand in for S3Storage
+       in tests and dry runs"""
+
+    def __init__(self, directory, prefix='templates'):
+        super(LocalStorage, self).__init__(prefix)
+        self._directory = directory
+
+    def path(self, key):
+        return os.path.join(self._directory, *key.split('/'))
+
+    def url(self, key):
+        return 'file://{}'.format(os.path.abspath(self.path(key)))
+
+    def _exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def _write(self, key, body):
+        write_atomic(self.path(key), body)
+
+
+class ArtifactStore(object):
+    """Directory of generated templates named after their region,
+       namespace and stack. Templates whose content did not change are
+       not written again, so file times only move on real changes. A
+       manifest records the hash of every template. Several processes
+       can write to the same directory, the manifest is updated under a
+       file lock."""
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._manifest = self._load()
+
+    def _load(self):
+        path = os.path.join(self._directory, self.MANIFEST)
+        if not os.path.exists(path):
+            return dict()
+        with open(path) as f:
+            return json.load(f)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Holds the manifest lock of this thread and of the directory"""
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+        with self._lock:
+            with open(os.path.join(self._directory,
+                                   self.MANIFEST + '.lock'), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def key(self, namespace, stack_name, region):
+        return '{}/{}-{}.json'.format(region, namespace, stack_name)
+
+    def path(self, namespace, stack_name, region):
+        return os.path.join(self._directory, *self.key(
+            namespace, stack_name, region).split('/'))
+
+    def write(self, namespace, stack_name, region, body):
+        """Stores a template, returns its path and whether it changed"""
+        key = self.key(namespace, stack_name, region)
+        path = self.path(namespace, stack_name, region)
+        digest = sha256(body)
+        with self._locked():
+            # other processes may have added entries since it was read
+            self._manifest = self._load()
+            entry = self._manifest.get(key, {})
+            if os.path.exists(path) and (entry.get('sha256') == digest or
+                                         _file_sha256(path) == digest):
+                changed = False
+            else:
+                write_atomic(path, body)
+                changed = True
+            if entry != {'sha256': digest, 'bytes': len(body)}:
+                self._manifest[key] = {'sha256': digest, 'bytes': len(body)}
+                write_atomic(os.path.join(self._directory, self.MANIFEST),
+                             json.dumps(self._manifest, indent=2,
+                                        sort_keys=True))
+        return path, changed
+
+    def read(self, namespace, stack_name, region):
+        """Returns a stored template, checked against the manifest"""
+        key = self.key(namespace, stack_name, region)
+        path = self.path(namespace, stack_name, region)
+        if key not in self._manifest:
+            self._manifest = self._load()
+        if key not in self._manifest or not os.path.exists(path):
+            raise LookupError("No generated template '{}' in '{}'"
+                              .format(key, self._directory))
+        with open(path) as f:
+            body = f.read()
+        if sha256(body) != self._manifest[key]['sha256']:
+            raise ValueError("Generated template '{}' does not match the "
+                             "manifest".format(path))
+        return body
+
+
+def _file_sha256(path):
+    with open(path) as f:
+        return sha256(f.read())
@@ -0,0 +1,236 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import re
+import json
+import time
+
+from troposphere_ext import api
+from troposphere_ext.timeline import STACK_TYPE, root_causes
+
+GONE = frozenset(['DELETE_COMPLETE'])
+
+_TOKENS = re.compile(r'[\s"\',]+')
+
+
+def strings(body):
+    """Returns every string of a template body along with the words in
+       them, physical ids inlined by SRef can be part of user data"""
+    found = set()
+    stack = [json.loads(body)]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.itervalues())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, basestring):
+            found.add(value)
+            found.update(_TOKENS.split(value))
+    return found
+
+
+def dependencies(names, bodies, physical_ids):
+    """Returns a dict of every stack to the stacks it references. A stack
+       references another when its template holds the other's name, as
+       templates built with a parent_stack do, or one of the other's
+       physical resource ids, which is what SRef resolves to."""
+    found = dict((name, strings(bodies[name])) for name in names)
+    return dict((name, set(other for other in names if other != name and
+                           (other in found[name] or
+                            not found[name].isdisjoint(
+                                physical_ids[other]))))
+                for name in names)
+
+
+def excluding(references, names):
+    """Returns the references without the stacks in names and every
+       stack they reference, directly or through others, which are not
+       deleted while those stay"""
+    left = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in left:
+            left.add(name)
+            pending.extend(references.get(name, ()))
+    return dict((name, targets - left)
+                for name, targets in references.iteritems()
+                if name not in left)
+
+
+def waves(references):
+    """Groups stacks into waves that can be deleted together. A stack is
+       only deleted after every stack that references it. Raises a
+       ValueError on circular references."""
+    remaining = dict((name, set(targets))
+                     for name, targets in references.iteritems())
+    result = []
+    while remaining:
+        referenced = set(t for targets in remaining.itervalues()
+                         for t in targets)
+        wave = sorted(name for name in remaining if name not in referenced)
+        if not wave:
+            raise ValueError('Circular references between stacks {}'
+                             .format(', '.join(sorted(remaining))))
+        for name in wave:
+            del remaining[name]
+        result.append(wave)
+    return result
+
+
+class Teardown(object):
+    """Deletes stacks of a namespace in reference order. Stacks are
+       started as soon as every stack referencing them is gone, up to
+       parallel at a time, and a single watcher tails all of them. When
+       a delete fails the stacks it references are left alone."""
+
+    def __init__(self, log, namespace, region, conn, parallel=4, interval=5,
+                 history=None, clock=time.time, sleep=time.sleep):
+        self._log = log
+        self._namespace = namespace
+        self._region = region
+        self._conn = conn
+        self._parallel = max(1, parallel)
+        self._interval = interval
+        self._history = history
+        self._clock = clock
+        self._sleep = sleep
+        # stack name to {'status', 'reason', 'seconds'}
+        self.results = dict()
+
+    def stacks(self, untagged=False):
+        """Returns the names of the namespace's live stacks, see
+           api.namespace_stacks"""
+        return sorted(s.stack_name for s in api.namespace_stacks(
+            api.pages(self._conn.describe_stacks, None), self._namespace,
+            untagged)
+            if s.stack_status not in GONE)
+
+    def plan(self, names=None):
+        """Returns the dict of stack references for the stacks"""
+        names = self.stacks() if names is None else names
+        bodies = dict()
+        physical_ids = dict()
+        for name in names:
+            bodies[name] = self._conn.get_template(name) \
+                .get('GetTemplateResponse') \
+                .get('GetTemplateResult') \
+                .get('TemplateBody')
+            physical_ids[name] = set(
+                r.physical_resource_id for r in api.pages(
+                    self._conn.list_stack_resources, name)
+                if r.physical_resource_id)
+        return dependencies(names, bodies, physical_ids)
+
+    def run(self, references):
+        """Deletes the stacks of a references dict, see plan. Returns a
+           Generator of (stack, kind, value) tuples, kind is 'event' for
+           stack events and 'result' once a stack is deleted, failed or
+           skipped."""
+        remaining = dict((name, set(targets))
+                         for name, targets in references.iteritems())
+        failed = set()
+        active = dict()
+
+        def _result(name, status, seconds=0, reason=None):
+            self.results[name] = {'status': status, 'seconds': seconds,
+                                  'reason': reason}
+            return name, 'result', self.results[name]
+
+        while 1:
+            # failed stacks stay in remaining so what they reference
+            # is never ready
+            referenced = set(t for targets in remaining.itervalues()
+                             for t in targets)
+            ready = sorted(name for name in remaining
+                           if name not in referenced and
+                           name not in active and name not in failed)
+            for name in ready[:self._parallel - len(active)]:
+                try:
+                    active[name] = self._start(name)
+                except Exception as e:
+                    self._log.exception("Unable to delete stack '{}'"
+                                        .format(name))
+                    failed.add(name)
+                    yield _result(name, 'DELETE_FAILED', reason=str(e))
+            if not active:
+                break
+
+            self._sleep(self._interval)
+            for name in sorted(active):
+                watched = active[name]
+                for e in self._new_events(watched):
+                    yield name, 'event', e
+                status = self._status(name, watched['events'])
+                if status is None:
+                    continue
+
+                del active[name]
+                reason = None
+                if status == 'DELETE_COMPLETE':
+                    del remaining[name]
+                else:
+                    failed.add(name)
+                    causes = root_causes(watched['events'])
+                    reason = causes[0].resource_status_reason \
+                        if causes else None
+                self._record(name, watched['events'])
+                yield _result(name, status,
+                              self._clock() - watched['start'], reason)
+
+        for name in sorted(set(remaining) - failed):
+            yield _result(name, 'SKIPPED', reason='referenced by a stack '
+                                                  'that was not deleted')
+
+    def _start(self, name):
+        stack = api.pages(self._conn.describe_stacks, name)[0]
+        # newest first, events up to now belong to earlier operations
+        seen = set(e.event_id for e in self._conn.describe_stack_events(
+            stack.stack_id, None))
+        self._log.info("Deleting stack '{}'".format(name))
+        self._conn.delete_stack(name)
+        return {'id': stack.stack_id, 'start': self._clock(), 'seen': seen,
+                'events': []}
+
+    def _new_events(self, watched):
+        """Returns the stack's events since the last call, oldest first,
+           only paging as far back as the first event already seen"""
+        events = []
+        next_token = None
+        while 1:
+            page = self._conn.describe_stack_events(watched['id'],
+                                                    next_token)
+            fresh = [e for e in page if e.event_id not in watched['seen']]
+            events.extend(fresh)
+            next_token = getattr(page, 'next_token', None)
+            if next_token is None or len(fresh) < len(page):
+                break
+        events.reverse()
+        watched['seen'].update(e.event_id for e in events)
+        watched['events'].extend(events)
+        return events
+
+    def _status(self, name, events):
+        """Returns the final status of the stack delete, None while it
+           is in progress"""
+        for e in reversed(events):
+            if e.resource_type == STACK_TYPE and \
+                    e.logical_resource_id == name and \
+                    e.resource_status in ('DELETE_COMPLETE',
+                                          'DELETE_FAILED'):
+                return e.resource_status
+        return None
+
+    def _record(self, name, events):
+        if self._history is None:
+            return
+        try:
+            self._history.record(self._namespace,
+                                 name[len(self._namespace) + 1:],
+                                 self._region, events)
+        except Exception:
+            self._log.exception("Unable to record events of stack '{}'"
+                                .format(name))
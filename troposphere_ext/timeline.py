@@ -0,0 +1,292 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import json
+import datetime
+
+STACK_TYPE = 'AWS::CloudFormation::Stack'
+
+# stack statuses that start a new stack operation
+OPERATIONS = frozenset(['CREATE_IN_PROGRESS', 'UPDATE_IN_PROGRESS',
+                        'DELETE_IN_PROGRESS'])
+
+# reasons Cloud Formation gives resources it stopped because another
+# resource failed
+CANCELLED = frozenset(['Resource creation cancelled',
+                       'Resource update cancelled'])
+
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f',
+                '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%SZ',
+                '%Y-%m-%dT%H:%M:%S.%fZ']
+
+
+def timestamp(value):
+    """Returns an event timestamp as a datetime, events relayed by the
+       trop daemon carry them as strings"""
+    if isinstance(value, datetime.datetime):
+        return value
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValueError("Unknown event timestamp '{}'".format(value))
+
+
+def stack_name(events):
+    """Returns the logical id the events of a stack carry for the stack
+       itself, the first stack event of a chronological list is always
+       its own"""
+    for e in events:
+        if e.resource_type == STACK_TYPE:
+            return e.logical_resource_id
+    return None
+
+
+def own(event, name):
+    """Returns True for an event of the stack name itself rather than of
+       one of its resources or nested stacks"""
+    return event.resource_type == STACK_TYPE and \
+        event.logical_resource_id == name
+
+
+def operations(events, name=None):
+    """Splits a chronological list of events of the stack name into one
+       list per stack operation"""
+    if name is None:
+        name = stack_name(events)
+    groups = []
+    for e in events:
+        if not groups or (own(e, name) and e.resource_status in OPERATIONS):
+            groups.append([])
+        groups[-1].append(e)
+    return groups
+
+
+def last_operation(events, name=None):
+    """Returns the events of the last stack operation from a
+       chronological list of events of the stack name"""
+    groups = operations(events, name)
+    return groups[-1] if groups else []
+
+
+def failed(event):
+    """Returns True for a failed resource event"""
+    return event.resource_type != STACK_TYPE and \
+        event.resource_status.endswith('_FAILED')
+
+
+def terminal(status):
+    """Returns True for a stack status that no operation is still moving
+       on from, UPDATE_COMPLETE_CLEANUP_IN_PROGRESS is not one of them"""
+    return status is not None and (status.endswith('_COMPLETE') or
+                                   status.endswith('_FAILED'))
+
+
+def finished(event, name):
+    """Returns True for the event that ends an operation of the stack
+       name, events of nested stacks do not end it"""
+    return own(event, name) and terminal(event.resource_status)
+
+
+def root_causes(events):
+    """Returns the failed resource events that are not just the result of
+       another failure cancelling the operation"""
+    return [e for e in events if failed(e) and
+            (e.resource_status_reason or '') not in CANCELLED]
+
+
+class Span(object):
+    """Time a resource spent in one operation"""
+
+    __slots__ = ['title', 'resource_type', 'start', 'end', 'status',
+                 'reason']
+
+    def __init__(self, title, resource_type, start):
+        self.title = title
+        self.resource_type = resource_type
+        self.start = start
+        self.end = None
+        self.status = None
+        self.reason = None
+
+    def duration(self, now=None):
+        end = self.end if self.end is not None else now
+        return 0.0 if end is None else (end - self.start).total_seconds()
+
+
+class Timeline(object):
+    """Pairs the IN_PROGRESS and COMPLETE or FAILED events of every
+       resource in a stack operation, nested stacks included. Events can
+       be added as they are watched or all at once after the operation
+       finished. Without a name the stack is the first one seen."""
+
+    def __init__(self, events=(), name=None):
+        self._name = name
+        self._spans = []
+        self._open = dict()
+        self._start = None
+        self._end = None
+        for e in events:
+            self.add(e)
+
+    def add(self, event):
+        when = timestamp(event.timestamp)
+        status = event.resource_status
+        self._start = when if self._start is None else min(self._start, when)
+        self._end = when if self._end is None else max(self._end, when)
+
+        if self._name is None and event.resource_type == STACK_TYPE:
+            self._name = event.logical_resource_id
+        if own(event, self._name):
+            return
+
+        title = event.logical_resource_id
+        span = self._open.get(title)
+        if status.endswith('_IN_PROGRESS'):
+            if span is None:
+                span = Span(title, event.resource_type, when)
+                self._open[title] = span
+                self._spans.append(span)
+        elif span is not None:
+            span.end = when
+            span.status = status
+            span.reason = event.resource_status_reason
+            del self._open[title]
+
+    @property
+    def spans(self):
+        return sorted(self._spans, key=lambda s: (s.start, s.title))
+
+    def duration(self):
+        if self._start is None:
+            return 0.0
+        return (self._end - self._start).total_seconds()
+
+    def slowest(self, count=10):
+        return sorted(self._spans,
+                      key=lambda s: (-s.duration(self._end), s.title))[:count]
+
+    def concurrency(self):
+        """Returns the average and the largest number of resources in
+           progress at the same time"""
+        changes = sorted([(s.start, 1) for s in self._spans] +
+                         [(s.end or self._end, -1) for s in self._spans],
+                         key=lambda c: (c[0], c[1]))
+        current = peak = 0
+        for _, change in changes:
+            current += change
+            peak = max(peak, current)
+        busy = sum(s.duration(self._end) for s in self._spans)
+        return busy / self.duration() if self.duration() else 0.0, peak
+
+    def gaps(self, minimum=1.0):
+        """Returns the (start, end) intervals longer than minimum seconds
+           during which no resource was in progress"""
+        gaps = []
+        cursor = self._start
+        for span in self.spans:
+            if cursor is not None and \
+                    (span.start - cursor).total_seconds() >= minimum:
+                gaps.append((cursor, span.start))
+            end = span.end or self._end
+            cursor = end if cursor is None else max(cursor, end)
+        if cursor is not None and \
+                (self._end - cursor).total_seconds() >= minimum:
+            gaps.append((cursor, self._end))
+        return gaps
+
+    def critical_path(self, graph=None):
+        """Returns the chain of spans that determined when the operation
+           finished. Walks back from the last resource to finish, to the
+           dependency that finished last before it started. Without a
+           DependencyGraph any resource that finished before it started
+           counts as a dependency."""
+        spans = dict((s.title, s) for s in self._spans)
+        if not spans:
+            return []
+
+        def _end(span):
+            return span.end or self._end
+
+        span = max(self.spans, key=_end)
+        path = [span]
+        while 1:
+            if graph is not None and span.title in graph.edges():
+                candidates = [spans[t] for t in graph.edges(span.title)
+                              if t in spans]
+            else:
+                candidates = self._spans
+            candidates = [c for c in candidates
+                          if c not in path and _end(c) <= span.start]
+            if not candidates:
+                break
+            span = max(candidates, key=_end)
+            path.append(span)
+        return path[::-1]
+
+    def to_dict(self, graph=None):
+        def _offset(when):
+            return None if when is None \
+                else (when - self._start).total_seconds()
+
+        parallelism, peak = self.concurrency()
+        return {
+            'start': None if self._start is None else self._start.isoformat(),
+            'duration': self.duration(),
+            'parallelism': round(parallelism, 2),
+            'max_concurrency': peak,
+            'resources': [{'title': s.title, 'type': s.resource_type,
+                           'status': s.status, 'reason': s.reason,
+                           'start': _offset(s.start), 'end': _offset(s.end),
+                           'duration': s.duration(self._end)}
+                          for s in self.spans],
+            'slowest': [s.title for s in self.slowest()],
+            'gaps': [{'start': _offset(start), 'end': _offset(end)}
+                     for start, end in self.gaps()],
+            'critical_path': [s.title for s in self.critical_path(graph)]
+        }
+
+    def to_json(self, graph=None):
+        return json.dumps(self.to_dict(graph), indent=2, sort_keys=True)
+
+    def gantt(self, width=60, graph=None):
+        """Returns a text Gantt chart of the operation. Critical path
+           resources are marked with a *, resources still in progress
+           end in >."""
+        spans = self.spans
+        if not spans:
+            return 'No resource events.'
+
+        total = max(self.duration(), 1.0)
+        critical = set(s.title for s in self.critical_path(graph))
+        name = max(len(s.title) for s in spans)
+        lines = []
+        for span in spans:
+            start = min(width - 1, int((span.start - self._start)
+                                       .total_seconds() * width / total))
+            end = int(((span.end or self._end) - self._start)
+                      .total_seconds() * width / total)
+            bar = '#' * max(1, end - start)
+            if span.end is None:
+                bar = bar[:-1] + '>'
+            lines.append('{} {} |{}| {:>6.0f}s {}'.format(
+                '*' if span.title in critical else ' ',
+                span.title.ljust(name),
+                (' ' * start + bar).ljust(width)[:width],
+                span.duration(self._end), span.status or 'IN_PROGRESS'))
+
+        parallelism, peak = self.concurrency()
+        lines.append('')
+        lines.append('Total {:.0f}s, average parallelism {:.1f}, peak {}'
+                     .format(self.duration(), parallelism, peak))
+        for start, end in self.gaps():
+            lines.append('Idle {:.0f}s from +{:.0f}s'.format(
+                (end - start).total_seconds(),
+                (start - self._start).total_seconds()))
+        lines.append('Slowest: {}'.format(', '.join(
+            '{} {:.0f}s'.format(s.title, s.duration(self._end))
+            for s in self.slowest(5))))
+        return '\n'.join(lines)
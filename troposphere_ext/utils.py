@@ -5,8 +5,12 @@
 
 import re
 import os
+import sys
+import types
 import importlib
+import collections
 import logging
+import threading
 import difflib
 import boto.cloudformation
 import time
@@ -14,23 +18,255 @@ import json
 
 from boto.exception import BotoServerError
 
+from troposphere_ext import validator
+from troposphere_ext import api
+from troposphere_ext import timeline
+from troposphere_ext import cfyaml
+
+# the ValidationError message of an update that changes nothing
+NO_UPDATES = 'No updates are to be performed.'
+
+_connections = dict()
+_connections_lock = threading.Lock()
+
+
+def connect(region):
+    """Returns a Cloud Formation connection for the region. Connections
+       are cached so long running processes reuse them and every call
+       goes through the region's shared rate limiter."""
+    with _connections_lock:
+        if region not in _connections:
+            _connections[region] = api.Api(
+                boto.cloudformation.connect_to_region(region),
+                api.TokenBucket())
+        return _connections[region]
+
+
+class ModuleReloader(object):
+    """Imports template modules by name and reloads them, along with
+       their local imports, only when a source file has changed"""
+
+    # never reload ourselves, class identity has to survive a reload
+    ignored = ('troposphere_ext',)
+
+    def __init__(self):
+        self._mtimes = dict()
+        self._graphs = dict()
+        self._lock = threading.RLock()
+
+    def load(self, name):
+        with self._lock:
+            module = sys.modules.get(name)
+            if module is None:
+                module = importlib.import_module(name)
+            else:
+                graph = self._graphs.get(name) or self._graph(module)
+                try:
+                    changed = [m for m in graph if self._is_changed(m)]
+                    for m in self._affected(graph, changed):
+                        reload(sys.modules[m])
+                finally:
+                    # record failed reloads too, the next change retries
+                    self._record(graph)
+                module = sys.modules[name]
+
+            self._graphs[name] = self._graph(module)
+            self._record(self._graphs[name])
+            return module
+
+    def changed(self, name):
+        """Returns True if the module or one of its local
+           imports changed since it was last loaded"""
+        with self._lock:
+            if name not in self._graphs:
+                return True
+            return any(self._is_changed(m) for m in self._graphs[name])
+
+    def _record(self, graph):
+        for m in graph:
+            if m in sys.modules:
+                self._mtimes[m] = self._mtime(sys.modules[m])
+
+    def _is_changed(self, name):
+        module = sys.modules.get(name)
+        return module is None or self._mtimes.get(name) != self._mtime(module)
+
+    def _graph(self, module):
+        """Maps the module and every local module it imports,
+           directly or transitively, to their local imports"""
+        root = self._root(module)
+        graph = dict()
+        stack = [module]
+        while stack:
+            m = stack.pop()
+            if m.__name__ in graph:
+                continue
+            deps = set()
+            for value in vars(m).values():
+                dep = value if isinstance(value, types.ModuleType) \
+                    else sys.modules.get(getattr(value, '__module__', None))
+                if dep is not None and dep is not m \
+                        and self._is_local(dep, root):
+                    deps.add(dep.__name__)
+                    stack.append(dep)
+            graph[m.__name__] = deps
+        return graph
+
+    def _affected(self, graph, changed):
+        """Returns the changed modules and everything importing them,
+           ordered so modules are reloaded before their importers"""
+        dependents = collections.defaultdict(set)
+        for m, deps in graph.iteritems():
+            for d in deps:
+                dependents[d].add(m)
+
+        affected = set()
+        stack = list(changed)
+        while stack:
+            m = stack.pop()
+            if m not in affected:
+                affected.add(m)
+                stack.extend(dependents[m])
+
+        order = []
+        visited = set()
+
+        def _visit(m):
+            if m not in visited:
+                visited.add(m)
+                for d in sorted(graph.get(m, [])):
+                    _visit(d)
+                if m in affected:
+                    order.append(m)
+
+        for m in sorted(graph):
+            _visit(m)
+
+        return order
+
+    def _root(self, module):
+        # the directory the top level package of the module lives in
+        path = source_path(module)
+        if path is None:
+            return None
+        depth = len(module.__name__.split('.'))
+        if os.path.basename(path).startswith('__init__.'):
+            depth += 1
+        for _ in range(depth):
+            path = os.path.dirname(path)
+        return path
+
+    def _is_local(self, module, root):
+        path = source_path(module)
+        return root is not None and path is not None \
+            and path.startswith(root + os.sep) \
+            and 'site-packages' not in path \
+            and not module.__name__.startswith(self.ignored)
+
+    def _mtime(self, module):
+        path = source_path(module)
+        try:
+            return os.stat(path).st_mtime if path is not None else None
+        except OSError:
+            return None
+
+
+def source_path(module):
+    """Returns the python source file for a module or None"""
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    return path
+
+
+_reloader = ModuleReloader()
+
+# templates are built against module level state in troposphere_ext
+# so only one template can be generated at a time per process
+_generate_lock = threading.RLock()
+
+# event history Tropext instances record stack events to, see use_history
+_history = None
+
+
+def use_history(history):
+    """Sets the event history every Tropext records the stack events it
+       sees to, None stops recording"""
+    global _history
+    _history = history
+
 
 class Tropext(object):
 
-    def __init__(self, log, stack_name, namespace, region='us-west-2'):
+    def __init__(self, log, stack_name, namespace, region='us-west-2',
+                 reloader=None, storage=None, history=None, artifacts=None,
+                 from_artifacts=False):
         self._region = region
+        self._artifacts = artifacts
+        self._from_artifacts = from_artifacts
+        self._history = _history if history is None else history
+        self._storage = storage
         self._stack_name = stack_name
         self._namespace = namespace
-        self._conn = boto.cloudformation.connect_to_region(region)
+        self._conn = connect(region)
         self._log = log
-
-    def generate(self, template_name, template_args):
-        """Creates a Cloud Formation JSON file from a Troposphere template"""
+        self._reloader = _reloader if reloader is None else reloader
+
+    def generate(self, template_name, template_args, validate=True,
+                 format='json'):
+        """Creates a Cloud Formation JSON or YAML file from a Troposphere
+           template. Returns None when the template fails validation."""
+        with _generate_lock:
+            body = self._generate(template_name, template_args, format)
+
+        if body is not None and validate:
+            errors = self.validate(body, format)
+            if errors:
+                for error in errors:
+                    self._log.error("Template '{}' is invalid: {}"
+                                    .format(template_name, error))
+                return None
+
+        if body is not None and self._artifacts is not None and \
+                not self._from_artifacts:
+            path, changed = self._artifacts.write(
+                self._namespace, self._stack_name, self._region, body)
+            self._log.info("{} '{}'".format(
+                'Wrote' if changed else 'Unchanged', path))
+
+        return body
+
+    def validate(self, body, format='json'):
+        """Validates a generated template body offline. Returns the list
+           of errors, empty when the template is valid. The body may be
+           as large as a template stored in a bucket allows, a body over
+           the inline limit is only an error when a stack is created or
+           updated without a storage."""
+        start = time.time()
+        template = cfyaml.loads(body) if format == 'yaml' \
+            else json.loads(body)
+        warnings = []
+        errors = validator.validate(template, body, validator.URL_LIMITS,
+                                    warnings)
+        if self._storage is None and \
+                len(body) > validator.LIMITS['body']:
+            warnings.append('Template body is {} bytes, over {} it is '
+                            'only deployed through a template bucket'
+                            .format(len(body), validator.LIMITS['body']))
+        for warning in warnings:
+            self._log.warn("Template may be invalid: {}".format(warning))
+        self._log.debug("Validated template in {:.1f}ms"
+                        .format((time.time() - start) * 1000))
+        return errors
+
+    def _generate(self, template_name, template_args, format='json'):
         try:
             self._log.debug("Loading template '{}'".format(template_name))
 
             # attempt to an existing template module by name
-            template = importlib.import_module(template_name)
+            template = self._reloader.load(template_name)
 
             # get matching namespaced stack name for parent
             # if the parent name was specified
@@ -58,7 +294,26 @@ class Tropext(object):
                                     self._namespace, template_args))
 
             # generate cloud formation JSON string from Troposphere DSL
-            return template.create(**template_args).to_json()
+            generated = template.create(**template_args)
+            body = generated.to_yaml() if format == 'yaml' \
+                else generated.to_json()
+
+            for title, counts in sorted(getattr(generated, 'rule_counts',
+                                                {}).iteritems()):
+                for name, (before, after) in sorted(counts.iteritems()):
+                    if before != after:
+                        self._log.info("Compacted {} of '{}' from {} to {} "
+                                       "rules".format(name, title, before,
+                                                      after))
+
+            groups = getattr(generated, 'record_groups', {})
+            if groups:
+                packed = sum(len(titles) for titles in groups.itervalues())
+                self._log.info("Packed {} record sets into {} record set "
+                               "groups, {} fewer resources"
+                               .format(packed, len(groups),
+                                       packed - len(groups)))
+            return body
 
         except ImportError as e:
             self._log.exception("Unable to load specified template '{}'"
@@ -66,6 +321,36 @@ class Tropext(object):
 
         return None
 
+    def watch_files(self, template_name, template_args=None,
+                    interval=0.2, validate=True, format='json'):
+        """Generates the template and generates it again every time the
+           template module or one of its local imports changes. Returns
+           a Generator of the generated templates."""
+
+        template_args = {} if template_args is None else template_args
+
+        while 1:
+            try:
+                start = time.time()
+                template = self.generate(template_name, dict(template_args),
+                                         validate, format)
+                self._log.info("Generated template '{}' in {:.0f}ms, "
+                               "watching for changes."
+                               .format(template_name,
+                                       (time.time() - start) * 1000))
+                yield template
+            except Exception as e:
+                self._log.exception("Error generating template '{}', "
+                                    "error was '{}'"
+                                    .format(template_name, str(e)))
+
+            if template_name not in sys.modules:
+                # nothing was ever imported so there is nothing to watch
+                return
+
+            while not self._reloader.changed(template_name):
+                time.sleep(interval)
+
     def diff(self, template_name, template_args=None):
         """Creates differences between the current
             and previous stack"""
@@ -77,12 +362,11 @@ class Tropext(object):
             self._log.warn("Stack '{}' doesn't, nothing to diff."
                            .format(self.__get_fq_stack_name()))
         else:
-            prev_template = existing_stack.get_template() \
-                .get('GetTemplateResponse') \
-                .get('GetTemplateResult') \
-                .get('TemplateBody')
+            prev_template = self.get_template(existing_stack.stack_id)
 
-            current_template = self.generate(template_name, template_args)
+            current_template = self.__body(template_name, template_args)
+            if current_template is None:
+                return None
             return [line for line in
                     difflib.unified_diff(prev_template.splitlines(),
                                          current_template.splitlines(),
@@ -106,17 +390,22 @@ class Tropext(object):
             return None
         else:
             try:
-                template_body = self.generate(template_name, template_args)
+                template_body = self.__body(template_name, template_args)
+                if template_body is None:
+                    return None
                 self._log.debug('Creating stack {} from template {}, '
                                 'body is:\n{}'.format(fq_stack_name,
                                                       template_name,
                                                       template_body))
 
+                template = self.__template(template_body)
+                # the namespace tag tells stacks of dev and dev-eu apart
+                tags = {'creator': creator,
+                        api.NAMESPACE_TAG: self._namespace}
                 return self._conn.create_stack(fq_stack_name,
-                                               template_body=template_body,
                                                parameters=template_params,
                                                capabilities=['CAPABILITY_IAM'],
-                                               tags={'creator': creator})
+                                               tags=tags, **template)
             except Exception as e:
                 self._log.exception("Error creating stack '{}' from template "
                                     "'{}', error was '{}'"
@@ -127,9 +416,10 @@ class Tropext(object):
             return None
 
     def update(self, template_name, template_args=None,
-               template_params=None):
+               template_params=None, unchanged=None):
         """Updates a stack and returns the stack ID or None
-           if there was an error"""
+           if there was an error, unchanged when neither the
+           template nor the parameters changed"""
 
         template_args = {} if template_args is None else template_args
         template_params = [] if template_params is None \
@@ -143,20 +433,25 @@ class Tropext(object):
             return None
         else:
             try:
-                template_body = self.generate(template_name, template_args)
+                template_body = self.__body(template_name, template_args)
+                if template_body is None:
+                    return None
                 self._log.debug('Updating stack {} from template {}, '
                                 'body is:\n{}'.format(fq_stack_name,
                                                       template_name,
                                                       template_body))
+                template = self.__template(template_body)
                 return self._conn.update_stack(fq_stack_name,
-                                               template_body=template_body,
                                                parameters=template_params,
-                                               capabilities=['CAPABILITY_IAM'])
+                                               capabilities=['CAPABILITY_IAM'],
+                                               **template)
             except BotoServerError as be:
                 error = json.loads(be.body)['Error']
                 code = error['Code']
                 message = error['Message']
                 self._log.warn('{code}: {message}'.format(**locals()))
+                if code == 'ValidationError' and message == NO_UPDATES:
+                    return unchanged
             except Exception as e:
                 self._log.exception("Error updating stack '{}' from template "
                                     "'{}', error was '{}'"
@@ -165,6 +460,23 @@ class Tropext(object):
 
             return None
 
+    def delete(self):
+        """Deletes the stack and returns its stack ID, which its events
+           can still be read with once it is gone, or None if there was
+           an error"""
+        fq_stack_name = self.__get_fq_stack_name()
+        existing = self.__get_existing_stack()
+        if existing is None:
+            self._log.warn("Stack '{}' doesn't exist.".format(fq_stack_name))
+            return None
+        try:
+            self._conn.delete_stack(fq_stack_name)
+            return existing.stack_id
+        except BotoServerError as be:
+            self._log.warn("Unable to delete stack '{}': {}"
+                           .format(fq_stack_name, api.error_code(be)))
+        return None
+
     def get_events(self):
         """Get the events in batches and return in
            chronological order"""
@@ -177,14 +489,24 @@ class Tropext(object):
             if events.next_token is None:
                 break
             next = events.next_token
-            time.sleep(1)
 
-        return reversed(sum(event_list, []))
-
-    def watch(self, fetch):
+        events = list(reversed(sum(event_list, [])))
+        if self._history is not None:
+            try:
+                self._history.record(self._namespace, self._stack_name,
+                                     self._region, events)
+            except Exception:
+                self._log.exception("Unable to record events of stack "
+                                    "'{}'".format(fq_stack_name))
+        return events
+
+    def watch(self, fetch, fail_fast=False):
         """Watches a Cloud Formation stack for events and
-           returns a Generator for consuming the events."""
+           returns a Generator for consuming the events. With fail_fast
+           the first failed resource cancels an update, whose rollback
+           is then watched, or stops watching a create."""
         seen = set()
+        failing = False
         if fetch:
             # fetch previous events
             initial_events = self.get_events()
@@ -196,19 +518,108 @@ class Tropext(object):
         complete = False
         while 1:
             events = self.get_events()
+            # failures of earlier operations are not a reason to fail fast
+            operation = timeline.last_operation(events,
+                                                self.__get_fq_stack_name())
+            current = set(e.event_id for e in operation)
             for e in events:
                 if e.event_id not in seen:
                     yield e
                     seen.add(e.event_id)
 
-            # exit loop on cloud formation complete or failed event
-            if (e.resource_type == 'AWS::CloudFormation::Stack' and
-                ('COMPLETE' in e.resource_status or
-                 'FAILED' in e.resource_status)):
+                    if fail_fast and not failing and \
+                            e.event_id in current and timeline.failed(e):
+                        failing = True
+                        if not self.__fail_fast(
+                                e, operation[0].resource_status):
+                            return
+
+            # exit loop once the stack itself reached a final status
+            if events and timeline.finished(events[-1],
+                                            self.__get_fq_stack_name()):
                 break
 
             time.sleep(5)
 
+    def cancel_update(self):
+        """Cancels the update in progress, Cloud Formation rolls the stack
+           back to its previous template"""
+        fq_stack_name = self.__get_fq_stack_name()
+        try:
+            self._conn.cancel_update_stack(fq_stack_name)
+            return True
+        except BotoServerError as be:
+            self._log.warn("Unable to cancel the update of stack '{}': {}"
+                           .format(fq_stack_name, api.error_code(be)))
+        return False
+
+    def __fail_fast(self, event, operation):
+        """Reacts to the first failed resource of an operation, operation
+           is the status that started it. Returns False when there is
+           nothing left worth watching."""
+        self._log.warn("{} {}: {}".format(event.logical_resource_id,
+                                          event.resource_status,
+                                          event.resource_status_reason))
+        if operation == 'UPDATE_IN_PROGRESS':
+            # an update already rolling back has nothing left to cancel
+            if self.status() == 'UPDATE_IN_PROGRESS':
+                self._log.warn("Cancelling the update of stack '{}'"
+                               .format(self.__get_fq_stack_name()))
+                self.cancel_update()
+            return True
+        if operation == 'CREATE_IN_PROGRESS':
+            self._log.warn("Stack '{}' failed to create, no longer "
+                           "waiting for its rollback"
+                           .format(self.__get_fq_stack_name()))
+            return False
+        return True
+
+    def get_template(self, stack=None):
+        """Returns the template body of the deployed stack"""
+        stack = self.__get_fq_stack_name() if stack is None else stack
+        # through the connection rather than the stack object so the
+        # call is rate limited
+        return self._conn.get_template(stack) \
+            .get('GetTemplateResponse') \
+            .get('GetTemplateResult') \
+            .get('TemplateBody')
+
+    @property
+    def fq_stack_name(self):
+        """Name of the stack in Cloud Formation and the logical id its own
+           events carry"""
+        return self.__get_fq_stack_name()
+
+    def status(self):
+        """Returns the status of the stack or None if it doesn't exist"""
+        existing = self.__get_existing_stack()
+        return None if existing is None else existing.stack_status
+
+    def final_status(self, interval=5):
+        """Waits until no operation is in progress on the stack and
+           returns its status, None if it doesn't exist"""
+        status = self.status()
+        while status is not None and not timeline.terminal(status):
+            time.sleep(interval)
+            status = self.status()
+        return status
+
+    def __template(self, template_body):
+        """Returns the create and update stack arguments for a template,
+           the body inline or the URL it was stored under when there is
+           a storage"""
+        if self._storage is None:
+            if len(template_body) > validator.LIMITS['body']:
+                raise ValueError('Template body is {} bytes, the limit '
+                                 'without a template bucket is {}'
+                                 .format(len(template_body),
+                                         validator.LIMITS['body']))
+            return {'template_body': template_body}
+
+        template_url = self._storage.put(template_body)
+        self._log.debug("Stored template as '{}'".format(template_url))
+        return {'template_url': template_url}
+
     def __get_existing_stack(self):
         fq_stack_name = self.__get_fq_stack_name()
         try:
@@ -222,9 +633,17 @@ class Tropext(object):
 
         return None
 
-    def __get_template_path(self):
-        return os.path.join(self._template_dir,
-                            '{}.json'.format(self.__get_fq_stack_name()))
+    def __body(self, template_name, template_args):
+        """Returns the template body to deploy or diff, generated or read
+           from the artifact directory"""
+        if not self._from_artifacts:
+            return self.generate(template_name, template_args)
+        try:
+            return self._artifacts.read(self._namespace, self._stack_name,
+                                        self._region)
+        except (LookupError, ValueError) as e:
+            self._log.error(str(e))
+            return None
 
     def __get_fq_stack_name(self, stack_name=None, namespace=None):
         if namespace is None:
@@ -238,3 +657,21 @@ class Tropext(object):
 def camel_to_snake(value):
     split = re.split(r'([A-Z][^A-Z]*)', value)
     return '_'.join(filter(None, split)).lower()
+
+
+def intern_str(value):
+    """Interns byte strings so repeated titles and tag
+       values share a single copy"""
+    return intern(value) if type(value) is str else value
+
+
+def plain(value):
+    """Resolves troposphere objects and helper functions in
+       value to plain dicts, lists and scalars"""
+    while hasattr(value, 'JSONrepr'):
+        value = value.JSONrepr()
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.iteritems()}
+    elif isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    return value
@@ -0,0 +1,155 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import json
+
+from troposphere_ext.graph import DependencyGraph, references, depends_on
+
+# service limits Cloud Formation enforces on a template
+LIMITS = {
+    'Parameters': 60,
+    'Outputs': 60,
+    'Mappings': 100,
+    'Resources': 200,
+    'title': 255,
+    'body': 51200,
+    # body limit of a template uploaded to S3 and passed as a TemplateURL
+    'url_body': 460800,
+}
+
+# limits of a template uploaded to S3 and passed as a TemplateURL
+URL_LIMITS = dict(LIMITS, body=LIMITS['url_body'])
+
+PSEUDO_PARAMETERS = frozenset([
+    'AWS::AccountId',
+    'AWS::NotificationARNs',
+    'AWS::NoValue',
+    'AWS::Region',
+    'AWS::StackId',
+    'AWS::StackName',
+])
+
+# attributes Fn::GetAtt accepts per resource type. types that are not
+# listed are not checked. Cloud Formation adds attributes over time so
+# one that is not listed is only a warning.
+ATTRIBUTES = dict((t, frozenset(a)) for t, a in {
+    'AWS::AutoScaling::AutoScalingGroup': [],
+    'AWS::AutoScaling::LaunchConfiguration': [],
+    'AWS::CloudFormation::WaitCondition': ['Data'],
+    'AWS::CloudFront::Distribution': ['DomainName'],
+    'AWS::DynamoDB::Table': ['StreamArn'],
+    'AWS::EC2::EIP': ['AllocationId'],
+    'AWS::EC2::Instance': ['AvailabilityZone', 'PrivateDnsName',
+                           'PrivateIp', 'PublicDnsName', 'PublicIp'],
+    'AWS::EC2::InternetGateway': [],
+    'AWS::EC2::NetworkAcl': [],
+    'AWS::EC2::NetworkInterface': ['PrimaryPrivateIpAddress',
+                                   'SecondaryPrivateIpAddresses'],
+    'AWS::EC2::RouteTable': [],
+    'AWS::EC2::SecurityGroup': ['GroupId'],
+    'AWS::EC2::Subnet': ['AvailabilityZone'],
+    'AWS::EC2::Volume': [],
+    'AWS::EC2::VPC': ['CidrBlock', 'DefaultNetworkAcl',
+                      'DefaultSecurityGroup'],
+    'AWS::ElastiCache::CacheCluster': ['ConfigurationEndpoint.Address',
+                                       'ConfigurationEndpoint.Port',
+                                       'RedisEndpoint.Address',
+                                       'RedisEndpoint.Port'],
+    'AWS::ElasticLoadBalancing::LoadBalancer': [
+        'CanonicalHostedZoneName', 'CanonicalHostedZoneNameID',
+        'DNSName', 'SourceSecurityGroup.GroupName',
+        'SourceSecurityGroup.OwnerAlias'],
+    'AWS::IAM::AccessKey': ['SecretAccessKey'],
+    'AWS::IAM::Group': ['Arn'],
+    'AWS::IAM::InstanceProfile': ['Arn'],
+    'AWS::IAM::Role': ['Arn'],
+    'AWS::IAM::User': ['Arn'],
+    'AWS::Kinesis::Stream': ['Arn'],
+    'AWS::Lambda::Function': ['Arn'],
+    'AWS::RDS::DBInstance': ['Endpoint.Address', 'Endpoint.Port'],
+    'AWS::Redshift::Cluster': ['Endpoint.Address', 'Endpoint.Port'],
+    'AWS::Route53::HostedZone': ['NameServers'],
+    'AWS::S3::Bucket': ['Arn', 'DomainName', 'WebsiteURL'],
+    'AWS::SNS::Topic': ['TopicName'],
+    'AWS::SQS::Queue': ['Arn', 'QueueName'],
+}.iteritems())
+
+
+def validate(template, body=None, limits=LIMITS, warnings=None):
+    """Validates a rendered template dict the way Cloud Formation would
+       before creating a stack. Returns a sorted list of errors, empty
+       when the template is valid. Problems that may be false positives,
+       like Fn::GetAtt attributes missing from ATTRIBUTES, are appended
+       to the warnings list when one is given."""
+    errors = []
+
+    if body is None:
+        body = json.dumps(template, separators=(',', ':'))
+    if len(body) > limits['body']:
+        errors.append("Template body is {} bytes, the limit is {}"
+                      .format(len(body), limits['body']))
+
+    for section in ['Parameters', 'Outputs', 'Mappings', 'Resources']:
+        values = template.get(section, {})
+        if len(values) > limits[section]:
+            errors.append("{} has {} entries, the limit is {}"
+                          .format(section, len(values), limits[section]))
+        for title in values:
+            if len(title) > limits['title']:
+                errors.append("{} title '{}...' is longer than {} "
+                              "characters".format(section, title[:32],
+                                                  limits['title']))
+
+    resources = template.get('Resources', {})
+    parameters = template.get('Parameters', {})
+
+    def _check(where, value, refs):
+        for kind, target, attr in references(value):
+            if kind == 'Ref':
+                if target not in refs and target not in PSEUDO_PARAMETERS:
+                    errors.append("{}: Ref to unknown '{}'"
+                                  .format(where, target))
+            elif target not in resources:
+                errors.append("{}: Fn::GetAtt of unknown resource '{}'"
+                              .format(where, target))
+            else:
+                _check_attribute(where, resources[target], target, attr)
+
+    def _check_attribute(where, resource, target, attr):
+        resource_type = resource.get('Type', '')
+        if resource_type == 'AWS::CloudFormation::Stack':
+            if not attr.startswith('Outputs.'):
+                errors.append("{}: Fn::GetAtt of nested stack '{}' must "
+                              "be an Outputs attribute, not '{}'"
+                              .format(where, target, attr))
+        elif resource_type in ATTRIBUTES \
+                and attr not in ATTRIBUTES[resource_type] \
+                and warnings is not None:
+            warnings.append("{}: {} '{}' has no known attribute '{}'"
+                            .format(where, resource_type, target, attr))
+
+    refs = set(resources) | set(parameters)
+
+    for title, resource in resources.iteritems():
+        _check(title, resource, refs)
+        for target in depends_on(resource):
+            if target not in resources:
+                errors.append("{}: DependsOn unknown resource '{}'"
+                              .format(title, target))
+
+    for title, output in template.get('Outputs', {}).iteritems():
+        _check('Outputs.{}'.format(title), output, refs)
+
+    # conditions can only refer to parameters
+    for title, condition in template.get('Conditions', {}).iteritems():
+        _check('Conditions.{}'.format(title), condition, parameters)
+
+    for cycle in DependencyGraph(template).cycles():
+        errors.append("Circular dependency between resources {}"
+                      .format(', '.join(cycle)))
+
+    if warnings is not None:
+        warnings.sort()
+    return sorted(errors)
@@ -0,0 +1,291 @@
+#
+#    Copyright (C) 2015 Lance Linder
+#
+
+
+import json
+import contextlib
+
+import troposphere_ext
+from troposphere_ext import utils, cfyaml
+from troposphere_ext.graph import depends_on
+
+SECTIONS = ['Conditions', 'Mappings', 'Outputs', 'Parameters', 'Resources']
+
+
+class Fragment(object):
+    """A rendered template entry along with the paths of every Ref and
+       Fn::GetAtt in it, so a variant only copies what it changes"""
+
+    __slots__ = ('value', 'references', 'name_tag', 'stacks')
+
+    def __init__(self, value, stacks=()):
+        self.value = value
+        # (path, kind, target, attribute) tuples
+        self.references = list(_references(value, ()))
+        self.name_tag = _name_tag(value)
+        # stacks the entry references with SRef, it is rendered again
+        # for variants that rename them
+        self.stacks = frozenset(stacks)
+
+
+def _references(value, path):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if isinstance(value.get('Ref'), basestring):
+                yield path, 'Ref', value['Ref'], None
+                return
+            get_att = value.get('Fn::GetAtt')
+            if isinstance(get_att, list) and len(get_att) == 2:
+                yield path, 'GetAtt', get_att[0], get_att[1]
+                return
+        for k, v in value.iteritems():
+            for reference in _references(v, path + (k,)):
+                yield reference
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            for reference in _references(v, path + (i,)):
+                yield reference
+
+
+def _name_tag(value):
+    """Returns the path of the Name tag value of a rendered resource"""
+    tags = value.get('Properties', {}).get('Tags') \
+        if isinstance(value, dict) else None
+    if isinstance(tags, list):
+        for i, tag in enumerate(tags):
+            if isinstance(tag, dict) and tag.get('Key') == 'Name':
+                return ('Properties', 'Tags', i, 'Value')
+    return None
+
+
+class _Copier(object):
+    """Sets values deep inside a rendered fragment by copying only the
+       containers on the way, everything else stays shared"""
+
+    def __init__(self):
+        self._copied = set()
+
+    def copy(self, container):
+        if id(container) in self._copied:
+            return container
+        container = dict(container) if isinstance(container, dict) \
+            else list(container)
+        self._copied.add(id(container))
+        return container
+
+    def set(self, root, path, value):
+        if not path:
+            return value
+        root = self.copy(root)
+        node = root
+        for key in path[:-1]:
+            node[key] = self.copy(node[key])
+            node = node[key]
+        node[path[-1]] = value
+        return root
+
+
+@contextlib.contextmanager
+def _rendering(template):
+    # TRef and TGetAtt resolve against the current template
+    previous = troposphere_ext._template
+    troposphere_ext._template = template
+    try:
+        yield
+    finally:
+        troposphere_ext._template = previous
+
+
+def fragments(template):
+    """Renders every entry of a template once. Returns a dict of
+       (section, title) to Fragment."""
+    SRef = troposphere_ext.SRef
+    result = dict()
+    with _rendering(template):
+        for section, entries in template._sections().iteritems():
+            for title, entry in entries.iteritems():
+                stacks = set()
+                SRef.record(stacks)
+                try:
+                    value = utils.plain(entry)
+                finally:
+                    SRef.record(None)
+                if stacks:
+                    # recorded SRefs render as placeholders
+                    value = utils.plain(entry)
+                result[(section, title)] = Fragment(value, stacks)
+    return result
+
+
+class Variant(object):
+    """A template derived from a built one for another environment. The
+       rendered entries of the template are shared and only the title
+       prefix, Name tags, references to renamed resources and the given
+       properties are changed. Entries that reference stacks of renamed
+       namespaces with SRef are rendered again."""
+
+    def __init__(self, template, name, properties=None, defaults=None,
+                 namespaces=None):
+        self._template = template
+        self._name = name
+        self._properties = dict()
+        for title, values in (properties or {}).iteritems():
+            self._properties[self._base_title(title)] = values
+        self._defaults = defaults or {}
+        for title in self._defaults:
+            if title not in template._parameters:
+                raise LookupError("Template '{}' has no parameter '{}'"
+                                  .format(template._name, title))
+        self._namespaces = namespaces or {}
+        self.rule_counts = dict()
+        self.record_groups = dict()
+
+    def _base_title(self, title):
+        resources = self._template._resources
+        for candidate in ['{}{}'.format(self._template._name, title), title]:
+            if candidate in resources:
+                return candidate
+        raise LookupError("Template '{}' has no resource '{}'"
+                          .format(self._template._name, title))
+
+    def title(self, title):
+        """Returns the variant title of a resource of the template"""
+        return self._title(title, self._lengths())
+
+    def _lengths(self):
+        return set(len(t) for t in self._template._resources)
+
+    def _title(self, title, lengths):
+        """Returns the title a build of the template under the variant
+           name gives a resource. The template name prefix is swapped.
+           Titles that already held the name were not prefixed, the
+           titles of other resources they are built from, like the
+           subnet of an association, are swapped in them instead and
+           the name is only added when none was."""
+        old = self._template._name
+        if title in self._template._unprefixed:
+            title = self._embedded(title, lengths)
+        elif title.startswith(old):
+            title = title[len(old):]
+        else:
+            return title
+        if self._name in title:
+            return title
+        return '{}{}'.format(self._name, title)
+
+    def _embedded(self, title, lengths):
+        """Swaps the template name where a registered title other than
+           title itself starts"""
+        old = self._template._name
+        resources = self._template._resources
+        parts = []
+        start = 0
+        i = title.find(old)
+        while i != -1:
+            if any(title[i:i + length] in resources and
+                   title[i:i + length] != title for length in lengths):
+                parts.append(title[start:i])
+                parts.append(self._name)
+                start = i + len(old)
+                i = title.find(old, start)
+            else:
+                i = title.find(old, i + 1)
+        parts.append(title[start:])
+        return ''.join(parts)
+
+    def _stack(self, stack_name):
+        for old, new in self._namespaces.iteritems():
+            prefix = '{}-'.format(old)
+            if stack_name.startswith(prefix):
+                return '{}-{}'.format(new, stack_name[len(prefix):])
+        return stack_name
+
+    def _fragment(self, section, title, fragment):
+        """Returns the fragment, rendered again when it references a
+           stack this variant renames"""
+        renamed = dict((name, self._stack(name))
+                       for _, name in fragment.stacks)
+        if all(old == new for old, new in renamed.iteritems()):
+            return fragment
+        SRef = troposphere_ext.SRef
+        entry = self._template._sections()[section][title]
+        SRef.rename(renamed)
+        try:
+            with _rendering(self._template):
+                return Fragment(utils.plain(entry))
+        finally:
+            SRef.rename(None)
+
+    def to_dict(self):
+        template = self._template
+        cached = template._fragments()
+        lengths = self._lengths()
+        renamed = dict((title, self._title(title, lengths))
+                       for title in template._resources)
+        t = template._header()
+        for section in SECTIONS:
+            t[section] = dict()
+
+        for (section, title), fragment in cached.iteritems():
+            fragment = self._fragment(section, title, fragment)
+            copier = _Copier()
+            value = fragment.value
+            for path, kind, target, attribute in fragment.references:
+                if renamed.get(target, target) == target:
+                    continue
+                target = renamed[target]
+                value = copier.set(value, path, {'Ref': target}
+                                   if kind == 'Ref'
+                                   else {'Fn::GetAtt': [target, attribute]})
+
+            if section == 'Resources':
+                value = self._resource(title, value, fragment, renamed,
+                                       copier)
+                title = renamed[title]
+            elif section == 'Parameters' and title in self._defaults:
+                value = copier.set(value, ('Default',),
+                                   utils.plain(self._defaults[title]))
+            t[section][title] = value
+
+        # the render time passes change these in place
+        t['Mappings'] = dict(t['Mappings'])
+        if template._compact_rules:
+            for title, resource in t['Resources'].items():
+                t['Resources'][title] = dict(
+                    resource, Properties=dict(resource.get('Properties',
+                                                           {})))
+        t = template._resolve(t, self._name)
+        self.rule_counts = template.rule_counts
+        self.record_groups = template.record_groups
+        return t
+
+    def _resource(self, title, value, fragment, renamed, copier):
+        targets = depends_on(value)
+        if any(renamed.get(t, t) != t for t in targets):
+            value = copier.set(value, ('DependsOn',),
+                               [renamed.get(t, t) for t in targets]
+                               if isinstance(value['DependsOn'], list)
+                               else renamed.get(targets[0], targets[0]))
+
+        path = fragment.name_tag
+        if path is not None and renamed[title] != title and \
+                value['Properties']['Tags'][path[2]]['Value'] == \
+                utils.camel_to_snake(title):
+            value = copier.set(value, path, utils.intern_str(
+                utils.camel_to_snake(renamed[title])))
+
+        properties = self._properties.get(title, {})
+        if properties and 'Properties' not in value:
+            value = copier.set(value, ('Properties',), dict())
+        for name, property_value in properties.iteritems():
+            value = copier.set(value, ('Properties', name),
+                               utils.plain(property_value))
+        return value
+
+    def to_json(self, indent=2, sort_keys=True, separators=(', ', ': ')):
+        return json.dumps(self.to_dict(), indent=indent,
+                          sort_keys=sort_keys, separators=separators)
+
+    def to_yaml(self):
+        return cfyaml.dumps(self.to_dict())